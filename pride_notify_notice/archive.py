@@ -0,0 +1,261 @@
+import fcntl
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+
+# Every payload fetched from the ESB is kept gzipped under
+# `directory`/objects/<sha256[:2]>/<sha256>.json.gz, so a payload fetched
+# twice is stored once. `directory`/index/<YYYY-MM-DD>.jsonl records which
+# feed fetched which payload when. Index days older than `retention_days`
+# are dropped by `prune()`, together with the payloads nothing else uses.
+# Filing a payload and pruning both hold an exclusive flock on
+# `directory`/.lock, so a prune never sees an object whose index line is
+# not written yet, across threads and worker processes alike.
+DEFAULT_ESB_ARCHIVE = {
+    'enabled': False,
+    'directory': os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'var', 'esb_archive'),
+    'retention_days': 30,
+}
+
+
+def get_archive_config():
+    config = dict(DEFAULT_ESB_ARCHIVE)
+    config.update(getattr(settings, 'ESB_ARCHIVE', {}))
+    return config
+
+
+class _ArchiveWriter:
+    """Binary sink that hashes and gzips a payload, then files it in the archive."""
+
+    def __init__(self, archive, feed_name, params=None):
+        self.archive = archive
+        self.feed_name = feed_name
+        self.params = params
+        self.size = 0
+        self._digest = hashlib.sha256()
+        os.makedirs(archive.objects_dir, exist_ok=True)
+        fd, self._tmp_path = tempfile.mkstemp(dir=archive.objects_dir, suffix='.tmp')
+        self._raw = os.fdopen(fd, 'wb')
+        self._gzip = gzip.GzipFile(fileobj=self._raw, mode='wb', compresslevel=6)
+
+    def write(self, data):
+        self._digest.update(data)
+        self.size += len(data)
+        self._gzip.write(data)
+
+    def commit(self):
+        self._gzip.close()
+        self._raw.close()
+        digest = self._digest.hexdigest()
+        path = self.archive.object_path(digest)
+        with self.archive.locked():
+            if os.path.exists(path):
+                os.unlink(self._tmp_path)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(self._tmp_path, path)
+            self.archive.record(self.feed_name, digest, self.size, self.params)
+        return digest
+
+    def discard(self):
+        self._gzip.close()
+        self._raw.close()
+        os.unlink(self._tmp_path)
+
+
+class _TeeReader:
+    """Wraps a streamed response body, copying what is read into an archive writer.
+
+    The payload is filed by `finish()`, once the parser is done with it.
+    """
+
+    def __init__(self, raw, writer):
+        self._raw = raw
+        self._writer = writer
+        self._done = False
+
+    def read(self, size=-1):
+        data = self._raw.read(size)
+        if data:
+            self._writer.write(data)
+        return data
+
+    def finish(self):
+        """Read whatever the parser left unread and file the payload."""
+        if self._done:
+            return
+        for chunk in iter(lambda: self._raw.read(64 * 1024), b''):
+            self._writer.write(chunk)
+        self._done = True
+        self._writer.commit()
+
+    def close(self):
+        """Drop a payload that was not read to the end."""
+        if not self._done:
+            self._done = True
+            self._writer.discard()
+
+
+class PayloadArchive:
+    """Content-addressed, compressed archive of raw ESB payloads."""
+
+    def __init__(self, directory, retention_days=30):
+        self.directory = str(directory)
+        self.retention_days = retention_days
+        self.objects_dir = os.path.join(self.directory, 'objects')
+        self.index_dir = os.path.join(self.directory, 'index')
+        self.lock_path = os.path.join(self.directory, '.lock')
+
+    @contextmanager
+    def locked(self):
+        """Hold the archive-wide file lock. Not reentrant: flock locks are per open file."""
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.lock_path, 'a') as fh:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+    def object_path(self, digest):
+        return os.path.join(self.objects_dir, digest[:2], f"{digest}.json.gz")
+
+    def writer(self, feed_name, params=None):
+        return _ArchiveWriter(self, feed_name, params)
+
+    def store_bytes(self, feed_name, data, params=None):
+        """Archive one payload held in memory and return its digest."""
+        writer = self.writer(feed_name, params)
+        try:
+            writer.write(data)
+        except BaseException:
+            writer.discard()
+            raise
+        return writer.commit()
+
+    def store_gzip_file(self, feed_name, path, params=None):
+        """Archive a payload that is already on disk gzipped (a snapshot)."""
+        writer = self.writer(feed_name, params)
+        try:
+            with gzip.open(path, 'rb') as fh:
+                for chunk in iter(lambda: fh.read(64 * 1024), b''):
+                    writer.write(chunk)
+        except BaseException:
+            writer.discard()
+            raise
+        return writer.commit()
+
+    def tee(self, feed_name, raw, params=None):
+        return _TeeReader(raw, self.writer(feed_name, params))
+
+    def record(self, feed_name, digest, size, params=None):
+        """Append an index line. Callers filing an object hold `locked()`."""
+        entry = {
+            'feed': feed_name,
+            'digest': digest,
+            'bytes': size,
+            'fetched_at': timezone.localtime().isoformat(),
+            'params': params or None,
+        }
+        os.makedirs(self.index_dir, exist_ok=True)
+        index_path = os.path.join(self.index_dir, f"{timezone.localdate().isoformat()}.jsonl")
+        with open(index_path, 'a') as fh:
+            fh.write(json.dumps(entry) + '\n')
+        return entry
+
+    def entries(self, feed_name=None, day=None):
+        """Index entries, oldest first, optionally for one feed and/or day."""
+        if not os.path.isdir(self.index_dir):
+            return []
+        names = sorted(os.listdir(self.index_dir))
+        if day is not None:
+            names = [name for name in names if name == f"{day.isoformat()}.jsonl"]
+        entries = []
+        for name in names:
+            if not name.endswith('.jsonl'):
+                continue
+            with open(os.path.join(self.index_dir, name)) as fh:
+                for line in fh:
+                    if not line.strip():
+                        continue
+                    entry = json.loads(line)
+                    if feed_name is None or entry['feed'] == feed_name:
+                        entries.append(entry)
+        return entries
+
+    def latest(self, feed_name, day=None):
+        entries = self.entries(feed_name, day)
+        return entries[-1] if entries else None
+
+    def resolve(self, digest_prefix):
+        """Full digest of the archived payload starting with `digest_prefix`."""
+        folder = os.path.join(self.objects_dir, digest_prefix[:2])
+        matches = [
+            name[:-len('.json.gz')]
+            for name in (os.listdir(folder) if os.path.isdir(folder) else [])
+            if name.startswith(digest_prefix) and name.endswith('.json.gz')
+        ]
+        if len(matches) != 1:
+            raise ValueError(f"{len(matches)} archived payloads match '{digest_prefix}'.")
+        return matches[0]
+
+    def open(self, digest):
+        return gzip.open(self.object_path(digest), 'rb')
+
+    def prune(self):
+        """Drop index days past retention and the payloads no remaining day refers to.
+
+        Returns (index days removed, payloads removed). Holds the archive
+        lock throughout, so payloads filed meanwhile wait and stay indexed.
+        """
+        if not os.path.isdir(self.index_dir):
+            return 0, 0
+        with self.locked():
+            return self._prune()
+
+    def _prune(self):
+        cutoff = timezone.localdate() - timedelta(days=self.retention_days)
+        days_removed = 0
+        for name in os.listdir(self.index_dir):
+            try:
+                day = date.fromisoformat(name.split('.', 1)[0])
+            except ValueError:
+                continue
+            if day < cutoff:
+                os.remove(os.path.join(self.index_dir, name))
+                days_removed += 1
+
+        keep = {entry['digest'] for entry in self.entries()}
+        objects_removed = 0
+        for folder, _, files in os.walk(self.objects_dir):
+            for name in files:
+                path = os.path.join(folder, name)
+                if name.endswith('.tmp'):
+                    # Left behind by a crashed write; give live writers an hour.
+                    # A writer discarding its temp file may beat us to it.
+                    try:
+                        if time.time() - os.path.getmtime(path) > 3600:
+                            os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                elif name[:-len('.json.gz')] not in keep:
+                    os.remove(path)
+                    objects_removed += 1
+        return days_removed, objects_removed
+
+
+def get_payload_archive():
+    """The configured payload archive, or None when ESB_ARCHIVE is disabled."""
+    config = get_archive_config()
+    if not config['enabled']:
+        return None
+    return PayloadArchive(config['directory'], config['retention_days'])
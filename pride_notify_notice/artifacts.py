@@ -0,0 +1,110 @@
+import os
+import shutil
+import tempfile
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+# Reports are rendered into a spooled buffer: in memory up to
+# `spool_max_bytes`, in an anonymous temporary file beyond that. When
+# enabled, each report is also kept under `directory`/<YYYY-MM-DD>/<filename>
+# for `retention_days`; `prune()` drops older days.
+DEFAULT_REPORT_ARTIFACTS = {
+    'enabled': False,
+    'directory': os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'var', 'report_artifacts'),
+    'retention_days': 30,
+    'spool_max_bytes': 16 * 1024 * 1024,
+}
+
+
+def get_artifact_config():
+    config = dict(DEFAULT_REPORT_ARTIFACTS)
+    config.update(getattr(settings, 'REPORT_ARTIFACTS', {}))
+    return config
+
+
+class ReportArtifact:
+    """A rendered report held in a spooled buffer until it is emailed and stored.
+
+    Use as a context manager; closing discards the buffer, so nothing is
+    left on the worker's disk.
+    """
+
+    def __init__(self, filename, content_type=XLSX_CONTENT_TYPE, spool_max_bytes=None):
+        if spool_max_bytes is None:
+            spool_max_bytes = get_artifact_config()['spool_max_bytes']
+        self.filename = filename
+        self.content_type = content_type
+        self.buffer = tempfile.SpooledTemporaryFile(max_size=spool_max_bytes)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def size(self):
+        return self.buffer.seek(0, os.SEEK_END)
+
+    def getvalue(self):
+        self.buffer.seek(0)
+        return self.buffer.read()
+
+    def copy_to(self, fh):
+        self.buffer.seek(0)
+        shutil.copyfileobj(self.buffer, fh)
+
+    def close(self):
+        self.buffer.close()
+
+
+class ArtifactStore:
+    """Rendered reports kept on disk, one folder per day."""
+
+    def __init__(self, directory, retention_days=30):
+        self.directory = str(directory)
+        self.retention_days = retention_days
+
+    def save(self, artifact):
+        """Write `artifact` into today's folder and return its path."""
+        folder = os.path.join(self.directory, timezone.localdate().isoformat())
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, artifact.filename)
+        fd, tmp_path = tempfile.mkstemp(dir=folder, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as fh:
+                artifact.copy_to(fh)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        return path
+
+    def prune(self):
+        """Drop the day folders past retention. Returns the number removed."""
+        if not os.path.isdir(self.directory):
+            return 0
+        cutoff = timezone.localdate() - timedelta(days=self.retention_days)
+        removed = 0
+        for name in os.listdir(self.directory):
+            try:
+                day = date.fromisoformat(name)
+            except ValueError:
+                continue
+            if day < cutoff:
+                shutil.rmtree(os.path.join(self.directory, name))
+                removed += 1
+        return removed
+
+
+def get_artifact_store():
+    """The configured report artifact store, or None when REPORT_ARTIFACTS is disabled."""
+    config = get_artifact_config()
+    if not config['enabled']:
+        return None
+    return ArtifactStore(config['directory'], config['retention_days'])
@@ -0,0 +1,98 @@
+import threading
+import time
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a gateway whose circuit is open."""
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker for one gateway.
+
+    CLOSED: calls go through; `failure_threshold` failures in a row open the
+    circuit. OPEN: calls are refused straight away for `reset_timeout`
+    seconds. HALF_OPEN: up to `half_open_max_calls` probe calls are let
+    through; a successful probe closes the circuit, a failed one re-opens it
+    for another `reset_timeout`.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name, failure_threshold, reset_timeout, half_open_max_calls=1):
+        self.name = name
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.reset_timeout = float(reset_timeout)
+        self.half_open_max_calls = max(1, int(half_open_max_calls))
+
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probes = 0
+        self._lock = threading.Lock()
+
+        self.times_opened = 0
+        self.calls_refused = 0
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self):
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self._state = self.HALF_OPEN
+            self._probes = 0
+        return self._state
+
+    def before_call(self):
+        """Reserve a call, or raise CircuitOpenError if the gateway is out."""
+        with self._lock:
+            state = self._current_state()
+            if state == self.CLOSED:
+                return
+            if state == self.HALF_OPEN and self._probes < self.half_open_max_calls:
+                self._probes += 1
+                return
+            self.calls_refused += 1
+            retry_in = max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at))
+        raise CircuitOpenError(f"{self.name} gateway circuit is open (retry in {retry_in:.0f}s).")
+
+    def cancel_call(self):
+        """Give back a call reserved by `before_call` that was never made."""
+        with self._lock:
+            if self._state == self.HALF_OPEN and self._probes:
+                self._probes -= 1
+
+    def record_success(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probes = 0
+
+    def record_failure(self):
+        with self._lock:
+            state = self._current_state()
+            self._failures += 1
+            if state == self.HALF_OPEN or (
+                state == self.CLOSED and self._failures >= self.failure_threshold
+            ):
+                self._open()
+
+    def _open(self):
+        if self._state != self.OPEN:
+            self.times_opened += 1
+            print(f"Opening {self.name} gateway circuit after {self._failures} consecutive failures.")
+        self._state = self.OPEN
+        self._opened_at = time.monotonic()
+        self._probes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'circuit_state': self._current_state(),
+                'consecutive_failures': self._failures,
+                'times_opened': self.times_opened,
+                'calls_refused': self.calls_refused,
+            }
@@ -0,0 +1,71 @@
+import threading
+
+from django.conf import settings
+from django.db import connection
+
+
+DEFAULT_MAX_IN_FLIGHT = 8
+
+
+def get_max_in_flight(campaign=None):
+    """Return the configured number of concurrent sends for `campaign`.
+
+    Limits come from `settings.SMS_CAMPAIGN_MAX_IN_FLIGHT`, a dict keyed by
+    campaign name with an optional `default` entry.
+    """
+    limits = getattr(settings, 'SMS_CAMPAIGN_MAX_IN_FLIGHT', {})
+    value = limits.get(campaign, limits.get('default', DEFAULT_MAX_IN_FLIGHT))
+    return max(1, int(value))
+
+
+def dispatch_records(records, send, max_in_flight=None, campaign=None):
+    """Call `send(record)` for every record with bounded concurrency.
+
+    At most `max_in_flight` sends run at the same time (defaults to the
+    campaign's configured limit). Results are returned in the same order as
+    `records`; a record whose `send` raised gets `None` in its slot so one bad
+    record never aborts the rest of the campaign.
+
+    Each worker thread holds its own Django database connection, which is
+    closed when the worker finishes so campaign runs do not leak connections.
+    """
+    if max_in_flight is None:
+        max_in_flight = get_max_in_flight(campaign)
+
+    pending = enumerate(records)
+    results = {}
+    lock = threading.Lock()
+
+    def send_one(index, record):
+        try:
+            return send(record)
+        except Exception as exc:
+            print(f"Dispatch error for {campaign or 'campaign'} record #{index}: {exc}")
+            return None
+
+    def worker():
+        try:
+            while True:
+                with lock:
+                    item = next(pending, None)
+                if item is None:
+                    return
+                index, record = item
+                results[index] = send_one(index, record)
+        finally:
+            connection.close()
+
+    if max_in_flight <= 1:
+        for index, record in pending:
+            results[index] = send_one(index, record)
+    else:
+        workers = [
+            threading.Thread(target=worker, name=f"sms-dispatch-{campaign or 'campaign'}-{n}", daemon=True)
+            for n in range(max_in_flight)
+        ]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+
+    return [results[index] for index in range(len(results))]
@@ -0,0 +1,53 @@
+from django.conf import settings
+
+from .outbox import send_deferred, send_error
+
+
+DEFAULT_SMS_FANOUT = {
+    'enabled': False,
+    'chunk_size': 500,
+    'min_records': 1000,
+    'max_chunks': 16,
+}
+
+
+def get_fanout_config():
+    config = dict(DEFAULT_SMS_FANOUT)
+    config.update(getattr(settings, 'SMS_FANOUT', {}))
+    return config
+
+
+def fanout_chunks(count):
+    """Number of Celery tasks to spread `count` messages over.
+
+    Returns 1 (send in the calling task) when fan-out is off or the campaign
+    is below `min_records`, otherwise one task per `chunk_size` messages,
+    capped at `max_chunks`.
+    """
+    config = get_fanout_config()
+    if not config['enabled'] or count < config['min_records']:
+        return 1
+    chunk_size = max(1, int(config['chunk_size']))
+    return max(1, min(int(config['max_chunks']), -(-count // chunk_size)))
+
+
+def split_records(records, chunks):
+    """Split `records` into `chunks` contiguous slices of near-equal size."""
+    size = -(-len(records) // chunks)
+    return [records[start:start + size] for start in range(0, len(records), size)]
+
+
+def tally_responses(responses):
+    """Count sent, failed, skipped and deferred sends from `send_sms_to_api` responses."""
+    counts = {'records': 0, 'sent': 0, 'failed': 0, 'skipped': 0, 'deferred': 0}
+    for response in responses:
+        counts['records'] += 1
+        if response and response.get('status') == 'skipped_duplicate':
+            counts['skipped'] += 1
+        elif send_deferred(response):
+            counts['deferred'] += 1
+        elif send_error(response) is None:
+            counts['sent'] += 1
+        else:
+            counts['failed'] += 1
+    return counts
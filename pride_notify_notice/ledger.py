@@ -0,0 +1,62 @@
+from array import array
+from decimal import ROUND_HALF_UP, Decimal
+from itertools import accumulate
+from operator import attrgetter, sub
+
+
+CENT = Decimal('0.01')
+
+
+def to_cents(amount):
+    """Amount -> integer cents, rounded half-up on the decimal value as written."""
+    scaled = amount * 100
+    cents = round(scaled)
+    if -1e-6 < scaled - cents < 1e-6:
+        # Already whole cents, as nearly every ESB amount is.
+        return cents
+    return int(Decimal(repr(amount)).quantize(CENT, rounding=ROUND_HALF_UP) * 100)
+
+
+def from_cents(cents):
+    return cents / 100
+
+
+def date_range(records, field):
+    """(earliest, latest) non-blank `field` value, or (None, None)."""
+    values = [value for value in map(attrgetter(field), records) if value]
+    if not values:
+        return None, None
+    return min(values), max(values)
+
+
+class LedgerColumns:
+    """Debit and credit columns of parsed statement records, in integer cents.
+
+    Built once per report; totals, counts and running balances are then
+    computed over the arrays with exact integer arithmetic, so money
+    never picks up float drift however many rows are summed.
+    """
+
+    def __init__(self, records, debit_field='debit', credit_field='credit'):
+        self.debits = array('q', list(map(to_cents, map(attrgetter(debit_field), records))))
+        self.credits = array('q', list(map(to_cents, map(attrgetter(credit_field), records))))
+
+    def __len__(self):
+        return len(self.debits)
+
+    def total_debits(self):
+        return sum(self.debits)
+
+    def total_credits(self):
+        return sum(self.credits)
+
+    def count_debits(self):
+        return sum(1 for cents in self.debits if cents > 0)
+
+    def count_credits(self):
+        return sum(1 for cents in self.credits if cents > 0)
+
+    def running_balances(self, opening_cents=0):
+        """Balance after each row: opening + credits - debits so far."""
+        balances = list(accumulate(map(sub, self.credits, self.debits), initial=opening_cents))
+        return array('q', balances[1:])
@@ -0,0 +1,140 @@
+import contextlib
+import os
+import random
+import time
+import tracemalloc
+from copy import copy
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core import mail
+from django.core.management.base import BaseCommand
+from openpyxl.cell import WriteOnlyCell
+
+from pride_notify_notice import report_writer, statements, tasks
+from pride_notify_notice.esb import use_esb_client
+
+
+class _SyntheticESBClient:
+    """Answers the report feeds with generated rows; nothing leaves the process."""
+
+    def __init__(self, payloads):
+        self.payloads = payloads
+
+    def fetch(self, feed_name, **kwargs):
+        return self.payloads[feed_name]
+
+
+class _PerCellStyleSheet(report_writer.StreamingSheet):
+    """Builds fresh Font/Fill/Border/Alignment objects for every cell, as the
+    report builders did before the shared style catalogue."""
+
+    def _cell(self, value, style):
+        cell = WriteOnlyCell(self.ws, value)
+        for name in ('font', 'fill', 'border', 'alignment'):
+            part = getattr(style, name)
+            if part is not None:
+                setattr(cell, name, copy(part))
+        if style.number_format is not None:
+            cell.number_format = style.number_format
+        return cell
+
+
+def _ura_rows(rng, count):
+    day = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=1)
+    rows = []
+    for index in range(count):
+        debit = rng.choice([0, rng.randrange(1000, 5000000)])
+        rows.append({
+            'TRAN_DT': (day + timedelta(seconds=index * 86400 // max(count, 1))).isoformat(),
+            'EFFECTIVE_DT': day.isoformat(),
+            'USER_NAME': rng.choice(['JANE NAKATO', 'PETER OKELLO', 'SYSTEM']),
+            'TRAN_DESC': f"URA ePayment {index}",
+            'PRN': f"22{index:08d}",
+            'TIN': f"10{rng.randrange(10 ** 8):08d}",
+            'TRAN_REF_TXT': f"FT{index:010d}",
+            'CONTRA_ACCT_NO': f"0{rng.randrange(10 ** 11):011d}",
+            'USER_BU': rng.choice(['Head Office', 'Kampala Road', 'Mbale']),
+            'DEBIT_AMT': debit,
+            'CREDIT_AMT': 0 if debit else rng.randrange(1000, 5000000),
+            'PAYMENT_TYPE': rng.choice(['CASH', 'CHEQUE']),
+            'OPENING_BALANCE': 150000000,
+            'GL_ACCT_NO': '101010101',
+        })
+    return {'Report': rows}
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark the streaming Excel rendering of the URA report: runs '
+        'retrieve_ura_report on synthetic rows at each size and reports task '
+        'time, render time, file size and, with --memory, the peak memory of '
+        'the render. With --compare-styles each size is also rendered with '
+        'per-cell style objects instead of the named style catalogue. Email '
+        'goes to the in-memory backend and the report artifact store is off.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, action='append',
+                            help='Report rows (repeatable; default 50000, 100000, 200000)')
+        parser.add_argument('--memory', action='store_true',
+                            help='Trace the render peak memory (tracemalloc slows the render down several times)')
+        parser.add_argument('--compare-styles', action='store_true',
+                            help='Also render with per-cell style objects, for comparison')
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        sizes = options['rows'] or [50000, 100000, 200000]
+        rng = random.Random(options['seed'])
+        settings.EMAIL_BACKEND = 'django.core.mail.backends.locmem.EmailBackend'
+        settings.REPORT_ARTIFACTS = {'enabled': False}
+
+        modes = ['named', 'per-cell'] if options['compare_styles'] else ['named']
+
+        self.stdout.write(
+            f"{'rows':>10}{'styles':>10}{'task s':>10}{'render s':>10}{'us/row':>9}{'peak MB':>10}{'file KB':>10}"
+        )
+        for count in sizes:
+            payload = _ura_rows(rng, count)
+            for mode in modes:
+                task_elapsed, render = self._run(payload, trace=options['memory'], mode=mode)
+                size = len(mail.outbox[-1].attachments[0][1])
+                peak = f"{render['peak'] / 2 ** 20:.1f}" if render['peak'] is not None else '-'
+                self.stdout.write(
+                    f"{count:>10,}{mode:>10}{task_elapsed:>10.2f}{render['elapsed']:>10.2f}"
+                    f"{render['elapsed'] / count * 1e6:>9.1f}{peak:>10}{size / 1024:>10,.0f}"
+                )
+
+    def _run(self, payload, trace, mode='named'):
+        render = {}
+        write_report = statements.write_report
+        streaming_sheet = report_writer.StreamingSheet
+
+        def timed_write_report(*args, **kwargs):
+            # The render is measured on its own: the task also parses and
+            # prints the whole payload, which is not what this benchmarks.
+            if trace:
+                tracemalloc.start()
+            started = time.perf_counter()
+            try:
+                return write_report(*args, **kwargs)
+            finally:
+                render['elapsed'] = time.perf_counter() - started
+                render['peak'] = tracemalloc.get_traced_memory()[1] if trace else None
+                if trace:
+                    tracemalloc.stop()
+
+        mail.outbox = []
+        statements.write_report = timed_write_report
+        if mode == 'per-cell':
+            report_writer.StreamingSheet = _PerCellStyleSheet
+        try:
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull), \
+                    use_esb_client(_SyntheticESBClient({'ura_report': payload})):
+                started = time.perf_counter()
+                tasks.retrieve_ura_report()
+                task_elapsed = time.perf_counter() - started
+        finally:
+            statements.write_report = write_report
+            report_writer.StreamingSheet = streaming_sheet
+        return task_elapsed, render
@@ -0,0 +1,177 @@
+import contextlib
+import io
+import math
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from pride_notify_notice.dispatch import dispatch_records
+from pride_notify_notice.log_sink import SMSLogSink
+from pride_notify_notice.message_types import MESSAGE_TYPES
+from pride_notify_notice.outbox import send_deferred, send_error
+from pride_notify_notice.stub_gateway import start_stub_gateway
+from pride_notify_notice.tasks import send_sms_to_api
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = max(0, math.ceil(pct / 100.0 * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+def synthetic_records(handler, count):
+    """`count` copies of the handler's sample, each to a different phone number."""
+    records = []
+    for i in range(count):
+        record = dict(handler.sample)
+        record[handler.phone_field] = f"07{i:08d}"
+        records.append(record)
+    return records
+
+
+class Command(BaseCommand):
+    help = (
+        'End-to-end SMS send benchmark against a local stub gateway: drives '
+        'send_sms_to_api one by one ("single") and the campaign send path with '
+        'dispatcher and log sink ("campaign") using synthetic ESB payloads, and '
+        'reports messages/s, p50/p95/p99 latency and DB write time. Log rows '
+        'written by the run are deleted afterwards unless --keep-rows is given.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--records', type=int, default=1000, help='Messages per type and mode (default 1000)')
+        parser.add_argument('--type', dest='types', action='append', help='Message type to run (repeatable, default all)')
+        parser.add_argument('--mode', dest='modes', action='append', choices=['single', 'campaign'],
+                            help='single, campaign or both (repeatable, default both)')
+        parser.add_argument('--stub-url', help='Use an already running stub (run_stub_sms_gateway) instead of starting one')
+        parser.add_argument('--latency', type=float, default=50.0, help='Stub latency in ms (default 50)')
+        parser.add_argument('--jitter', type=float, default=20.0, help='Stub latency jitter in ms (default 20)')
+        parser.add_argument('--error-rate', type=float, default=0.0, help='Stub share of 500 responses (0-1)')
+        parser.add_argument('--max-rps', type=int, default=0, help='Stub 429 threshold in requests/second (0 = off)')
+        parser.add_argument('--unthrottled', action='store_true',
+                            help='Lift the configured gateway rate limits to measure raw throughput')
+        parser.add_argument('--keep-rows', action='store_true', help='Keep the SMS log rows the benchmark wrote')
+
+    def handle(self, *args, **options):
+        count = options['records']
+        names = options['types'] or [name for name in MESSAGE_TYPES if name != 'custom']
+        modes = options['modes'] or ['single', 'campaign']
+
+        stub = None
+        base_url = options['stub_url']
+        if not base_url:
+            stub = start_stub_gateway(
+                latency=options['latency'] / 1000.0,
+                jitter=options['jitter'] / 1000.0,
+                error_rate=options['error_rate'],
+                max_rps=options['max_rps'],
+            )
+            base_url = stub.url
+        base_url = base_url.rstrip('/')
+
+        # Never let a benchmark reach the real gateways.
+        os.environ['MOONLIGHT_SENDER_ADDRESS'] = f"{base_url}/sms"
+        settings.BIRTHDAY_SMS_GATEWAY_URL = f"{base_url}/api/v1/sms"
+        if options['unthrottled']:
+            limits = dict(getattr(settings, 'SMS_GATEWAY_LIMITS', {}))
+            for gateway in {handler.gateway for handler in MESSAGE_TYPES.values()} | set(limits):
+                limits[gateway] = dict(limits.get(gateway, {}), rate=1e6, burst=1e6)
+            settings.SMS_GATEWAY_LIMITS = limits
+
+        self.stdout.write(f"Stub gateway: {base_url}")
+        self.stdout.write(
+            f"{'type':<13}{'mode':<10}{'msgs':>7}{'msg/s':>9}{'p50 ms':>9}{'p95 ms':>9}"
+            f"{'p99 ms':>9}{'db s':>8}{'failed':>8}"
+        )
+
+        marks = self._log_marks(names)
+        try:
+            for name in names:
+                handler = MESSAGE_TYPES[name]
+                for mode in modes:
+                    records = synthetic_records(handler, count)
+                    result = self._run(mode, handler, records)
+                    self._report(name, mode, result)
+                    # Clear between modes so the Greg School duplicate guard
+                    # does not skip the second run.
+                    if not options['keep_rows']:
+                        self._delete_since(marks)
+        finally:
+            if stub is not None:
+                self.stdout.write(f"Stub responses by status: {stub.stats()}")
+                stub.shutdown()
+                stub.server_close()
+
+    def _run(self, mode, handler, records):
+        latencies = []
+        db_seconds = [0.0]
+
+        if mode == 'single':
+            def time_writes(execute, sql, params, many, context):
+                started = time.perf_counter()
+                try:
+                    return execute(sql, params, many, context)
+                finally:
+                    if sql.lstrip().upper().startswith('INSERT'):
+                        db_seconds[0] += time.perf_counter() - started
+
+            with contextlib.redirect_stdout(io.StringIO()), connection.execute_wrapper(time_writes):
+                started = time.perf_counter()
+                responses = []
+                for record in records:
+                    sent = time.perf_counter()
+                    responses.append(send_sms_to_api(record, message_type=handler.name))
+                    latencies.append(time.perf_counter() - sent)
+                elapsed = time.perf_counter() - started
+        else:
+            with contextlib.redirect_stdout(io.StringIO()):
+                started = time.perf_counter()
+                records = handler.drop_already_sent(records)
+                with SMSLogSink() as log_sink:
+                    def send(record):
+                        sent = time.perf_counter()
+                        try:
+                            return send_sms_to_api(record, log_sink=log_sink, message_type=handler.name)
+                        finally:
+                            latencies.append(time.perf_counter() - sent)
+
+                    responses = dispatch_records(records, send, campaign=handler.name)
+                elapsed = time.perf_counter() - started
+            db_seconds[0] = log_sink.flush_seconds
+
+        return {
+            'messages': len(responses),
+            'elapsed': elapsed,
+            'latencies': sorted(latencies),
+            'db_seconds': db_seconds[0],
+            # Deferred (circuit open) messages were not delivered either.
+            'failed': sum(
+                1 for response in responses
+                if send_deferred(response) or send_error(response) is not None
+            ),
+        }
+
+    def _report(self, name, mode, result):
+        lat = result['latencies']
+        rate = result['messages'] / result['elapsed'] if result['elapsed'] else 0.0
+        self.stdout.write(
+            f"{name:<13}{mode:<10}{result['messages']:>7}{rate:>9,.0f}"
+            f"{percentile(lat, 50) * 1000:>9.1f}{percentile(lat, 95) * 1000:>9.1f}"
+            f"{percentile(lat, 99) * 1000:>9.1f}{result['db_seconds']:>8.2f}{result['failed']:>8}"
+        )
+
+    def _log_marks(self, names):
+        marks = {}
+        for name in names:
+            model = MESSAGE_TYPES[name].log_model
+            last = model.objects.order_by('-pk').values_list('pk', flat=True).first()
+            marks[model] = last or 0
+        return marks
+
+    def _delete_since(self, marks):
+        for model, last_pk in marks.items():
+            model.objects.filter(pk__gt=last_pk).delete()
@@ -0,0 +1,111 @@
+import random
+import time
+from datetime import timedelta
+
+from dateutil.parser import parse
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from pride_notify_notice.utils import (
+    _parse_transaction_datetime,
+    filter_transactions_in_window,
+    get_rolling_window,
+    parse_transaction_times,
+)
+
+
+def _legacy_parse(txn_time_str):
+    # The per-record parser as it was: dateutil for every value.
+    if not txn_time_str:
+        return None
+    try:
+        txn_datetime = parse(str(txn_time_str))
+    except (TypeError, ValueError):
+        return None
+    current_timezone = timezone.get_current_timezone()
+    if timezone.is_aware(txn_datetime):
+        return timezone.localtime(txn_datetime, current_timezone)
+    return timezone.make_aware(txn_datetime, current_timezone)
+
+
+def _legacy_filter(transactions, window_start, window_end):
+    result = []
+    for txn in transactions:
+        txn_datetime = _legacy_parse(txn.get('TXN_TIME'))
+        if txn_datetime is None:
+            continue
+        if window_start <= txn_datetime < window_end:
+            result.append(txn)
+    return result
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark TXN_TIME parsing and rolling-window filtering on synthetic '
+        'Greg School transactions: the old per-record dateutil path against '
+        'the ISO fast path with the sorted, bisected window.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100000, help='Transactions to generate (default 100000)')
+        parser.add_argument('--odd-share', type=float, default=0.02,
+                            help='Share of non-ISO or blank timestamps (default 0.02)')
+        parser.add_argument('--repeat', type=int, default=3, help='Best of this many runs (default 3)')
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        window_start, window_end = get_rolling_window(window_hours=1)
+        transactions = self._transactions(rng, options['rows'], options['odd_share'], window_end)
+        repeat = max(1, options['repeat'])
+
+        legacy = _legacy_filter(transactions, window_start, window_end)
+        fast = filter_transactions_in_window(transactions, window_start, window_end)
+        if sorted(map(id, legacy)) != sorted(map(id, fast)):
+            self.stderr.write(f"Mismatch: legacy kept {len(legacy)}, fast kept {len(fast)}.")
+        self.stdout.write(
+            f"{len(transactions):,} transactions, {len(fast):,} in window {window_start:%H:%M}-{window_end:%H:%M}"
+        )
+
+        current_timezone = timezone.get_current_timezone()
+        cases = [
+            ('parse (dateutil)', lambda: [_legacy_parse(t.get('TXN_TIME')) for t in transactions]),
+            ('parse (fast path)', lambda: [
+                _parse_transaction_datetime(t.get('TXN_TIME'), current_timezone) for t in transactions
+            ]),
+            ('parse column + sort', lambda: parse_transaction_times(transactions)),
+            ('window (old)', lambda: _legacy_filter(transactions, window_start, window_end)),
+            ('window (bisect)', lambda: filter_transactions_in_window(transactions, window_start, window_end)),
+        ]
+
+        self.stdout.write(f"{'case':<22}{'seconds':>10}{'rows/s':>14}")
+        for label, run in cases:
+            best = min(self._time(run) for _ in range(repeat))
+            self.stdout.write(f"{label:<22}{best:>10.3f}{len(transactions) / best:>14,.0f}")
+
+    def _time(self, run):
+        started = time.perf_counter()
+        run()
+        return time.perf_counter() - started
+
+    def _transactions(self, rng, count, odd_share, window_end):
+        # A day of transactions ending at the current hour, in ESB order.
+        day_start = timezone.localtime(window_end - timedelta(days=1)).replace(tzinfo=None)
+        transactions = []
+        for index in range(count):
+            moment = day_start + timedelta(seconds=rng.randrange(36 * 3600))
+            roll = rng.random()
+            if roll < odd_share / 2:
+                txn_time = moment.strftime('%d-%b-%Y %I:%M:%S %p')
+            elif roll < odd_share:
+                txn_time = ''
+            elif roll < 0.5:
+                txn_time = moment.isoformat(timespec='seconds')
+            else:
+                txn_time = moment.strftime('%Y-%m-%d %H:%M:%S')
+            transactions.append({
+                'TXN_TIME': txn_time,
+                'TRAN_DESC': f"GS{index:08d}",
+                'AMOUNT': rng.randrange(1000, 500000),
+            })
+        return transactions
@@ -1,33 +1,39 @@
 # celery -A pride_notify_service.celery worker --pool=solo -l info
 # celery -A pride_notify_service.celery beat --loglevel=info
 
-from django.core.management.base import BaseCommand
-from django.db import connections
-from django.db.utils import OperationalError
-
-class Command(BaseCommand):
-    help = 'Fetch Loans Due in 3 days from the Oracle database'
-
-    def handle(self, *args, **kwargs):
-        # Access the Oracle database through a custom connection
-        try:
-            # Use the 'oracle' connection defined in settings.py
-            with connections['oracle'].cursor() as cursor:
-                # Updated SQL query
-                query = """
-                    SELECT * FROM PRIDELIVE.V_LOAN_DUE_3DAYS
-                """
+import time
 
-                # PRIDELIVE.V_LOAN_ARREARS_3DAYS
+import oracledb
+from django.core.management.base import BaseCommand
 
-                cursor.execute(query)
+from pride_notify_notice.oracle_source import get_oracle_source
 
-                # Fetch all rows
-                rows = cursor.fetchall()
 
-                # Process your rows (you can print or save them)
-                for row in rows:
+class Command(BaseCommand):
+    help = (
+        'Read a campaign feed straight from its PRIDELIVE view through the '
+        'Oracle source pool (default: Loans Due in 3 days) and print the rows.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--feed', default='loans_due', help='Feed to read (default loans_due)')
+        parser.add_argument('--limit', type=int, default=0, help='Stop after this many rows (0 = all)')
+        parser.add_argument('--count-only', action='store_true', help='Only report the row count and time taken')
+
+    def handle(self, *args, **options):
+        feed = options['feed']
+        limit = options['limit']
+        started = time.perf_counter()
+        count = 0
+        try:
+            for row in get_oracle_source().iter_records(feed):
+                count += 1
+                if not options['count_only']:
                     self.stdout.write(str(row))
-
-        except OperationalError as e:
+                if limit and count >= limit:
+                    break
+        except oracledb.Error as e:
             self.stderr.write(f"Error connecting to Oracle: {e}")
+            return
+
+        self.stdout.write(f"{count} rows from {feed} in {time.perf_counter() - started:.2f}s")
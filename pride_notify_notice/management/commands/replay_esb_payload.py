@@ -0,0 +1,211 @@
+import contextlib
+import io
+import os
+import time
+from datetime import date, datetime
+from functools import partial
+
+from celery import current_app
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from pride_notify_notice import tasks
+from pride_notify_notice.archive import get_payload_archive
+from pride_notify_notice.esb import ReplayESBClient, get_feed_config, use_esb_client
+from pride_notify_notice.message_types import MESSAGE_TYPES
+from pride_notify_notice.models import FeedWatermark, SMSOutbox
+from pride_notify_notice.stub_gateway import start_stub_gateway
+from pride_notify_notice.utils import get_rolling_window
+
+
+# Feed -> the scheduled task that consumes it.
+REPLAY_TASKS = {
+    'loans_due': 'retrieve_data',
+    'birthdays': 'retrieve_birthday_data',
+    'group_loans': 'retrieve_group_loans',
+    'atm_expiry': 'retrieve_atm_expiry_notifications',
+    'greg_school_reports': 'retrieve_greg_school_reports',
+    'ura_report': 'retrieve_ura_report',
+    'interswitch_agents_report': 'retrieve_interswitch_agents_report',
+    'escrow_notifications': 'retrieve_escrow_notifications',
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Replay an archived ESB payload through the real retrieve_* task of its '
+        'feed, with SMS sent to a local stub gateway and email kept in memory. '
+        'Picks the latest archived payload of the feed unless --digest or --date '
+        'is given; --list shows what is archived. SMS log and outbox rows written '
+        'by the replay are deleted afterwards unless --keep-rows is given. Greg '
+        'School is filtered on the hour window of the run that fetched the '
+        'payload, ignoring the live watermark.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('feed', nargs='?', choices=sorted(REPLAY_TASKS), help='Feed to replay')
+        parser.add_argument('--list', action='store_true', help='List archived payloads (of the feed, if given) and exit')
+        parser.add_argument('--digest', help='Archived payload to replay (digest or unique prefix)')
+        parser.add_argument('--date', help='Replay the latest payload archived on this day (YYYY-MM-DD)')
+        parser.add_argument('--repeat', type=int, default=1, help='Run the replay this many times (default 1)')
+        parser.add_argument('--stub-url', help='Use an already running stub (run_stub_sms_gateway) instead of starting one')
+        parser.add_argument('--latency', type=float, default=50.0, help='Stub latency in ms (default 50)')
+        parser.add_argument('--jitter', type=float, default=20.0, help='Stub latency jitter in ms (default 20)')
+        parser.add_argument('--error-rate', type=float, default=0.0, help='Stub share of 500 responses (0-1)')
+        parser.add_argument('--unthrottled', action='store_true',
+                            help='Lift the configured gateway rate limits to measure raw throughput')
+        parser.add_argument('--keep-rows', action='store_true', help='Keep the SMS log and outbox rows the replay wrote')
+
+    def handle(self, *args, **options):
+        archive = get_payload_archive()
+        if archive is None:
+            raise CommandError("The ESB payload archive is disabled (ESB_ARCHIVE['enabled']).")
+
+        feed = options['feed']
+        if options['list']:
+            for entry in archive.entries(feed):
+                params = f" params={entry['params']}" if entry.get('params') else ''
+                self.stdout.write(
+                    f"{entry['fetched_at']}  {entry['feed']:<28}{entry['digest'][:16]}  {entry['bytes']:>12,} B{params}"
+                )
+            return
+        if not feed:
+            raise CommandError("Give the feed to replay, or --list.")
+
+        entry = self._select(archive, feed, options)
+        digest = entry['digest']
+        task = getattr(tasks, REPLAY_TASKS[feed])
+
+        stub = None
+        base_url = options['stub_url']
+        if not base_url:
+            stub = start_stub_gateway(
+                latency=options['latency'] / 1000.0,
+                jitter=options['jitter'] / 1000.0,
+                error_rate=options['error_rate'],
+            )
+            base_url = stub.url
+        base_url = base_url.rstrip('/')
+
+        # Never let a replay reach the real gateways, mailboxes, Oracle or the
+        # report artifact store, and run the Celery fan-out (outbox drains,
+        # chunk chords) in process.
+        os.environ['MOONLIGHT_SENDER_ADDRESS'] = f"{base_url}/sms"
+        settings.BIRTHDAY_SMS_GATEWAY_URL = f"{base_url}/api/v1/sms"
+        settings.EMAIL_BACKEND = 'django.core.mail.backends.locmem.EmailBackend'
+        settings.REPORT_ARTIFACTS = dict(getattr(settings, 'REPORT_ARTIFACTS', {}), enabled=False)
+        feeds = dict(getattr(settings, 'ESB_FEEDS', {}))
+        feeds[feed] = dict(feeds.get(feed, {}), source='esb')
+        settings.ESB_FEEDS = feeds
+        current_app.conf.task_always_eager = True
+        if options['unthrottled']:
+            limits = dict(getattr(settings, 'SMS_GATEWAY_LIMITS', {}))
+            for gateway in {handler.gateway for handler in MESSAGE_TYPES.values()} | set(limits):
+                limits[gateway] = dict(limits.get(gateway, {}), rate=1e6, burst=1e6)
+            settings.SMS_GATEWAY_LIMITS = limits
+
+        self.stdout.write(f"Replaying {feed} payload {digest[:16]} through {task.name} (gateway stub {base_url})")
+        marks = self._row_marks()
+        watermarks = list(FeedWatermark.objects.filter(feed=feed).values())
+        try:
+            with use_esb_client(ReplayESBClient(archive, {feed: digest})), self._pinned_window(feed, entry):
+                for run in range(1, max(1, options['repeat']) + 1):
+                    self._run(task, run)
+                    if not options['keep_rows']:
+                        self._delete_since(marks)
+                        FeedWatermark.objects.filter(feed=feed).delete()
+                        for row in watermarks:
+                            FeedWatermark.objects.create(**row)
+        finally:
+            if stub is not None:
+                self.stdout.write(f"Stub responses by status: {stub.stats()}")
+                stub.shutdown()
+                stub.server_close()
+
+    def _select(self, archive, feed, options):
+        if options['digest']:
+            try:
+                digest = archive.resolve(options['digest'])
+            except ValueError as exc:
+                raise CommandError(str(exc))
+            entries = [entry for entry in archive.entries(feed) if entry['digest'] == digest]
+            return entries[-1] if entries else {'digest': digest, 'fetched_at': None}
+
+        day = None
+        if options['date']:
+            try:
+                day = date.fromisoformat(options['date'])
+            except ValueError:
+                raise CommandError(f"Invalid --date '{options['date']}'. Use YYYY-MM-DD.")
+        entry = archive.latest(feed, day)
+        if entry is None:
+            raise CommandError(f"No archived {feed} payload{f' for {day}' if day else ''}.")
+        if entry.get('params') and get_feed_config(feed).get('paging'):
+            self.stderr.write("Note: this entry is a single page of a paged feed.")
+        return entry
+
+    @contextlib.contextmanager
+    def _pinned_window(self, feed, entry):
+        """Make Greg School filter the payload as the run that fetched it did.
+
+        The task keeps transactions of the hour before its own run (or above
+        the live watermark), so the window is anchored to the entry's
+        `fetched_at` and the watermark is ignored.
+        """
+        if feed != 'greg_school_reports':
+            yield
+            return
+        if not entry.get('fetched_at'):
+            self.stderr.write("Note: the payload is not in the archive index; using the current hour window.")
+            fetched_at = None
+        else:
+            fetched_at = datetime.fromisoformat(entry['fetched_at'])
+        self.stdout.write(
+            "Greg School window: {} to {}".format(*get_rolling_window(window_hours=1, now=fetched_at))
+        )
+
+        rolling_window, watermark = tasks.get_rolling_window, tasks.get_watermark
+        tasks.get_rolling_window = partial(get_rolling_window, now=fetched_at)
+        tasks.get_watermark = lambda feed_name: None
+        try:
+            yield
+        finally:
+            tasks.get_rolling_window, tasks.get_watermark = rolling_window, watermark
+
+    def _run(self, task, run):
+        output = io.StringIO()
+        started = time.perf_counter()
+        error = None
+        with contextlib.redirect_stdout(output):
+            try:
+                result = task()
+            except Exception as exc:
+                result, error = None, exc
+        elapsed = time.perf_counter() - started
+
+        rows = sum(
+            model.objects.filter(pk__gt=last_pk).count()
+            for model, last_pk in self._marks.items()
+        )
+        summary = f"error: {error}" if error is not None else _summarise(result)
+        self.stdout.write(f"run {run}: {elapsed:.2f}s, {rows} log/outbox rows written, {summary}")
+
+    def _row_marks(self):
+        models = {handler.log_model for handler in MESSAGE_TYPES.values()} | {SMSOutbox}
+        self._marks = {
+            model: model.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+            for model in models
+        }
+        return self._marks
+
+    def _delete_since(self, marks):
+        for model, last_pk in marks.items():
+            model.objects.filter(pk__gt=last_pk).delete()
+
+
+def _summarise(result):
+    if isinstance(result, list):
+        return f"{len(result)} results"
+    if isinstance(result, dict):
+        return ', '.join(f"{key}={value}" for key, value in result.items() if not isinstance(value, (list, dict)))
+    return repr(result)
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+
+from pride_notify_notice.stub_gateway import StubGatewayServer
+
+
+class Command(BaseCommand):
+    help = (
+        'Run a local stand-in for the Moonlight (GET) and birthday (JSON POST) '
+        'SMS gateways with configurable latency, errors and throttling. Point '
+        'MOONLIGHT_SENDER_ADDRESS and BIRTHDAY_SMS_GATEWAY_URL at it.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8099)
+        parser.add_argument('--latency', type=float, default=50.0, help='Mean response latency in ms (default 50)')
+        parser.add_argument('--jitter', type=float, default=20.0, help='Latency jitter in ms, +/- (default 20)')
+        parser.add_argument('--error-rate', type=float, default=0.0, help='Share of requests answered 500 (0-1)')
+        parser.add_argument('--max-rps', type=int, default=0, help='Answer 429 above this many requests/second (0 = off)')
+
+    def handle(self, *args, **options):
+        server = StubGatewayServer(
+            (options['host'], options['port']),
+            latency=options['latency'] / 1000.0,
+            jitter=options['jitter'] / 1000.0,
+            error_rate=options['error_rate'],
+            max_rps=options['max_rps'],
+        )
+        self.stdout.write(f"Stub SMS gateway listening on {server.url}")
+        self.stdout.write(f"  MOONLIGHT_SENDER_ADDRESS={server.url}/sms")
+        self.stdout.write(f"  BIRTHDAY_SMS_GATEWAY_URL={server.url}/api/v1/sms")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.stdout.write(f"Responses by status: {server.stats()}")
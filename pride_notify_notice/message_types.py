@@ -0,0 +1,546 @@
+import re
+from datetime import datetime
+
+from django.conf import settings
+
+from .models import (
+    ATMExpirySMSLog,
+    BirthdaySMSLog,
+    GregSchoolSMSLog,
+    GroupLoanSMSLog,
+    GroupSMSLog,
+    SMSLog,
+    greg_school_dedupe_key,
+)
+from .records import to_datetime
+
+
+class MessageType:
+    """One kind of SMS notice: how to read it, word it and log it.
+
+    Subclasses set `marker` (the ESB key that identifies the record type),
+    `log_model` and `template`, and implement `extract()` (raw ESB record ->
+    parsed fields, raising on unusable records) and `log_row()` (fields ->
+    keyword arguments for `log_model`). The template is bound once at class
+    creation, so rendering a message is a single `str.format` call.
+    """
+
+    name = ''
+    marker = ''
+    log_model = None
+    gateway = 'moonlight'
+    template = ''
+    name_field = ''
+    phone_field = 'TEL_NUMBER'
+    sample = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._render = staticmethod(cls.template.format) if cls.template else None
+
+    def extract(self, detail):
+        raise NotImplementedError
+
+    def render(self, fields):
+        return self._render(**fields)
+
+    def recipient(self, detail):
+        """Best-effort (name, phone) for records that failed to parse."""
+        return detail.get(self.name_field, ''), detail.get(self.phone_field, '')
+
+    def already_sent(self, fields, message, log_sink=None):
+        return False
+
+    def drop_already_sent(self, records):
+        """Remove records of a campaign batch that must not be sent again."""
+        return records
+
+    def sent_status(self, api_response):
+        return api_response
+
+    def failed_status(self, fallback_response):
+        return fallback_response
+
+    def log_row(self, fields, message, status, response_data, failed=False):
+        raise NotImplementedError
+
+
+MESSAGE_TYPES = {}
+
+
+def register(cls):
+    MESSAGE_TYPES[cls.name] = cls()
+    return cls
+
+
+def get_message_type(name):
+    try:
+        return MESSAGE_TYPES[name]
+    except KeyError:
+        raise ValueError(f"Unknown message type '{name}'.") from None
+
+
+def resolve_message_type(detail):
+    """Return the handler whose marker key appears in `detail`.
+
+    Markers are checked in registration order, which mirrors the precedence of
+    the original if/elif chain in `send_sms_to_api`.
+    """
+    if isinstance(detail, dict):
+        for handler in MESSAGE_TYPES.values():
+            if handler.marker in detail:
+                return handler
+    raise ValueError("Invalid message_detail format: no recognized fields found.")
+
+
+def resolve_campaign_message_type(records):
+    """Resolve the message type once for a whole campaign list.
+
+    Returns the handler name (a plain string so it can travel through Celery),
+    or None if no record is recognisable; `send_sms_to_api` then falls back to
+    per-record resolution and logs each bad record as before.
+    """
+    for record in records:
+        try:
+            return resolve_message_type(record).name
+        except ValueError:
+            continue
+    return None
+
+
+@register
+class CustomMessage(MessageType):
+    name = 'custom'
+    marker = 'CUSTOM_MESSAGE'
+    log_model = GroupSMSLog
+    name_field = 'CUST_NM'
+    sample = {
+        'CUST_NM': 'SAMPLE GROUP',
+        'TEL_NUMBER': '0700000000',
+        'CUSTOM_MESSAGE': 'Dear member, your group meeting is on Friday at 10am.',
+    }
+
+    def extract(self, detail):
+        return {
+            'acct_nm': detail.get('CUST_NM'),
+            'tel_number': detail.get('TEL_NUMBER'),
+            'message': detail.get('CUSTOM_MESSAGE'),
+        }
+
+    def render(self, fields):
+        return fields['message']
+
+    def log_row(self, fields, message, status, response_data, failed=False):
+        return {
+            'account_name': fields['acct_nm'],
+            'phone_number': fields['tel_number'],
+            'message': message,
+            'status': status,
+            'response_data': response_data,
+        }
+
+
+@register
+class LoanDueMessage(MessageType):
+    name = 'loans_due'
+    marker = 'AMT_DUE'
+    log_model = SMSLog
+    name_field = 'CUST_NM'
+    template = (
+        "Dear {acct_nm}, your loan instalment is due on {due_date_sms}. "
+        "Thank you for banking with us. Toll Free: 0800333999"
+    )
+    sample = {
+        'CUST_NM': 'JOHN DOE',
+        'TEL_NUMBER': '0700000000',
+        'DUE_DT': '2026-10-21T00:00:00',
+        'AMT_DUE': '152000',
+    }
+
+    def extract(self, detail):
+        due_dt_serial = detail.get('DUE_DT')
+        amt_due = float(detail.get('AMT_DUE', 0))
+        due_dt_obj = to_datetime(due_dt_serial)
+        if due_dt_obj is None:
+            raise ValueError(f"Invalid DUE_DT '{due_dt_serial}'")
+
+        return {
+            'acct_nm': detail.get('CUST_NM'),
+            'tel_number': detail.get('TEL_NUMBER'),
+            'amount_due': amt_due,
+            'due_date': due_dt_obj.date(),
+            'due_date_sms': due_dt_obj.strftime('%d-%m-%Y'),
+        }
+
+    def log_row(self, fields, message, status, response_data, failed=False):
+        return {
+            'account_name': fields['acct_nm'],
+            'phone_number': fields['tel_number'],
+            'message': message,
+            'due_date': fields['due_date'],
+            'amount_due': fields['amount_due'] if failed else (fields['amount_due'] or 0),
+            'status': status,
+            'response_data': response_data,
+        }
+
+
+@register
+class BirthdayMessage(MessageType):
+    name = 'birthdays'
+    marker = 'BIRTH_DT'
+    log_model = BirthdaySMSLog
+    gateway = 'birthday'
+    name_field = 'FIRST_NM'
+    template = (
+        "Dear {acct_nm}, Pride Wishes you a Happy Birthday. We value our relationship with you. "
+        "Thank you for choosing Pride. Toll Free: 0800333999"
+    )
+    sample = {
+        'FIRST_NM': 'JANE',
+        'TEL_NUMBER': '0700000000',
+        'BIRTH_DT': '1990-10-18T00:00:00',
+        'CLIENT_TYPE': 'CUSTOMER',
+    }
+
+    def extract(self, detail):
+        try:
+            date_of_birth = to_datetime(detail.get('BIRTH_DT')).date()
+        except Exception as e:
+            print(f"Failed to parse BIRTH_DT: {e}")
+            date_of_birth = None
+
+        return {
+            'acct_nm': detail.get('FIRST_NM'),
+            'tel_number': detail.get('TEL_NUMBER'),
+            'client_type': detail.get('CLIENT_TYPE', 'CUSTOMER'),
+            'date_of_birth': date_of_birth,
+        }
+
+    def sent_status(self, api_response):
+        # The gateway returns {"requestId": ..., "status": "QUEUED"}. Store the
+        # short status string in `status` (CharField) and keep the full payload
+        # (incl. requestId) in `response_data`.
+        return api_response.get("status") if isinstance(api_response, dict) else api_response
+
+    def log_row(self, fields, message, status, response_data, failed=False):
+        return {
+            'acct_nm': fields['acct_nm'],
+            'client_type': fields['client_type'],
+            'message': message,
+            'date_of_birth': fields['date_of_birth'],
+            'contact': fields['tel_number'],
+            'status': status,
+            'response_data': response_data,
+        }
+
+
+@register
+class GregSchoolMessage(MessageType):
+    name = 'greg_school'
+    marker = 'CUSTOMER_NAME'
+    log_model = GregSchoolSMSLog
+    name_field = 'CUSTOMER_NAME'
+    template = (
+        "{school_name}, CR on A/C {acct_masked} "
+        "with UGX {txn_amount_fmt} on {txn_date_fmt} "
+        "at {txn_time_fmt} "
+        "by {extracted_desc}. Bal:{bal_fmt}. "
+        "For Help Call 0800333999"
+    )
+    sample = {
+        'CUSTOMER_NAME': 'GREGS HILL PRI SCH',
+        'TEL_NUMBER': '0700000000',
+        'ACCT_NO': '3010000000',
+        'TXN_AMT': '250000',
+        'TXN_TIME': '2026-10-18T09:15:00',
+        'TRAN_DESC': '1009453253-Jane Doe-MTN_UG-REF123',
+        'LEDGER_BAL': '12500000.00',
+    }
+
+    # Pulls "1009453253-Jane Doe" out of "1009453253-Jane Doe-MTN_UG-...".
+    DESCRIPTION_PATTERN = re.compile(r'(\d+-.*?)(?=-[A-Z_]+_UG\b)', flags=re.IGNORECASE)
+
+    def recipient(self, detail):
+        return detail.get('CUSTOMER_NAME', ''), detail.get('TEL_NUMBER') or detail.get('CUSTOMER_NAME', '')
+
+    def extract(self, detail):
+        acct_no = detail.get('ACCT_NO', '')
+        txn_amount = detail.get('TXN_AMT', '0')
+        txn_date_raw = detail.get('TXN_TIME')
+        tran_desc = detail.get('TRAN_DESC', '')
+        ledger_bal = detail.get('LEDGER_BAL', '0')
+
+        school_name = "Valued Customer"  # Default name if no account match
+        if acct_no == settings.GREG_SCHOOL_ACCOUNT_NUMBER:
+            school_name = "GREGS HILL PRI SCH"
+        elif acct_no == settings.PRECIOUS_SCHOOL_ACCOUNT_NUMBER:
+            school_name = "PRECIOUS KINDERGARTEN"
+
+        try:
+            txn_amount_fmt = f"{int(float(txn_amount)):,}"
+        except Exception:
+            txn_amount_fmt = txn_amount
+
+        try:
+            parsed_txn_date = datetime.fromisoformat(txn_date_raw)
+            txn_date_for_db = parsed_txn_date.date()
+            txn_date_fmt = parsed_txn_date.strftime("%d/%m/%Y")
+            txn_time_fmt = parsed_txn_date.strftime("%H:%M")
+            txn_minute = parsed_txn_date.strftime("%Y-%m-%d %H:%M")
+        except Exception as e:
+            print(f"Failed to parse TRAN_DT '{txn_date_raw}': {e}")
+            txn_date_fmt = txn_date_raw
+            txn_date_for_db = None
+            txn_time_fmt = ""
+            txn_minute = ""
+
+        try:
+            match = self.DESCRIPTION_PATTERN.search(tran_desc)
+            extracted_desc = match.group(1).strip() if match else "UNKNOWN"
+        except Exception as e:
+            print(f"Failed to extract description from TRAN_DESC: {e}")
+            extracted_desc = "UNKNOWN"
+
+        try:
+            bal_fmt = f"{int(float(ledger_bal)):,}"
+        except Exception:
+            bal_fmt = ledger_bal
+
+        return {
+            'acct_nm': detail.get('CUSTOMER_NAME', ''),
+            'tel_number': detail.get('TEL_NUMBER') or detail.get('CUSTOMER_NAME', ''),
+            'acct_no': acct_no,
+            'txn_amount': txn_amount,
+            'tran_desc': tran_desc,
+            'ledger_bal': ledger_bal,
+            'txn_date': txn_date_for_db,
+            'school_name': school_name,
+            'acct_masked': f"***{acct_no[-4:]}" if acct_no else "***0000",
+            'txn_amount_fmt': txn_amount_fmt,
+            'txn_date_fmt': txn_date_fmt,
+            'txn_time_fmt': txn_time_fmt,
+            'extracted_desc': extracted_desc,
+            'bal_fmt': bal_fmt,
+            'dedupe_key': greg_school_dedupe_key(
+                detail.get('TEL_NUMBER') or detail.get('CUSTOMER_NAME', ''),
+                acct_no,
+                txn_amount,
+                txn_minute,
+                tran_desc,
+            ),
+        }
+
+    def render(self, fields):
+        message = self._render(**fields)
+        print(f"Generated {fields['school_name']} message:", message)
+        return message
+
+    def already_sent(self, fields, message, log_sink=None):
+        # Never send the same school alert twice: a successful send stores the
+        # alert's content hash in the uniquely indexed `dedupe_key` column, so
+        # this is a single index probe (plus a look at rows still buffered in
+        # the sink). This protects against window overlap and Celery retries
+        # re-processing a batch after a partial failure.
+        key = fields['dedupe_key']
+        if GregSchoolSMSLog.objects.filter(dedupe_key=key).exists():
+            return True
+        return log_sink is not None and log_sink.has_pending(GregSchoolSMSLog, dedupe_key=key)
+
+    def drop_already_sent(self, records):
+        """Drop alerts already sent, and repeats within the batch, in one query.
+
+        Records that cannot be parsed are kept so `send_sms_to_api` logs them
+        as failures exactly as before.
+        """
+        keyed = []
+        for record in records:
+            try:
+                key = self.extract(record)['dedupe_key']
+            except Exception:
+                key = None
+            keyed.append((key, record))
+
+        keys = {key for key, _ in keyed if key}
+        seen = set(
+            GregSchoolSMSLog.objects.filter(dedupe_key__in=keys).values_list('dedupe_key', flat=True)
+        ) if keys else set()
+
+        unsent = []
+        for key, record in keyed:
+            if key is None:
+                unsent.append(record)
+            elif key not in seen:
+                seen.add(key)
+                unsent.append(record)
+
+        skipped = len(keyed) - len(unsent)
+        if skipped:
+            print(f"Skipping {skipped} duplicate {self.name} SMS: already sent or repeated in this batch.")
+        return unsent
+
+    def sent_status(self, api_response):
+        return "SENT"
+
+    def failed_status(self, fallback_response):
+        return "FAILED"
+
+    def log_row(self, fields, message, status, response_data, failed=False):
+        return {
+            'acct_nm': fields['acct_no'],
+            'txn_amount': fields['txn_amount'],
+            'txn_date': fields['txn_date'],
+            'tran_description': fields['tran_desc'],
+            'ledger': fields['ledger_bal'],
+            'contact': fields['tel_number'],
+            'message': message,
+            'status': status,
+            'response_data': response_data,
+            # Failed attempts carry no key so the alert can be retried.
+            'dedupe_key': None if failed else fields['dedupe_key'],
+        }
+
+
+@register
+class GroupLoanMessage(MessageType):
+    name = 'group_loans'
+    marker = 'GROUP_CUST_NO'
+    log_model = GroupLoanSMSLog
+    name_field = 'MEMBER_NM'
+    phone_field = 'PHONE'
+    template = (
+        "Dear {display_name}, your CEC/MEC collection of Shs {formatted_total} has been received on {formatted_date}. "
+        "For Help Call 0800333999. Never share your ATM/Mobile PIN."
+    )
+    sample = {
+        'MEMBER_NM': 'AKELLO GRACE',
+        'PHONE': '0700000000',
+        'GROUP_CUST_NO': 'G000123',
+        'LOAN_AMOUNT_PAID': '45000',
+        'COMP_AMOUNT_PAID': '5000',
+        'VOL_AMOUNT_PAID': '2000',
+        'CREATE_DT': '2026-10-17T08:00:00Z',
+    }
+
+    def extract(self, detail):
+        full_name = detail.get('MEMBER_NM', '')
+        name_parts = full_name.split()
+        display_name = name_parts[-1] if len(name_parts) > 1 else full_name
+
+        try:
+            total_amount = (
+                float(detail.get('LOAN_AMOUNT_PAID', '0'))
+                + float(detail.get('COMP_AMOUNT_PAID', '0'))
+                + float(detail.get('VOL_AMOUNT_PAID', '0'))
+            )
+            formatted_total = "{:,.0f}".format(total_amount)
+        except (ValueError, TypeError) as e:
+            print(f"Error calculating total amount: {e}")
+            formatted_total = "0"
+
+        try:
+            create_dt = datetime.fromisoformat(detail.get('CREATE_DT', '').replace('Z', '+00:00'))
+            formatted_date = create_dt.strftime('%d-%m-%Y')
+        except (ValueError, TypeError, AttributeError) as e:
+            print(f"Error formatting date: {e}")
+            formatted_date = datetime.now().strftime('%d-%m-%Y')
+
+        return {
+            'acct_nm': full_name,
+            'tel_number': detail.get('PHONE', ''),
+            'group_cust_no': detail.get('GROUP_CUST_NO', ''),
+            'display_name': display_name,
+            'formatted_total': formatted_total,
+            'formatted_date': formatted_date,
+        }
+
+    def render(self, fields):
+        message = self._render(**fields)
+        print("Generated group loan message:", message)
+        return message
+
+    def log_row(self, fields, message, status, response_data, failed=False):
+        return {
+            'acct_nm': fields['acct_nm'],
+            'group_cust_no': (fields['group_cust_no'] or "") if failed else fields['group_cust_no'],
+            'message': message,
+            'contact': fields['tel_number'],
+            'status': status,
+            'response_data': response_data,
+        }
+
+
+@register
+class ATMExpiryMessage(MessageType):
+    name = 'atm_expiry'
+    marker = 'CARD_TITLE'
+    log_model = ATMExpirySMSLog
+    name_field = 'CARD_TITLE'
+    phone_field = 'MOBILE_CONTACT'
+    template = (
+        "Dear {card_title}, your ATM card ending with **{pan_last4} will expire at the end of this month. "
+        "Please visit your nearest branch to renew. Never share your PIN."
+    )
+    sample = {
+        'CARD_TITLE': 'OKELLO, JAMES',
+        'PAN_MASKED': '506183******5678',
+        'MOBILE_CONTACT': '0700000000',
+        'CUST_ID': '100234',
+        'CUST_NO': '200456',
+        'TRANSACTION_ACCT': '3010000000',
+        'REQUESTED_DATE': '2023-11-02T00:00:00',
+        'EXPIRY_DATE': '2026-10-31T00:00:00',
+    }
+
+    def extract(self, detail):
+        pan_masked = str(detail.get('PAN_MASKED') or '')
+        tel_number = str(detail.get('MOBILE_CONTACT') or '').strip()
+        card_title_raw = str(detail.get('CARD_TITLE') or '').strip()
+        card_title = card_title_raw.split()[0].replace(',', '') if card_title_raw else 'Customer'
+
+        try:
+            requested_date_raw = detail.get('REQUESTED_DATE')
+            requested_date = to_datetime(requested_date_raw).date() if requested_date_raw else None
+        except Exception:
+            requested_date = None
+
+        try:
+            expiry_date_raw = detail.get('EXPIRY_DATE')
+            expiry_date = to_datetime(expiry_date_raw).date() if expiry_date_raw else None
+        except Exception:
+            expiry_date = None
+
+        # Skip invalid/non-SMS contacts (e.g., emails)
+        if not tel_number.isdigit():
+            raise ValueError(f"Invalid ATM contact '{tel_number}' for card '{card_title_raw}'")
+
+        # Keep model field length constraints safe
+        return {
+            'acct_nm': card_title,
+            'tel_number': tel_number[:15],
+            'card_title': card_title,
+            'pan_masked': pan_masked,
+            'pan_last4': pan_masked[-4:],
+            'cust_id': str(detail.get('CUST_ID') or '').strip(),
+            'cust_no': str(detail.get('CUST_NO') or '').strip(),
+            'transaction_acct': str(detail.get('TRANSACTION_ACCT') or '').strip()[:50],
+            'requested_date': requested_date,
+            'expiry_date': expiry_date,
+        }
+
+    def recipient(self, detail):
+        return str(detail.get('CARD_TITLE') or ''), str(detail.get('MOBILE_CONTACT') or '').strip()
+
+    def log_row(self, fields, message, status, response_data, failed=False):
+        return {
+            'cust_id': fields['cust_id'],
+            'cust_no': fields['cust_no'],
+            'pan_masked': fields['pan_masked'],
+            'card_title': (fields['card_title'] or fields['acct_nm']) if failed else fields['card_title'],
+            'requested_date': fields['requested_date'],
+            'expiry_date': fields['expiry_date'],
+            'transaction_acct': fields['transaction_acct'],
+            'mobile_contact': fields['tel_number'],
+            'message': message,
+            'status': status,
+            'response_data': response_data,
+        }
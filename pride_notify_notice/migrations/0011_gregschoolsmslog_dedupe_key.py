@@ -0,0 +1,90 @@
+# Generated by Django 4.1.2 on 2026-10-18 09:48
+
+import hashlib
+import re
+from datetime import datetime
+
+from django.db import migrations, models
+
+
+# The alert text carries the transaction time as "on dd/mm/YYYY at HH:MM".
+MESSAGE_TIME_PATTERN = re.compile(r' on (\d{2}/\d{2}/\d{4}) at (\d{2}:\d{2}) by ')
+
+BACKFILL_BATCH_SIZE = 1000
+
+
+def greg_school_dedupe_key(contact, account, amount, txn_time, description):
+    # Frozen copy of models.greg_school_dedupe_key as of this migration.
+    parts = (contact, account, amount, txn_time, description)
+    raw = "\x1f".join(str(part or '').strip() for part in parts)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def message_txn_minute(message):
+    match = MESSAGE_TIME_PATTERN.search(message or '')
+    if not match:
+        return ''
+    try:
+        parsed = datetime.strptime(' '.join(match.groups()), '%d/%m/%Y %H:%M')
+    except ValueError:
+        return ''
+    return parsed.strftime('%Y-%m-%d %H:%M')
+
+
+def backfill_dedupe_keys(apps, schema_editor):
+    """Key every SENT row; repeats of an alert keep the key on the oldest row only."""
+    GregSchoolSMSLog = apps.get_model('pride_notify_notice', 'GregSchoolSMSLog')
+
+    seen = set()
+    pending = []
+    rows = (
+        GregSchoolSMSLog.objects.filter(status="SENT")
+        .order_by('id')
+        .only('id', 'contact', 'acct_nm', 'txn_amount', 'tran_description', 'message')
+    )
+    for row in rows.iterator(chunk_size=BACKFILL_BATCH_SIZE):
+        key = greg_school_dedupe_key(
+            row.contact,
+            row.acct_nm,
+            row.txn_amount,
+            message_txn_minute(row.message),
+            row.tran_description,
+        )
+        if key in seen:
+            continue
+        seen.add(key)
+        row.dedupe_key = key
+        pending.append(row)
+
+        if len(pending) >= BACKFILL_BATCH_SIZE:
+            GregSchoolSMSLog.objects.bulk_update(pending, ['dedupe_key'])
+            pending = []
+
+    if pending:
+        GregSchoolSMSLog.objects.bulk_update(pending, ['dedupe_key'])
+
+
+def clear_dedupe_keys(apps, schema_editor):
+    GregSchoolSMSLog = apps.get_model('pride_notify_notice', 'GregSchoolSMSLog')
+    GregSchoolSMSLog.objects.exclude(dedupe_key=None).update(dedupe_key=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pride_notify_notice', '0010_gregschoolsmslog'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gregschoolsmslog',
+            name='dedupe_key',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True),
+        ),
+        migrations.RunPython(backfill_dedupe_keys, clear_dedupe_keys),
+        migrations.AlterField(
+            model_name='gregschoolsmslog',
+            name='dedupe_key',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True, unique=True),
+        ),
+    ]
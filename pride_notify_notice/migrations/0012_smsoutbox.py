@@ -0,0 +1,37 @@
+# Generated by Django 4.1.2 on 2026-10-18 09:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pride_notify_notice', '0011_gregschoolsmslog_dedupe_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SMSOutbox',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('campaign', models.CharField(max_length=50)),
+                ('message_type', models.CharField(blank=True, max_length=50, null=True)),
+                ('payload', models.JSONField()),
+                ('idempotency_key', models.CharField(max_length=64, unique=True)),
+                ('status', models.CharField(choices=[('PENDING', 'Pending'), ('SENDING', 'Sending'), ('SENT', 'Sent'), ('FAILED', 'Failed')], default='PENDING', max_length=10)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('last_error', models.TextField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('claimed_at', models.DateTimeField(blank=True, null=True)),
+                ('sent_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='smsoutbox',
+            index=models.Index(fields=['status', 'id'], name='smsoutbox_status_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='smsoutbox',
+            index=models.Index(fields=['status', 'claimed_at'], name='smsoutbox_status_claimed_idx'),
+        ),
+    ]
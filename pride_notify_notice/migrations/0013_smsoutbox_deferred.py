@@ -0,0 +1,18 @@
+# Generated by Django 4.1.2 on 2026-10-18 09:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pride_notify_notice', '0012_smsoutbox'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='smsoutbox',
+            name='status',
+            field=models.CharField(choices=[('PENDING', 'Pending'), ('SENDING', 'Sending'), ('SENT', 'Sent'), ('FAILED', 'Failed'), ('DEFERRED', 'Deferred')], default='PENDING', max_length=10),
+        ),
+    ]
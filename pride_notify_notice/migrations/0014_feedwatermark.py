@@ -0,0 +1,23 @@
+# Generated by Django 4.1.2 on 2026-10-18 11:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pride_notify_notice', '0013_smsoutbox_deferred'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeedWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('feed', models.CharField(max_length=50, unique=True)),
+                ('last_txn_time', models.DateTimeField(blank=True, null=True)),
+                ('last_reference', models.CharField(blank=True, default='', max_length=255)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -1,5 +1,21 @@
+import hashlib
+
 from django.db import models
 
+
+def greg_school_dedupe_key(contact, account, amount, txn_time, description):
+    """Fixed-length idempotency key for one Greg School credit alert.
+
+    `txn_time` is the transaction time as 'YYYY-MM-DD HH:MM' (the precision the
+    SMS itself carries). Values are stripped and joined with a separator that
+    cannot appear in them, then hashed to 64 hex characters so the key fits a
+    unique index regardless of description length.
+    """
+    parts = (contact, account, amount, txn_time, description)
+    raw = "\x1f".join(str(part or '').strip() for part in parts)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
 class SMSLog(models.Model):
     account_name = models.CharField(max_length=255)
     phone_number = models.CharField(max_length=15)
@@ -78,6 +94,66 @@ class GregSchoolSMSLog(models.Model):
     response_data = models.JSONField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     status = models.CharField(max_length=50, null=True, blank=True)
+    # Only set on SENT rows, so failed attempts never block a later resend.
+    dedupe_key = models.CharField(max_length=64, unique=True, null=True, blank=True, editable=False)
+
+    def __str__(self):
+        return f"GregSchoolSMSLog for {self.acct_nm} ({self.contact})"
+
+class SMSOutbox(models.Model):
+    """One SMS waiting to be sent, written by a campaign and drained by workers.
+
+    `idempotency_key` identifies the message within its campaign run, so a
+    retried campaign task re-inserting the same records adds nothing.
+    DEFERRED rows were refused by an open gateway circuit and wait in the
+    spool for `replay_deferred_sms`.
+    """
+
+    PENDING = 'PENDING'
+    SENDING = 'SENDING'
+    SENT = 'SENT'
+    FAILED = 'FAILED'
+    DEFERRED = 'DEFERRED'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (SENDING, 'Sending'),
+        (SENT, 'Sent'),
+        (FAILED, 'Failed'),
+        (DEFERRED, 'Deferred'),
+    ]
+
+    campaign = models.CharField(max_length=50)
+    message_type = models.CharField(max_length=50, null=True, blank=True)
+    payload = models.JSONField()
+    idempotency_key = models.CharField(max_length=64, unique=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'id'], name='smsoutbox_status_id_idx'),
+            models.Index(fields=['status', 'claimed_at'], name='smsoutbox_status_claimed_idx'),
+        ]
+
+    def __str__(self):
+        return f"SMSOutbox {self.campaign} #{self.pk} ({self.status})"
+
+
+class FeedWatermark(models.Model):
+    """High-water mark of an incrementally processed ESB feed.
+
+    Records at or below (`last_txn_time`, `last_reference`) have already been
+    handled and are skipped by the next run.
+    """
+
+    feed = models.CharField(max_length=50, unique=True)
+    last_txn_time = models.DateTimeField(null=True, blank=True)
+    last_reference = models.CharField(max_length=255, blank=True, default='')
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
-        return f"GregSchoolSMSLog for {self.acct_nm} ({self.contact})"
\ No newline at end of file
+        return f"FeedWatermark {self.feed} @ {self.last_txn_time} ({self.last_reference})"
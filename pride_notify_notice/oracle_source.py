@@ -0,0 +1,165 @@
+import json
+import os
+import threading
+from datetime import date, datetime
+from decimal import Decimal
+
+import oracledb
+from cryptography.fernet import Fernet
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .esb import ENVELOPE_KEYS, get_feed_config, payload_records
+
+
+# A campaign feed is read straight from the PRIDELIVE views instead of the
+# ESB when its ESB_FEEDS entry has 'source': 'oracle'. The query comes from
+# the entry's 'oracle_query', falling back to ORACLE_QUERIES below.
+ORACLE_QUERIES = {
+    'loans_due': "SELECT * FROM PRIDELIVE.V_LOAN_DUE_3DAYS",
+}
+
+# `arraysize` rows come back per round trip and `prefetchrows` ride along
+# with the execute itself; `batch_size` rows are handed out per fetchmany().
+DEFAULT_ORACLE_SOURCE = {
+    'class': 'pride_notify_notice.oracle_source.OracleSource',
+    'options': {
+        'pool_min': 1,
+        'pool_max': 4,
+        'pool_increment': 1,
+        'arraysize': 5000,
+        'prefetchrows': 5001,
+        'batch_size': 5000,
+    },
+}
+
+
+def get_oracle_source_config():
+    config = dict(DEFAULT_ORACLE_SOURCE)
+    overrides = getattr(settings, 'ORACLE_SOURCE', {})
+    config['options'] = dict(config['options'], **overrides.get('options', {}))
+    if overrides.get('class'):
+        config['class'] = overrides['class']
+    return config
+
+
+def uses_oracle(feed_name):
+    return get_feed_config(feed_name).get('source', 'esb') == 'oracle'
+
+
+def oracle_query(feed_name):
+    query = get_feed_config(feed_name).get('oracle_query') or ORACLE_QUERIES.get(feed_name)
+    if not query:
+        raise ValueError(f"No Oracle query configured for feed '{feed_name}'.")
+    return query
+
+
+def _json_value(value):
+    """Convert Oracle column values to what the ESB JSON would have carried."""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+
+class OracleSource:
+    """Reads campaign feeds from the PRIDELIVE views through an oracledb pool.
+
+    Rows are fetched with a server-side cursor in `batch_size` batches and
+    yielded as dicts keyed by column name, so a campaign never holds the
+    whole view in memory. Credentials are the Fernet-encrypted
+    ORACLE_DATABASE_* variables.
+    """
+
+    def __init__(self, pool_min=1, pool_max=4, pool_increment=1, arraysize=5000, prefetchrows=5001, batch_size=5000):
+        encryption_key = os.getenv("ENCRYPTION_KEY")
+        if encryption_key is None:
+            raise ValueError("Encryption key not found. Set ENCRYPTION_KEY in your environment variables.")
+        self._cipher = Fernet(encryption_key.encode())
+
+        self.arraysize = arraysize
+        self.prefetchrows = prefetchrows
+        self.batch_size = batch_size
+        self.pool = oracledb.create_pool(
+            user=self._decrypt_env("ORACLE_DATABASE_USER"),
+            password=self._decrypt_env("ORACLE_DATABASE_PASSWORD"),
+            dsn=oracledb.makedsn(
+                self._decrypt_env("ORACLE_DATABASE_HOST"),
+                int(self._decrypt_env("ORACLE_DATABASE_PORT")),
+                service_name=self._decrypt_env("ORACLE_DATABASE_SERVICE_NAME"),
+            ),
+            min=pool_min,
+            max=pool_max,
+            increment=pool_increment,
+        )
+
+    def _decrypt_env(self, name):
+        value = os.getenv(name)
+        if value is None:
+            raise ValueError(f"{name} not found. Set {name} in your environment variables.")
+        return self._cipher.decrypt(value.encode()).decode()
+
+    def iter_records(self, feed_name, params=None):
+        """Yield the rows of `feed_name`'s view as dicts, one fetchmany() batch at a time."""
+        with self.pool.acquire() as connection:
+            with connection.cursor() as cursor:
+                cursor.arraysize = self.arraysize
+                cursor.prefetchrows = self.prefetchrows
+                cursor.execute(oracle_query(feed_name), params or {})
+                columns = [column[0] for column in cursor.description]
+                while True:
+                    rows = cursor.fetchmany(self.batch_size)
+                    if not rows:
+                        break
+                    for row in rows:
+                        yield {column: _json_value(value) for column, value in zip(columns, row)}
+
+    def close(self):
+        self.pool.close()
+
+
+class FixtureOracleSource:
+    """Local stand-in for `OracleSource` reading `<directory>/<feed>.json`.
+
+    The file holds the records as a JSON array or as an ESB-style envelope.
+    Select it with ORACLE_SOURCE = {'class': '...FixtureOracleSource',
+    'options': {'directory': ...}}.
+    """
+
+    def __init__(self, directory, **options):
+        self.directory = str(directory)
+
+    def iter_records(self, feed_name, params=None):
+        with open(os.path.join(self.directory, f"{feed_name}.json")) as fh:
+            _, records = payload_records(json.load(fh), ENVELOPE_KEYS)
+        yield from records
+
+    def close(self):
+        pass
+
+
+_source = None
+_source_pid = None
+_source_lock = threading.Lock()
+
+
+def get_oracle_source():
+    """Return the process-wide Oracle source, building it (and its pool) on first use.
+
+    Rebuilt after a fork, like the ESB client.
+    """
+    global _source, _source_pid
+
+    pid = os.getpid()
+    if _source is not None and _source_pid == pid:
+        return _source
+
+    with _source_lock:
+        if _source is None or _source_pid != pid:
+            config = get_oracle_source_config()
+            _source = import_string(config['class'])(**config['options'])
+            _source_pid = pid
+    return _source
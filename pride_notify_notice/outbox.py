@@ -0,0 +1,187 @@
+import hashlib
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import SMSOutbox
+
+
+DEFAULT_SMS_OUTBOX = {
+    'batch_size': 200,
+    'claim_timeout': 900,
+    'max_attempts': 3,
+}
+
+
+def get_outbox_config():
+    config = dict(DEFAULT_SMS_OUTBOX)
+    config.update(getattr(settings, 'SMS_OUTBOX', {}))
+    return config
+
+
+def outbox_enabled():
+    return getattr(settings, 'SMS_USE_OUTBOX', False)
+
+
+def outbox_key(campaign, run_key, record):
+    """Idempotency key for `record` in one run of `campaign`.
+
+    `run_key` scopes the key (the local date by default) so tomorrow's run of
+    a daily campaign can send the same record again, while a retry of today's
+    run finds every row already queued.
+    """
+    body = json.dumps(record, sort_keys=True, default=str)
+    raw = f"{campaign}\x1f{run_key}\x1f{body}"
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def enqueue_campaign(records, campaign, message_type=None, run_key=None, status=SMSOutbox.PENDING):
+    """Insert a campaign's records as outbox rows (PENDING unless `status` says otherwise).
+
+    Rows whose key already exists are ignored. Returns the number of records
+    that were new to the outbox.
+    """
+    if run_key is None:
+        run_key = timezone.localdate().isoformat()
+
+    batch_size = get_outbox_config()['batch_size']
+    keyed = {}
+    for record in records:
+        keyed.setdefault(outbox_key(campaign, run_key, record), record)
+
+    keys = list(keyed)
+    queued = set()
+    for start in range(0, len(keys), batch_size):
+        queued.update(
+            SMSOutbox.objects.filter(idempotency_key__in=keys[start:start + batch_size])
+            .values_list('idempotency_key', flat=True)
+        )
+
+    rows = [
+        SMSOutbox(
+            campaign=campaign,
+            message_type=message_type,
+            payload=record,
+            idempotency_key=key,
+            status=status,
+        )
+        for key, record in keyed.items()
+        if key not in queued
+    ]
+    # ignore_conflicts covers a concurrent enqueue of the same run.
+    SMSOutbox.objects.bulk_create(rows, batch_size=batch_size, ignore_conflicts=True)
+    return len(rows)
+
+
+def claim_outbox_batch(batch_size):
+    """Claim up to `batch_size` PENDING rows for this worker.
+
+    Rows are locked with SELECT ... FOR UPDATE SKIP LOCKED, so concurrent
+    drainers on other workers each get a disjoint batch instead of waiting on
+    one another, and flipped to SENDING before the lock is released.
+    """
+    with transaction.atomic():
+        rows = list(
+            SMSOutbox.objects.select_for_update(skip_locked=True)
+            .filter(status=SMSOutbox.PENDING)
+            .order_by('id')[:batch_size]
+        )
+        if not rows:
+            return []
+
+        now = timezone.now()
+        SMSOutbox.objects.filter(pk__in=[row.pk for row in rows]).update(
+            status=SMSOutbox.SENDING,
+            claimed_at=now,
+            attempts=F('attempts') + 1,
+        )
+        for row in rows:
+            row.status = SMSOutbox.SENDING
+            row.claimed_at = now
+            row.attempts += 1
+    return rows
+
+
+def release_stale_claims():
+    """Return rows stuck in SENDING after a worker died mid-batch.
+
+    A row is retried until it has been claimed `max_attempts` times, then
+    marked FAILED. The worker may have sent the SMS before dying, so a
+    reclaimed row can be delivered twice; that is preferred to dropping it.
+    """
+    config = get_outbox_config()
+    cutoff = timezone.now() - timedelta(seconds=config['claim_timeout'])
+    stale = SMSOutbox.objects.filter(status=SMSOutbox.SENDING, claimed_at__lt=cutoff)
+
+    failed = stale.filter(attempts__gte=config['max_attempts']).update(
+        status=SMSOutbox.FAILED,
+        last_error="Claim expired too many times.",
+    )
+    released = stale.update(status=SMSOutbox.PENDING, claimed_at=None)
+    return released, failed
+
+
+def claim_deferred_probe(message_types):
+    """Claim the oldest DEFERRED row of `message_types` to probe its gateway with."""
+    with transaction.atomic():
+        row = (
+            SMSOutbox.objects.select_for_update(skip_locked=True)
+            .filter(status=SMSOutbox.DEFERRED, message_type__in=message_types)
+            .order_by('id')
+            .first()
+        )
+        if row is None:
+            return None
+        row.status = SMSOutbox.SENDING
+        row.claimed_at = timezone.now()
+        row.attempts += 1
+        row.save(update_fields=['status', 'claimed_at', 'attempts'])
+    return row
+
+
+def release_deferred(message_types):
+    """Move every DEFERRED row of `message_types` back to PENDING."""
+    return SMSOutbox.objects.filter(
+        status=SMSOutbox.DEFERRED,
+        message_type__in=message_types,
+    ).update(status=SMSOutbox.PENDING, claimed_at=None)
+
+
+def finish_outbox_rows(rows, results):
+    """Record the outcome of each claimed row from its send response."""
+    now = timezone.now()
+    for row, response in zip(rows, results):
+        if send_deferred(response):
+            row.status = SMSOutbox.DEFERRED
+            row.last_error = str(response['response_data']['deferred'])
+            continue
+
+        error = send_error(response)
+        if error is None:
+            row.status = SMSOutbox.SENT
+            row.sent_at = now
+            row.last_error = None
+        else:
+            row.status = SMSOutbox.FAILED
+            row.last_error = error
+
+    SMSOutbox.objects.bulk_update(rows, ['status', 'sent_at', 'last_error'])
+
+
+def send_deferred(response):
+    """True if `send_sms_to_api` held the message back because the gateway circuit is open."""
+    return bool(response) and response.get('status') == 'deferred'
+
+
+def send_error(response):
+    """Return the error text of a `send_sms_to_api` response, or None on success."""
+    if not response:
+        return "No response from send."
+    data = response.get('response_data')
+    if isinstance(data, dict) and 'error' in data:
+        return str(data['error'])
+    return None
@@ -0,0 +1,293 @@
+import os
+import threading
+import time
+
+import redis
+from django.conf import settings
+
+from .circuit_breaker import CircuitBreaker
+
+
+DEFAULT_GATEWAY_LIMITS = {
+    'rate': 10.0,
+    'burst': 20,
+    'initial_concurrency': 4,
+    'min_concurrency': 1,
+    'max_concurrency': 16,
+    'additive_increase': 1.0,
+    'multiplicative_decrease': 0.5,
+    'latency_target': 2.0,
+    'failure_threshold': 5,
+    'reset_timeout': 60.0,
+    'half_open_max_calls': 1,
+}
+
+# Token bucket refill and take in one round trip. The bucket state lives in a
+# Redis hash so every Celery worker draws from the same budget; the clock is
+# the Redis server's so worker clock skew does not matter. Returns the number
+# of seconds to wait (as a string, to keep the fraction) or "0" when a token
+# was taken.
+TOKEN_BUCKET_SCRIPT = """
+if redis.replicate_commands then redis.replicate_commands() end
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 60)
+return tostring(wait)
+"""
+
+
+class LocalTokenBucket:
+    """In-process token bucket used when Redis cannot be reached."""
+
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self._tokens = self.burst
+        self._ts = time.monotonic()
+        self._lock = threading.Lock()
+
+    def try_take(self):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._ts) * self.rate)
+            self._ts = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+
+class RedisTokenBucket:
+    """Token bucket shared by every worker through the Redis broker.
+
+    If Redis is unavailable the bucket degrades to a per-process
+    `LocalTokenBucket` for `REDIS_RETRY_AFTER` seconds so sending slows down
+    instead of stopping, and without paying a connect timeout per message.
+    """
+
+    REDIS_RETRY_AFTER = 30.0
+
+    def __init__(self, name, rate, burst, redis_url):
+        self.key = f"sms:rate:{name}"
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self._local = LocalTokenBucket(rate, burst)
+        self._redis_down_until = 0.0
+        try:
+            client = redis.Redis.from_url(redis_url, socket_timeout=1, socket_connect_timeout=1)
+            self._script = client.register_script(TOKEN_BUCKET_SCRIPT)
+        except ValueError as exc:
+            print(f"Rate limiter cannot use {redis_url!r} for {self.key}, using local bucket: {exc}")
+            self._script = None
+
+    def try_take(self):
+        if self._script is None or time.monotonic() < self._redis_down_until:
+            return self._local.try_take()
+        try:
+            return float(self._script(keys=[self.key], args=[self.rate, self.burst]))
+        except redis.RedisError as exc:
+            print(f"Rate limiter Redis error for {self.key}, using local bucket: {exc}")
+            self._redis_down_until = time.monotonic() + self.REDIS_RETRY_AFTER
+            return self._local.try_take()
+
+    def take(self):
+        """Block until a token is available."""
+        while True:
+            wait = self.try_take()
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+
+class AIMDLimiter:
+    """Additive-increase / multiplicative-decrease concurrency limit.
+
+    Every successful call that finishes within `latency_target` seconds grows
+    the limit by `additive_increase / limit` (about one extra slot per full
+    window of calls). An error or a slow call multiplies the limit by
+    `multiplicative_decrease`, at most once per `latency_target` seconds so a
+    burst of failures from one window only backs off once.
+    """
+
+    def __init__(self, initial_concurrency, min_concurrency, max_concurrency,
+                 additive_increase, multiplicative_decrease, latency_target):
+        self.min_limit = float(min_concurrency)
+        self.max_limit = float(max_concurrency)
+        self.limit = min(max(float(initial_concurrency), self.min_limit), self.max_limit)
+        self.additive_increase = float(additive_increase)
+        self.multiplicative_decrease = float(multiplicative_decrease)
+        self.latency_target = float(latency_target)
+
+        self.in_flight = 0
+        self.successes = 0
+        self.errors = 0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+
+    def cancel(self):
+        """Give a slot back without feeding an outcome into the limit."""
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    def release(self, ok, latency):
+        with self._cond:
+            self.in_flight -= 1
+            now = time.monotonic()
+
+            if ok and latency <= self.latency_target:
+                self.successes += 1
+                self.limit = min(self.max_limit, self.limit + self.additive_increase / self.limit)
+            else:
+                if not ok:
+                    self.errors += 1
+                if now - self._last_decrease >= self.latency_target:
+                    self.limit = max(self.min_limit, self.limit * self.multiplicative_decrease)
+                    self._last_decrease = now
+
+            self._cond.notify_all()
+
+
+class _Slot:
+    def __init__(self):
+        self.ok = True
+
+    def record_status(self, status_code):
+        """Mark the call as failed when the gateway throttled or errored."""
+        if status_code == 429 or status_code >= 500:
+            self.ok = False
+
+    def fail(self):
+        self.ok = False
+
+
+class GatewayThrottle:
+    """Rate and concurrency control for one outbound SMS gateway.
+
+        with get_gateway_throttle('moonlight').slot() as slot:
+            resp = client.request(...)
+            slot.record_status(resp.status)
+
+    Entering the block first asks the gateway's circuit breaker, raising
+    `CircuitOpenError` at once while the gateway is known to be down, then
+    waits for a concurrency slot and a rate token. Leaving it feeds the
+    outcome and latency back into the AIMD limit and the breaker. Exceptions
+    count as errors and are re-raised.
+    """
+
+    def __init__(self, name, config, redis_url):
+        self.name = name
+        self.bucket = RedisTokenBucket(name, config['rate'], config['burst'], redis_url)
+        self.limiter = AIMDLimiter(
+            initial_concurrency=config['initial_concurrency'],
+            min_concurrency=config['min_concurrency'],
+            max_concurrency=config['max_concurrency'],
+            additive_increase=config['additive_increase'],
+            multiplicative_decrease=config['multiplicative_decrease'],
+            latency_target=config['latency_target'],
+        )
+        self.breaker = CircuitBreaker(
+            name,
+            failure_threshold=config['failure_threshold'],
+            reset_timeout=config['reset_timeout'],
+            half_open_max_calls=config['half_open_max_calls'],
+        )
+
+    def slot(self):
+        return _ThrottledCall(self)
+
+    def stats(self):
+        stats = {
+            'gateway': self.name,
+            'concurrency_limit': round(self.limiter.limit, 2),
+            'in_flight': self.limiter.in_flight,
+            'successes': self.limiter.successes,
+            'errors': self.limiter.errors,
+        }
+        stats.update(self.breaker.stats())
+        return stats
+
+
+class _ThrottledCall:
+    def __init__(self, throttle):
+        self.throttle = throttle
+        self.slot = _Slot()
+        self.started = None
+
+    def __enter__(self):
+        breaker = self.throttle.breaker
+        breaker.before_call()
+        try:
+            self.throttle.limiter.acquire()
+        except BaseException:
+            breaker.cancel_call()
+            raise
+        try:
+            self.throttle.bucket.take()
+        except BaseException:
+            self.throttle.limiter.cancel()
+            breaker.cancel_call()
+            raise
+        self.started = time.monotonic()
+        return self.slot
+
+    def __exit__(self, exc_type, exc, tb):
+        ok = exc_type is None and self.slot.ok
+        self.throttle.limiter.release(ok, time.monotonic() - self.started)
+        if ok:
+            self.throttle.breaker.record_success()
+        else:
+            self.throttle.breaker.record_failure()
+        return False
+
+
+_throttles = {}
+_throttles_pid = None
+_throttles_lock = threading.Lock()
+
+
+def get_gateway_throttle(name):
+    """Return the process-wide throttle for gateway `name`.
+
+    Limits come from `settings.SMS_GATEWAY_LIMITS[name]` on top of
+    `DEFAULT_GATEWAY_LIMITS`; the shared bucket lives in
+    `settings.SMS_RATE_LIMIT_REDIS_URL` (the Celery broker by default).
+    """
+    global _throttles, _throttles_pid
+
+    with _throttles_lock:
+        if _throttles_pid != os.getpid():
+            _throttles = {}
+            _throttles_pid = os.getpid()
+
+        throttle = _throttles.get(name)
+        if throttle is None:
+            config = dict(DEFAULT_GATEWAY_LIMITS)
+            config.update(getattr(settings, 'SMS_GATEWAY_LIMITS', {}).get(name, {}))
+            redis_url = getattr(
+                settings,
+                'SMS_RATE_LIMIT_REDIS_URL',
+                getattr(settings, 'CELERY_BROKER_URL', 'redis://localhost:6379/0'),
+            )
+            throttle = GatewayThrottle(name, config, redis_url)
+            _throttles[name] = throttle
+        return throttle
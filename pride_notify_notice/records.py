@@ -0,0 +1,171 @@
+from collections import Counter, namedtuple
+from datetime import datetime
+
+from dateutil.parser import parse
+
+
+def to_amount(value):
+    """ESB amount -> float; blank or unparseable values count as 0.0."""
+    if value in (None, ''):
+        return 0.0
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(str(value).replace(',', ''))
+    except ValueError:
+        return 0.0
+
+
+def to_optional_amount(value):
+    """Like `to_amount`, but None for blank values so callers can fall back."""
+    if value in (None, ''):
+        return None
+    return to_amount(value)
+
+
+def to_strict_amount(value):
+    """Like `to_amount`, but rejects the row when the value is not a number."""
+    if value in (None, ''):
+        return 0.0
+    return float(str(value).replace(',', ''))
+
+
+def to_datetime(value):
+    """ESB timestamp -> datetime, or None. ISO strings skip dateutil."""
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        return value
+    text = str(value)
+    try:
+        return datetime.fromisoformat(text)
+    except ValueError:
+        pass
+    try:
+        return parse(text)
+    except (ValueError, OverflowError):
+        return None
+
+
+def to_text(value):
+    return '' if value is None else str(value).strip()
+
+
+def to_str(value):
+    return '' if value is None else str(value)
+
+
+def to_raw(value):
+    return value if value is not None else ''
+
+
+class Field:
+    """One typed attribute of a record: read from the first non-empty `keys`."""
+
+    __slots__ = ('name', 'keys', 'parser', 'required')
+
+    def __init__(self, name, keys, parser=to_raw, required=False):
+        self.name = name
+        self.keys = (keys,) if isinstance(keys, str) else tuple(keys)
+        self.parser = parser
+        self.required = required
+
+
+class RecordSchema:
+    """Turns raw ESB rows into namedtuples with parsed, typed fields.
+
+    Each row is parsed exactly once. Rows that are not objects, or whose
+    required fields are missing or unparseable, are dropped and counted by
+    reason rather than failing one by one further down the pipeline.
+    """
+
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = tuple(fields)
+        self.record = namedtuple(f"{name.title().replace('_', '')}Record", [f.name for f in self.fields])
+
+    def parse_row(self, row):
+        values = []
+        for field in self.fields:
+            raw = None
+            for key in field.keys:
+                raw = row.get(key)
+                if raw not in (None, ''):
+                    break
+            if field.required and raw in (None, ''):
+                raise ValueError(f"missing {field.keys[0]}")
+            try:
+                value = field.parser(raw)
+            except (TypeError, ValueError):
+                raise ValueError(f"invalid {field.keys[0]}") from None
+            if field.required and value is None:
+                raise ValueError(f"invalid {field.keys[0]}")
+            values.append(value)
+        return self.record._make(values)
+
+    def parse(self, rows):
+        """Return (records, Counter of rejection reasons)."""
+        records = []
+        rejected = Counter()
+        parse_row = self.parse_row
+        for row in rows:
+            if not isinstance(row, dict):
+                rejected['not a record'] += 1
+                continue
+            try:
+                records.append(parse_row(row))
+            except ValueError as exc:
+                rejected[str(exc)] += 1
+        if rejected:
+            summary = ', '.join(f"{count} {reason}" for reason, count in rejected.most_common())
+            print(f"Rejected {sum(rejected.values())} of {len(records) + sum(rejected.values())} {self.name} rows: {summary}")
+        return records, rejected
+
+
+ESCROW_STATEMENT = RecordSchema('escrow_statement', [
+    Field('tran_dt', 'TRAN_DT', to_datetime),
+    Field('value_dt', 'VALUE_DT', to_datetime),
+    Field('tran_desc', 'TRAN_DESC'),
+    Field('reference', 'TRAN_REF_TXT'),
+    Field('bank_ref', 'SETTLEMENT_BANK_REF'),
+    Field('dr_cr_ind', 'DR_CR_IND', to_text),
+    Field('debit', 'DEBIT_AMT', to_amount),
+    Field('credit', 'CREDIT_AMT', to_amount),
+    Field('balance', 'STMNT_BAL', to_amount),
+    Field('closing_balance', 'CLOSING_BAL', to_optional_amount),
+    Field('cbs_status', 'CBS_Status'),
+    Field('prefunding', 'PREFUNDING_BRANCH', to_text),
+    Field('posted_by', ('POSTED_BY', 'USER_NAME'), to_text),
+    Field('branch', 'BU_NM', to_text),
+    Field('msisdn', 'CONTACT', to_text),
+])
+
+INTERSWITCH_REPORT = RecordSchema('interswitch_report', [
+    Field('tran_dt', 'TRAN_DT', to_datetime),
+    Field('timestamp', 'TIMESTAMP', to_datetime),
+    Field('value_dt', 'VALUE_DT', to_datetime),
+    Field('tran_desc', 'TRAN_DESC'),
+    Field('reference', 'TRAN_REF_TXT', to_str),
+    Field('recipient_account', 'RECIPIENT_ACCOUNT', to_str),
+    Field('recipient', 'RECIPIENT_NAME'),
+    Field('dr_cr_ind', 'DR_CR_IND'),
+    Field('debit', 'DEBIT_AMT', to_amount),
+    Field('credit', 'CREDIT_AMT', to_amount),
+    Field('balance', 'STMNT_BAL', to_amount),
+    Field('opening_balance', 'OPENING_BAL', to_amount),
+])
+
+URA_REPORT = RecordSchema('ura_report', [
+    Field('tran_dt', 'TRAN_DT', to_datetime),
+    Field('effective_dt', 'EFFECTIVE_DT', to_datetime),
+    Field('user_name', 'USER_NAME', to_text),
+    Field('tran_desc', 'TRAN_DESC'),
+    Field('prn', 'PRN'),
+    Field('tin', 'TIN'),
+    Field('reference', 'TRAN_REF_TXT'),
+    Field('contra_acct_no', 'CONTRA_ACCT_NO'),
+    Field('user_bu', 'USER_BU'),
+    Field('debit', 'DEBIT_AMT', to_strict_amount),
+    Field('credit', 'CREDIT_AMT', to_strict_amount),
+    Field('payment_type', 'PAYMENT_TYPE'),
+])
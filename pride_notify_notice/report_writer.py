@@ -0,0 +1,189 @@
+from copy import copy
+
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Border, NamedStyle, Side
+from openpyxl.styles.borders import DEFAULT_BORDER
+from openpyxl.styles.fills import DEFAULT_EMPTY_FILL
+from openpyxl.styles.fonts import DEFAULT_FONT
+from openpyxl.utils import get_column_letter
+from openpyxl.worksheet.cell_range import CellRange
+
+
+THIN_SIDE = Side(style='thin')
+THIN_BORDER = Border(left=THIN_SIDE, right=THIN_SIDE, top=THIN_SIDE, bottom=THIN_SIDE)
+MONEY_FORMAT = '#,##0.00'
+TEXT_FORMAT = '@'
+
+
+class CellStyle:
+    """Font, fill, border, alignment and number format applied to a cell as one unit.
+
+    A style with a `name` is registered in each workbook it is written to
+    as a NamedStyle and assigned to cells by that name, so the reports
+    share one catalogue of styles instead of per-cell formatting.
+    """
+
+    __slots__ = ('font', 'fill', 'border', 'alignment', 'number_format', 'name')
+
+    def __init__(self, font=None, fill=None, border=None, alignment=None, number_format=None, name=None):
+        self.font = font
+        self.fill = fill
+        self.border = border
+        self.alignment = alignment
+        self.number_format = number_format
+        self.name = name
+
+    def replace(self, **changes):
+        """A copy with `changes` applied. The copy is anonymous unless given a `name`."""
+        values = {name: getattr(self, name) for name in self.__slots__}
+        values['name'] = None
+        values.update(changes)
+        return CellStyle(**values)
+
+    def apply(self, cell):
+        for name in ('font', 'fill', 'border', 'alignment', 'number_format'):
+            value = getattr(self, name)
+            if value is not None:
+                setattr(cell, name, value)
+
+    def named_style(self):
+        """A new NamedStyle for one workbook; unset parts take the workbook defaults."""
+        return NamedStyle(
+            name=self.name,
+            font=self.font or DEFAULT_FONT,
+            fill=self.fill or DEFAULT_EMPTY_FILL,
+            border=self.border or DEFAULT_BORDER,
+            alignment=self.alignment,
+            number_format=self.number_format,
+        )
+
+
+def _merge_ranges(merge):
+    if not merge:
+        return ()
+    if isinstance(merge[0], int):
+        return (merge,)
+    return merge
+
+
+class ColumnWidths:
+    """Measuring pass of a report layout: tracks the widest value per column.
+
+    Mirrors the old auto-fit over a finished sheet: width is the longest
+    str(value) plus `padding`, capped at `max_width`. With `skip_falsy`,
+    blank and zero values are not measured.
+    """
+
+    def __init__(self, padding=2, max_width=None, skip_falsy=True):
+        self.padding = padding
+        self.max_width = max_width
+        self.skip_falsy = skip_falsy
+        self.next_row = 1
+        self._lengths = []
+
+    def append(self, values=(), styles=None, merge=None, fit=True):
+        self.next_row += 1
+        if not fit:
+            return
+        lengths = self._lengths
+        last_col = len(values)
+        for first, last in _merge_ranges(merge):
+            last_col = max(last_col, last)
+        if last_col > len(lengths):
+            lengths.extend([0] * (last_col - len(lengths)))
+
+        for col, value in enumerate(values):
+            if value is None or (self.skip_falsy and not value):
+                continue
+            length = len(str(value))
+            if length > lengths[col]:
+                lengths[col] = length
+
+    def widths(self):
+        widths = {}
+        for col, length in enumerate(self._lengths, start=1):
+            width = length + self.padding
+            if self.max_width is not None:
+                width = min(width, self.max_width)
+            widths[get_column_letter(col)] = width
+        return widths
+
+
+class StreamingSheet:
+    """Writing pass of a report layout over a write-only worksheet.
+
+    Rows are styled as they are appended and go straight to disk. A style
+    is resolved against the workbook once (named styles are registered on
+    first use), then copied onto each cell.
+    """
+
+    def __init__(self, ws):
+        self.ws = ws
+        self.next_row = 1
+        self._resolved = {}
+
+    def _cell(self, value, style):
+        cell = WriteOnlyCell(self.ws, value)
+        resolved = self._resolved.get(style)
+        if resolved is None:
+            if style.name is None:
+                style.apply(cell)
+            else:
+                wb = self.ws.parent
+                if style.name not in wb.named_styles:
+                    wb.add_named_style(style.named_style())
+                cell.style = style.name
+            self._resolved[style] = copy(cell._style)
+        else:
+            cell._style = copy(resolved)
+        return cell
+
+    def append(self, values=(), styles=None, merge=None, fit=True):
+        """Append one row.
+
+        `styles` is a CellStyle for every cell or a sequence of them (None
+        for unstyled) matching `values`; a styled None still gets a cell.
+        `merge` is a (first, last) column pair, or a sequence of them.
+        Rows appended with `fit=False` do not count towards column widths.
+        """
+        if styles is None:
+            row = list(values)
+        elif isinstance(styles, CellStyle):
+            row = [self._cell(value, styles) for value in values]
+        else:
+            row = [
+                value if style is None else self._cell(value, style)
+                for value, style in zip(values, styles)
+            ]
+            row.extend(values[len(row):])
+        self.ws.append(row)
+
+        for first, last in _merge_ranges(merge):
+            self.ws.merged_cells.add(CellRange(
+                min_col=first, min_row=self.next_row, max_col=last, max_row=self.next_row,
+            ))
+        self.next_row += 1
+
+
+def write_report(path, sheet_title, layout, column_widths=None, **measure):
+    """Stream a one-sheet report to `path` (a filename or a binary file) in openpyxl write-only mode.
+
+    `layout(out)` appends the rows to `out`. Column widths must be known
+    before the first row is written, so unless `column_widths` ({'A': 18,
+    ...}) is given, `layout` first runs against a `ColumnWidths` (built with
+    `measure`) and then again against the sheet. Neither pass keeps rows in
+    memory.
+    """
+    if column_widths is None:
+        measured = ColumnWidths(**measure)
+        layout(measured)
+        column_widths = measured.widths()
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(sheet_title)
+    for letter, width in column_widths.items():
+        ws.column_dimensions[letter].width = width
+    layout(StreamingSheet(ws))
+    wb.save(path)
+    return path
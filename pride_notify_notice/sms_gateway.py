@@ -0,0 +1,117 @@
+import os
+import threading
+
+import urllib3
+from django.conf import settings
+from urllib3.util import Retry, Timeout
+
+
+DEFAULT_MOONLIGHT_HTTP_POOL = {
+    'pool_maxsize': 16,
+    'connect_timeout': 5.0,
+    'read_timeout': 15.0,
+    'retries': 2,
+    'backoff_factor': 0.5,
+    'status_forcelist': (),
+}
+
+
+class MoonlightClient:
+    """Keep-alive HTTP client for the Moonlight SMS endpoint.
+
+    One instance is shared by every send in a worker process so consecutive
+    SMS reuse the same TCP/TLS connections instead of paying a handshake per
+    message. Certificate checks stay disabled as before; `assert_hostname` is
+    not passed because urllib3 skips hostname matching under CERT_NONE anyway
+    and plain-http pools reject the keyword.
+
+    Retries only cover connection failures by default: a GET that reached
+    Moonlight may already have queued the SMS, so read errors are never
+    retried blindly.
+    """
+
+    def __init__(self, pool_maxsize, connect_timeout, read_timeout, retries,
+                 backoff_factor, status_forcelist=()):
+        self.pool_maxsize = pool_maxsize
+        self._http = urllib3.PoolManager(
+            maxsize=pool_maxsize,
+            block=True,
+            cert_reqs='CERT_NONE',
+            timeout=Timeout(connect=connect_timeout, read=read_timeout),
+            retries=Retry(
+                total=retries,
+                connect=retries,
+                read=0,
+                status=retries if status_forcelist else 0,
+                status_forcelist=status_forcelist,
+                backoff_factor=backoff_factor,
+                raise_on_status=False,
+            ),
+        )
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._errors = 0
+
+    def request(self, method, url, **kwargs):
+        with self._lock:
+            self._requests += 1
+        try:
+            return self._http.request(method, url, **kwargs)
+        except Exception:
+            with self._lock:
+                self._errors += 1
+            raise
+
+    def stats(self):
+        """Return request and connection reuse counters for this process."""
+        opened = 0
+        attempts = 0
+        pools = self._http.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            opened += pool.num_connections
+            attempts += pool.num_requests
+
+        return {
+            'requests': self._requests,
+            'errors': self._errors,
+            'http_attempts': attempts,
+            'connections_opened': opened,
+            'connections_reused': max(attempts - opened, 0),
+            'pool_maxsize': self.pool_maxsize,
+        }
+
+    def clear(self):
+        self._http.clear()
+
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+def get_moonlight_client():
+    """Return the process-wide Moonlight client, creating it on first use.
+
+    The client is rebuilt after a fork so prefork Celery children never share
+    sockets inherited from the parent process.
+    """
+    global _client, _client_pid
+
+    pid = os.getpid()
+    if _client is not None and _client_pid == pid:
+        return _client
+
+    with _client_lock:
+        if _client is None or _client_pid != pid:
+            config = dict(DEFAULT_MOONLIGHT_HTTP_POOL)
+            config.update(getattr(settings, 'MOONLIGHT_HTTP_POOL', {}))
+            _client = MoonlightClient(**config)
+            _client_pid = pid
+    return _client
+
+
+def moonlight_client_stats():
+    return get_moonlight_client().stats()
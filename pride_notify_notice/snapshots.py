@@ -0,0 +1,131 @@
+import gzip
+import json
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+
+# Each feed is kept as one gzipped JSON payload per business date under
+# `directory`/<feed>/<YYYY-MM-DD>.json.gz, with the ESB validators and fetch
+# time in a <YYYY-MM-DD>.meta.json sidecar. A snapshot checked against the ESB
+# less than `max_age` seconds ago is served without a request; an older one is
+# revalidated with If-None-Match/If-Modified-Since. Feeds can override
+# `max_age` with `snapshot_max_age` in ESB_FEEDS (0 always revalidates).
+DEFAULT_ESB_SNAPSHOTS = {
+    'enabled': False,
+    'directory': os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'var', 'esb_snapshots'),
+    'max_age': 6 * 60 * 60,
+    'retention_days': 7,
+}
+
+
+def get_snapshot_config():
+    config = dict(DEFAULT_ESB_SNAPSHOTS)
+    config.update(getattr(settings, 'ESB_SNAPSHOTS', {}))
+    return config
+
+
+class SnapshotStore:
+    """Gzipped ESB payloads on local disk, keyed by feed and business date.
+
+    Snapshots are written to a temporary file (mode 0600) and renamed into
+    place, so readers only ever see complete payloads.
+    """
+
+    def __init__(self, directory, max_age=6 * 60 * 60, retention_days=7):
+        self.directory = str(directory)
+        self.max_age = max_age
+        self.retention_days = retention_days
+
+    def _base(self, feed_name, business_date):
+        return os.path.join(self.directory, feed_name, business_date.isoformat())
+
+    def path(self, feed_name, business_date):
+        return self._base(feed_name, business_date) + '.json.gz'
+
+    def meta(self, feed_name, business_date):
+        """Sidecar metadata of a snapshot, or None if there is no snapshot."""
+        if not os.path.exists(self.path(feed_name, business_date)):
+            return None
+        try:
+            with open(self._base(feed_name, business_date) + '.meta.json') as fh:
+                return json.load(fh)
+        except (OSError, ValueError):
+            return None
+
+    def is_fresh(self, meta, max_age=None):
+        if meta is None:
+            return False
+        max_age = self.max_age if max_age is None else max_age
+        return time.time() - meta.get('checked_at', 0) < max_age
+
+    def open(self, feed_name, business_date):
+        return gzip.open(self.path(feed_name, business_date), 'rb')
+
+    def load(self, feed_name, business_date):
+        with self.open(feed_name, business_date) as fh:
+            return json.load(fh)
+
+    def touch(self, feed_name, business_date):
+        """Record that the ESB confirmed the snapshot is still current (HTTP 304)."""
+        meta = self.meta(feed_name, business_date) or {}
+        meta['checked_at'] = time.time()
+        self._write_meta(feed_name, business_date, meta)
+
+    @contextmanager
+    def writer(self, feed_name, business_date, etag=None, last_modified=None):
+        """Yield a binary file to write the payload to; it replaces the snapshot on success."""
+        folder = os.path.join(self.directory, feed_name)
+        os.makedirs(folder, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=folder, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as raw, gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=6) as out:
+                yield out
+            os.replace(tmp_path, self.path(feed_name, business_date))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+        now = time.time()
+        self._write_meta(feed_name, business_date, {
+            'etag': etag,
+            'last_modified': last_modified,
+            'fetched_at': now,
+            'checked_at': now,
+        })
+        self.prune(feed_name)
+
+    def _write_meta(self, feed_name, business_date, meta):
+        base = self._base(feed_name, business_date)
+        tmp_path = base + '.meta.tmp'
+        with open(tmp_path, 'w') as fh:
+            json.dump(meta, fh)
+        os.replace(tmp_path, base + '.meta.json')
+
+    def prune(self, feed_name):
+        """Delete snapshots of `feed_name` older than `retention_days`."""
+        folder = os.path.join(self.directory, feed_name)
+        cutoff = timezone.localdate() - timedelta(days=self.retention_days)
+        for name in os.listdir(folder):
+            try:
+                day = date.fromisoformat(name.split('.', 1)[0])
+            except ValueError:
+                continue
+            if day < cutoff:
+                try:
+                    os.remove(os.path.join(folder, name))
+                except OSError:
+                    pass
+
+
+def get_snapshot_store():
+    """The configured snapshot store, or None when ESB_SNAPSHOTS is disabled."""
+    config = get_snapshot_config()
+    if not config['enabled']:
+        return None
+    return SnapshotStore(config['directory'], config['max_age'], config['retention_days'])
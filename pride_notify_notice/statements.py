@@ -0,0 +1,458 @@
+from datetime import datetime
+
+from openpyxl.styles import Alignment, Font, PatternFill
+
+from .ledger import LedgerColumns, date_range, from_cents, to_cents
+from .report_writer import MONEY_FORMAT, TEXT_FORMAT, THIN_BORDER, CellStyle, write_report
+
+
+# Column kinds: how a record value is written and styled in the table.
+PLAIN = 'plain'
+TEXT = 'text'                        # kept as text ('@'), so long numbers never turn scientific
+MONEY = 'money'                      # '#,##0.00'
+DATE = 'date'                        # datetime field shown as dd/mm/yyyy
+SERIAL = 'serial'                    # 1-based row number
+RUNNING_BALANCE = 'running_balance'  # opening_balance + credits - debits so far (money)
+
+ZEBRA_COLOR = "F2F2F2"
+
+# The style catalogue every statement shares. Each style is registered in
+# the workbook under its name and cells are assigned to it by name.
+TITLE = CellStyle(font=Font(bold=True, size=14), alignment=Alignment(horizontal='center'), name='title')
+SUBTITLE = CellStyle(font=Font(italic=True), alignment=Alignment(horizontal='center'), name='subtitle')
+BOLD = CellStyle(font=Font(bold=True), name='bold')
+BOLD_LEFT = CellStyle(font=Font(bold=True), alignment=Alignment(horizontal='left'), name='bold-left')
+BOLD_RIGHT = CellStyle(font=Font(bold=True), alignment=Alignment(horizontal='right'), name='bold-right')
+BOLD_MONEY = CellStyle(font=Font(bold=True), number_format=MONEY_FORMAT, name='bold-money')
+ITALIC = CellStyle(font=Font(italic=True), name='italic')
+LEFT = CellStyle(alignment=Alignment(horizontal='left'), name='left')
+MONEY_CELL = CellStyle(number_format=MONEY_FORMAT, name='total')
+PANEL_LABEL = CellStyle(
+    font=Font(bold=True),
+    fill=PatternFill(start_color="EEF2F7", end_color="EEF2F7", fill_type="solid"),
+    border=THIN_BORDER,
+    alignment=Alignment(horizontal='left', vertical='center'),
+    name='label',
+)
+PANEL_VALUE = CellStyle(
+    fill=PatternFill(start_color="FFFFFF", end_color="FFFFFF", fill_type="solid"),
+    border=THIN_BORDER,
+    alignment=Alignment(horizontal='left', vertical='center'),
+    name='value',
+)
+TABLE_HEADER = CellStyle(
+    font=Font(bold=True), alignment=Alignment(horizontal='center'), border=THIN_BORDER, name='header',
+)
+TABLE_CELL = CellStyle(border=THIN_BORDER, name='cell')
+TABLE_MONEY = CellStyle(border=THIN_BORDER, number_format=MONEY_FORMAT, name='money')
+TABLE_TEXT = CellStyle(
+    border=THIN_BORDER, number_format=TEXT_FORMAT, alignment=Alignment(horizontal='left'), name='text',
+)
+
+
+def zebra(style, color=ZEBRA_COLOR):
+    """`style` on a striped row: 'zebra-money', or 'zebra-F7F7F7-money' for another colour."""
+    prefix = 'zebra' if color == ZEBRA_COLOR else f"zebra-{color}"
+    return style.replace(
+        fill=PatternFill(start_color=color, end_color=color, fill_type="solid"),
+        name=f"{prefix}-{style.name}",
+    )
+
+
+class Column:
+    """One table column: header label, source field of the record and kind.
+
+    `convert` is applied to the field value; `value(record)` replaces the
+    field lookup altogether for derived columns.
+    """
+
+    __slots__ = ('label', 'field', 'kind', 'convert', 'value')
+
+    def __init__(self, label, field=None, kind=PLAIN, convert=None, value=None):
+        self.label = label
+        self.field = field
+        self.kind = kind
+        self.convert = convert
+        self.value = value
+
+    def style(self):
+        if self.kind in (MONEY, RUNNING_BALANCE):
+            return TABLE_MONEY
+        if self.kind == TEXT:
+            return TABLE_TEXT
+        return TABLE_CELL
+
+
+# --- Sections: the rows of a statement, top to bottom. Text is formatted
+# with the render context (header fields, summary, `now`). ---
+
+class Line:
+    """One line of text, merged over `merge` columns (default: the table width)."""
+
+    def __init__(self, text, style=None, merge=None, fit=True):
+        self.text = text
+        self.style = style
+        self.merge = merge
+        self.fit = fit
+
+    def write(self, out, spec, records, context):
+        last = self.merge or spec.width
+        out.append([self.text.format(**context)], self.style, merge=(1, last), fit=self.fit)
+
+
+class Blank:
+    """A spacer row holding one empty string."""
+
+    def __init__(self, fit=True):
+        self.fit = fit
+
+    def write(self, out, spec, records, context):
+        out.append([""], fit=self.fit)
+
+
+class Gap:
+    """A spacer row without any cells."""
+
+    def write(self, out, spec, records, context):
+        out.append([])
+
+
+class Panel:
+    """Label/value pairs as two blocks side by side, values merged over B:C and F:H."""
+
+    def __init__(self, left, right):
+        self.left = left
+        self.right = right
+
+    def write(self, out, spec, records, context):
+        for (left_label, left_value), (right_label, right_value) in zip(self.left, self.right):
+            out.append(
+                [f"{left_label}:", left_value.format(**context), None, None,
+                 f"{right_label}:", right_value.format(**context)],
+                [PANEL_LABEL, PANEL_VALUE, None, None, PANEL_LABEL, PANEL_VALUE],
+                merge=[(2, 3), (6, 8)],
+            )
+
+
+class Totals:
+    """A label in column A and context values under the named table columns.
+
+    With `merge_label` the label spans every column before the first value.
+    `blank` fills the remaining cells up to the table width.
+    """
+
+    def __init__(self, label, values, label_style=BOLD, value_style=MONEY_CELL,
+                 merge_label=False, blank=None, fit=True):
+        self.label = label
+        self.values = values
+        self.label_style = label_style
+        self.value_style = value_style
+        self.merge_label = merge_label
+        self.blank = blank
+        self.fit = fit
+
+    def write(self, out, spec, records, context):
+        positions = {spec.column_index(field): key for field, key in self.values.items()}
+        width = spec.width if self.blank is not None else max(positions)
+        row = [self.label] + [self.blank] * (width - 1)
+        styles = [self.label_style] + [None] * (width - 1)
+        for col, key in positions.items():
+            row[col - 1] = context[key]
+            styles[col - 1] = self.value_style
+        merge = (1, min(positions) - 1) if self.merge_label else None
+        out.append(row, styles, merge=merge, fit=self.fit)
+
+
+class Table:
+    """The header row, then one row per record, bordered and zebra striped."""
+
+    def write(self, out, spec, records, context):
+        columns = spec.columns
+        out.append([column.label for column in columns], TABLE_HEADER)
+
+        balances = None
+        if spec.has_running_balance:
+            balances = context.get('running_balances')
+            if balances is None:
+                balances = spec.ledger(records).running_balances(to_cents(context.get('opening_balance', 0.0)))
+            balances = list(map(from_cents, balances))
+        row_styles, striped_styles = spec.row_styles, spec.striped_styles
+        for idx, record in enumerate(records, start=1):
+            row = []
+            for column in columns:
+                kind = column.kind
+                if kind == SERIAL:
+                    row.append(idx)
+                elif kind == RUNNING_BALANCE:
+                    row.append(balances[idx - 1])
+                elif column.value is not None:
+                    row.append(column.value(record))
+                else:
+                    value = getattr(record, column.field)
+                    if kind == DATE:
+                        value = value.strftime('%d/%m/%Y') if value else ''
+                    elif column.convert is not None:
+                        value = column.convert(value)
+                    row.append(value)
+            out.append(row, striped_styles if out.next_row % 2 == 0 else row_styles)
+
+
+class StatementSpec:
+    """Declarative layout of a one-sheet statement report.
+
+    `columns` describe the transaction table and `sections` the rows of the
+    sheet around it. `summarise` computes totals, counts, date ranges and
+    running balances over the records' ledger columns; `render` streams
+    the sheet through `report_writer.write_report`.
+    """
+
+    def __init__(self, sheet_title, columns=(), sections=(), zebra_color=ZEBRA_COLOR,
+                 max_width=None, skip_falsy=True, column_widths=None, date_ranges=None,
+                 debit_field='debit', credit_field='credit'):
+        self.sheet_title = sheet_title
+        self.columns = tuple(columns)
+        self.sections = tuple(sections)
+        self.max_width = max_width
+        self.skip_falsy = skip_falsy
+        self.column_widths = column_widths
+        self.debit_field = debit_field
+        self.credit_field = credit_field
+        if date_ranges is None:
+            date_ranges = [column.field for column in self.columns if column.kind == DATE]
+        self.date_ranges = tuple(date_ranges)
+
+        self.width = len(self.columns)
+        self.has_running_balance = any(column.kind == RUNNING_BALANCE for column in self.columns)
+        self.row_styles = [column.style() for column in self.columns]
+        self.striped_styles = [zebra(style, zebra_color) for style in self.row_styles]
+
+    def column_index(self, field):
+        for idx, column in enumerate(self.columns, start=1):
+            if column.field == field:
+                return idx
+        raise KeyError(f"No '{field}' column in the {self.sheet_title} report.")
+
+    def ledger(self, records):
+        return LedgerColumns(records, self.debit_field, self.credit_field)
+
+    def summarise(self, records, opening_balance=0.0):
+        """Totals, counts, (min, max) per date range field and the running balances.
+
+        Money is summed in integer cents over the ledger columns. The
+        balance after each row is returned (in cents) as
+        `running_balances`, which `Table` reuses when it is in the context.
+        """
+        ledger = self.ledger(records)
+        balances = ledger.running_balances(to_cents(opening_balance))
+        summary = {
+            'total_debits': from_cents(ledger.total_debits()),
+            'total_credits': from_cents(ledger.total_credits()),
+            'count_debits': ledger.count_debits(),
+            'count_credits': ledger.count_credits(),
+            'opening_balance': opening_balance,
+            'running_balance': from_cents(balances[-1]) if balances else opening_balance,
+            'running_balances': balances,
+        }
+        for field in self.date_ranges:
+            summary[f"{field}_range"] = date_range(records, field)
+        return summary
+
+    def render(self, path, records=(), **context):
+        """Write the statement to `path` (a filename or a binary file). `context` fills the section texts."""
+        context.setdefault('now', datetime.now())
+
+        def layout(out):
+            for section in self.sections:
+                section.write(out, self, records, context)
+
+        return write_report(
+            path, self.sheet_title, layout,
+            column_widths=self.column_widths,
+            max_width=self.max_width,
+            skip_falsy=self.skip_falsy,
+        )
+
+
+def format_date(value, default=''):
+    return value.strftime('%d/%m/%Y') if value else default
+
+
+def _escrow_dr_cr(record):
+    return record.dr_cr_ind or ('DR' if record.debit > 0 else 'CR' if record.credit > 0 else '')
+
+
+def _ura_created_by(record):
+    if not record.user_name:
+        return record.user_name
+    return ' '.join(word.capitalize() for word in record.user_name.lower().split())
+
+
+def _ura_description(record):
+    description = record.tran_desc
+    if record.prn and f"PRN: {record.prn}" not in description:
+        description += f", PRN: {record.prn}"
+    if record.tin and f"TIN: {record.tin}" not in description:
+        description += f", TIN: {record.tin}"
+    return description
+
+
+ESCROW_HEADER = [
+    Line("MTN Escrow Transaction Statement", TITLE, merge=14),
+    Gap(),
+    Panel(
+        left=[
+            ("Acct Name", "{acct_name}"),
+            ("Address", "{address}"),
+            ("Branch Name", "{branch_name}"),
+            ("Account No", "{account_no}"),
+            ("Product", "{product}"),
+        ],
+        right=[
+            ("Currency", "{currency}"),
+            ("From Date", "{from_date}"),
+            ("To Date", "{to_date}"),
+            ("Bank", "{bank_name}"),
+            ("Printed On", "{now:%d/%m/%Y}"),
+        ],
+    ),
+]
+
+# The old auto-fit ran before the footer was added, so it never counts.
+ESCROW_FOOTER = [
+    Blank(fit=False),
+    Line("Printed By : CUSTOMER ENGAGEMENT SYSTEM", merge=6, fit=False),
+    Line("Print Date: {now:%d-%b-%Y} ", merge=6, fit=False),
+    Line("Verified By: CUSTOMER ENGAGEMENT SYSTEM", merge=6, fit=False),
+]
+
+ESCROW_STATEMENT_REPORT = StatementSpec(
+    "MTN Escrow Statement",
+    columns=[
+        Column("Transaction Date", 'tran_dt', DATE),
+        Column("Value Date", 'value_dt', DATE),
+        Column("Bank Reference", 'reference', convert=str),
+        Column("MTN Reference", 'bank_ref', convert=str),
+        Column("MSISDN", 'msisdn'),
+        Column("Transaction Description", 'tran_desc'),
+        Column("Dr / Cr", 'dr_cr_ind', value=_escrow_dr_cr),
+        Column("Debit", 'debit', MONEY),
+        Column("Credit", 'credit', MONEY),
+        Column("Balance", 'balance', MONEY),
+        Column("CBS Status", 'cbs_status'),
+        Column("Prefunding", 'prefunding'),
+        Column("Posted By", 'posted_by'),
+        Column("Branch", 'branch'),
+    ],
+    sections=[
+        *ESCROW_HEADER,
+        Blank(),
+        Blank(),
+        Line("Opening balance : {opening_balance:,.2f}", BOLD, merge=6),
+        Blank(),
+        Table(),
+        Blank(fit=False),
+        Line("Debit(s) - {count_debits} Credit(s) - {count_credits}", BOLD, merge=6, fit=False),
+        Totals("Total :- ", {'debit': 'total_debits', 'credit': 'total_credits', 'balance': 'closing_balance'},
+               fit=False),
+        Blank(fit=False),
+        Line("Closing balance : {closing_balance:,.2f}", BOLD, merge=6, fit=False),
+        *ESCROW_FOOTER,
+    ],
+    zebra_color="F7F7F7",
+    max_width=60,
+)
+
+ESCROW_NO_TRANSACTION_REPORT = StatementSpec(
+    "MTN Escrow Statement",
+    sections=[
+        *ESCROW_HEADER,
+        Blank(),
+        Line("No transactions found for previous day.", ITALIC, merge=6),
+        Blank(),
+        Line("Opening balance : {opening_balance:,.2f}", BOLD, merge=6),
+        Blank(),
+        Line("Closing balance : {closing_balance:,.2f}", BOLD, merge=6),
+        *ESCROW_FOOTER,
+    ],
+    column_widths={'A': 18, 'B': 28, 'C': 6, 'D': 4, 'E': 18, 'F': 28, 'G': 6, 'H': 4},
+)
+
+URA_STATEMENT_REPORT = StatementSpec(
+    "URA Report",
+    columns=[
+        Column("S/N", kind=SERIAL),
+        Column("Post Date", 'tran_dt', DATE),
+        Column("Effective Date", 'effective_dt', DATE),
+        Column("Created By", 'user_name', value=_ura_created_by),
+        Column("Transaction Description", 'tran_desc', value=_ura_description),
+        Column("Reference", 'reference', TEXT, convert=str),
+        Column("Contra Account", 'contra_acct_no', TEXT, convert=str),
+        Column("Origin Branch", 'user_bu', convert=str),
+        Column("Debit", 'debit', MONEY),
+        Column("Credit", 'credit', MONEY),
+        Column("PRN", 'prn', TEXT, convert=str),
+        Column("Balance", 'balance', RUNNING_BALANCE),
+        Column("Payment Mode", 'payment_type', convert=str),
+    ],
+    sections=[
+        Line("URA Transaction Report", TITLE),
+        Line("Generated on: {now:%d/%m/%Y}", SUBTITLE),
+        Line("GL Account No: {gl_account_no}", BOLD_LEFT),
+        Line("Uganda Revenue Authority ePayments -Cash", LEFT),
+        Line("Period: {start_date} to {end_date}", BOLD_LEFT),
+        Blank(),
+        Totals("Opening Balance:", {'balance': 'opening_balance_text'},
+               label_style=BOLD_RIGHT, value_style=BOLD_MONEY, merge_label=True, blank=""),
+        Blank(),
+        Table(),
+    ],
+)
+
+INTERSWITCH_STATEMENT_REPORT = StatementSpec(
+    "Interswitch Agents Report",
+    columns=[
+        Column("S/N", kind=SERIAL),
+        # Column("Transaction Date", 'tran_dt', DATE), // Changed to TIMESTAMP for better clarity
+        Column("Transaction Date", 'timestamp', DATE),
+        Column("Value Date", 'value_dt', DATE),
+        Column("Description", 'tran_desc'),
+        Column("Reference", 'reference', TEXT),
+        # Column("Event", 'EVENT_DESC'),
+        # Column("Channel", 'CHANNEL_DESC'),
+        # Column("Contra Account", 'CONTRA_ACCT_NO', TEXT),
+        Column("Recipient Account", 'recipient_account', TEXT),
+        Column("Recipient", 'recipient'),
+        Column("Dr / Cr", 'dr_cr_ind'),
+        Column("Debit", 'debit', MONEY),
+        Column("Credit", 'credit', MONEY),
+        Column("Balance", 'balance', MONEY),
+        # Column("Posted By", 'POSTED_BY'),
+        # Column("Branch", 'BU_NM'),
+    ],
+    sections=[
+        Line("Interswitch Agency Banking Report", TITLE),
+        Line("Generated on: {now:%d/%m/%Y}", SUBTITLE),
+        Line("Account Name: {acct_name}", BOLD_LEFT),
+        # Line("Customer: {customer_name}", BOLD_LEFT),
+        Line("Account No: {account_no}", BOLD_LEFT),
+        Line("Product: {product}", BOLD_LEFT),
+        Line("Currency: {currency}", BOLD_LEFT),
+        # Line("Branch: {branch_name}", BOLD_LEFT),
+        # Line("Address: {address}", BOLD_LEFT),
+        Line("Bank: {bank_name}", BOLD_LEFT),
+        Line("Period: {start_date} to {end_date}", BOLD_LEFT),
+        Blank(),
+        Line("Opening Balance: {opening_balance:,.2f}", BOLD),
+        Blank(),
+        Table(),
+        Blank(),
+        Line("Debit(s) - {count_debits}   Credit(s) - {count_credits}", BOLD),
+        Totals("Total :-", {'debit': 'total_debits', 'credit': 'total_credits', 'balance': 'closing_balance'}),
+        Blank(),
+        Line("Closing Balance: {closing_balance:,.2f}", BOLD),
+    ],
+    max_width=60,
+    skip_falsy=False,
+    # The period runs from the earliest TIMESTAMP to the latest TRAN_DT.
+    date_ranges=['timestamp', 'tran_dt'],
+)
@@ -0,0 +1,130 @@
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+
+class StubGatewayHandler(BaseHTTPRequestHandler):
+    """Answers like the two SMS gateways the app talks to.
+
+    GET (any path) is the Moonlight query-string API and answers in plain
+    text; POST (any path) is the birthday gateway and answers
+    `{"requestId": ..., "status": "QUEUED"}`. Latency, error rate and
+    throttling come from the server (see `StubGatewayServer`).
+    """
+
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes; without TCP_NODELAY the
+    # client's delayed ACK adds ~40ms to every keep-alive response.
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        query = parse_qs(urlsplit(self.path).query)
+        if not query.get('recipient_addr') or not query.get('message'):
+            self._reply(400, b'101|MISSING PARAMETERS', 'text/plain')
+            return
+        self._handle(b'000|ACCEPTED FOR DELIVERY', 'text/plain')
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            self._reply(400, b'{"error": "invalid JSON"}', 'application/json')
+            return
+        if not body.get('to') or not body.get('text'):
+            self._reply(400, b'{"error": "to and text are required"}', 'application/json')
+            return
+        queued = json.dumps({'requestId': uuid.uuid4().hex, 'status': 'QUEUED'}).encode('utf-8')
+        self._handle(queued, 'application/json')
+
+    def _handle(self, body, content_type):
+        server = self.server
+        outcome = server.next_outcome()
+        delay = server.next_latency()
+        if delay:
+            time.sleep(delay)
+
+        if outcome == 'throttled':
+            self._reply(429, b'Too Many Requests', 'text/plain', retry_after=1)
+        elif outcome == 'error':
+            self._reply(500, b'Internal Server Error', 'text/plain')
+        else:
+            self._reply(200, body, content_type)
+
+    def _reply(self, status, body, content_type, retry_after=None):
+        self.server.count(status)
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        if retry_after is not None:
+            self.send_header('Retry-After', str(retry_after))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubGatewayServer(ThreadingHTTPServer):
+    """Threaded stand-in gateway with configurable behaviour.
+
+    `latency` and `jitter` are in seconds; `error_rate` is the share of
+    requests answered 500; `max_rps` (0 for unlimited) answers 429 to
+    requests beyond that many per second.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, latency=0.05, jitter=0.02, error_rate=0.0, max_rps=0):
+        super().__init__(address, StubGatewayHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.max_rps = max_rps
+
+        self._lock = threading.Lock()
+        self._window = int(time.monotonic())
+        self._window_requests = 0
+        self.responses = {}
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def next_latency(self):
+        return max(0.0, self.latency + random.uniform(-self.jitter, self.jitter))
+
+    def next_outcome(self):
+        with self._lock:
+            if self.max_rps:
+                window = int(time.monotonic())
+                if window != self._window:
+                    self._window = window
+                    self._window_requests = 0
+                self._window_requests += 1
+                if self._window_requests > self.max_rps:
+                    return 'throttled'
+        if self.error_rate and random.random() < self.error_rate:
+            return 'error'
+        return 'ok'
+
+    def count(self, status):
+        with self._lock:
+            self.responses[status] = self.responses.get(status, 0) + 1
+
+    def stats(self):
+        with self._lock:
+            return dict(sorted(self.responses.items()))
+
+
+def start_stub_gateway(host='127.0.0.1', port=0, **options):
+    """Start a `StubGatewayServer` on a background thread and return it."""
+    server = StubGatewayServer((host, port), **options)
+    thread = threading.Thread(target=server.serve_forever, name='stub-sms-gateway', daemon=True)
+    thread.start()
+    return server
@@ -1,7 +1,6 @@
-from celery import shared_task
+from celery import chord, shared_task
 from pride_notify_notice.utils import (
     filter_today_transactions,
-    filter_transactions_in_window,
     get_rolling_window,
     handle_ATM_expiry,
     handle_Escrow_notifications, 
@@ -18,20 +17,64 @@ from pride_notify_notice.utils import (
     parse_schedule_time,
     send_birthday_sms,
 )
-import urllib3
+from pride_notify_notice.archive import get_payload_archive
+from pride_notify_notice.artifacts import ReportArtifact, get_artifact_store
+from pride_notify_notice.circuit_breaker import CircuitOpenError
+from pride_notify_notice.dispatch import dispatch_records
+from pride_notify_notice.esb import get_esb_client, get_prefetch_config, get_streaming_config
+from pride_notify_notice.fanout import fanout_chunks, split_records, tally_responses
+from pride_notify_notice.log_sink import SMSLogSink
+from pride_notify_notice.message_types import (
+    get_message_type,
+    resolve_campaign_message_type,
+    resolve_message_type,
+)
+from pride_notify_notice.models import SMSOutbox
+from pride_notify_notice.oracle_source import get_oracle_source, uses_oracle
+from pride_notify_notice.outbox import (
+    claim_deferred_probe,
+    claim_outbox_batch,
+    enqueue_campaign,
+    finish_outbox_rows,
+    get_outbox_config,
+    outbox_enabled,
+    release_deferred,
+    release_stale_claims,
+    send_deferred,
+)
+from pride_notify_notice.rate_limit import get_gateway_throttle
+from pride_notify_notice.snapshots import get_snapshot_store
+from pride_notify_notice.records import (
+    ESCROW_STATEMENT,
+    INTERSWITCH_REPORT,
+    URA_REPORT,
+    to_amount,
+    to_datetime,
+)
+from pride_notify_notice.sms_gateway import get_moonlight_client
+from pride_notify_notice.statements import (
+    ESCROW_NO_TRANSACTION_REPORT,
+    ESCROW_STATEMENT_REPORT,
+    INTERSWITCH_STATEMENT_REPORT,
+    URA_STATEMENT_REPORT,
+    format_date,
+)
+from pride_notify_notice.watermarks import (
+    advance_watermark,
+    get_watermark,
+    records_after,
+    since_params,
+)
 from datetime import datetime
+from functools import partial
+from itertools import islice
 import json
-import re
-from .models import ATMExpirySMSLog, GregSchoolSMSLog, GroupLoanSMSLog, SMSLog, BirthdaySMSLog, GroupSMSLog
-from dateutil.parser import parse
 import os
+import time
 from dotenv import load_dotenv
 from django.conf import settings
-from openpyxl import Workbook
 # from openpyxl.styles import Font, Alignment
-from openpyxl.utils import get_column_letter
 from django.core.mail import EmailMessage
-from openpyxl.styles import Font, Alignment, Border, Side, PatternFill
 load_dotenv()
 
 
@@ -83,23 +126,279 @@ def _retry_or_fail_escrow_stage(
         },
     )
 
+
+def _campaign_records(feed_name, fetch, envelope_key):
+    """Return the records of a campaign feed.
+
+    With `ESB_STREAMING` on this is an iterator that parses records off the
+    ESB response as they arrive; `_send_campaign` sends it chunk by chunk.
+    Otherwise `fetch()` loads the whole payload and its `envelope_key` list
+    is returned, raising ValueError if it is empty. Feeds with 'source':
+    'oracle' are read from the PRIDELIVE views instead (see oracle_source).
+    """
+    if uses_oracle(feed_name):
+        records = get_oracle_source().iter_records(feed_name)
+        if get_streaming_config()['enabled']:
+            return records
+        records = list(records)
+    elif get_streaming_config()['enabled']:
+        return get_esb_client().stream(feed_name, (envelope_key,))
+    else:
+        records = fetch().get(envelope_key, [])
+
+    if not records:
+        raise ValueError("Empty 'Person' list received.")
+    return records
+
+
+def _send_campaign_stream(records, campaign):
+    """Send an iterator of records in chunks and return the summed counts.
+
+    Only one chunk of records is held at a time, so memory stays flat
+    however large the feed. Raises ValueError if the iterator was empty.
+    """
+    chunk_size = get_streaming_config()['chunk_size']
+    totals = {'campaign': campaign, 'records': 0, 'chunks': 0}
+
+    for chunk in iter(lambda: list(islice(records, chunk_size)), []):
+        result = _send_campaign(chunk, campaign)
+        counts = result if isinstance(result, dict) else tally_responses(result)
+        counts = dict(counts, records=len(chunk))
+        for key, value in counts.items():
+            if isinstance(value, int) and key != 'chunks':
+                totals[key] = totals.get(key, 0) + value
+        totals['chunks'] += 1
+
+    if not totals['records']:
+        raise ValueError("Empty 'Person' list received.")
+    print(f"Streamed {campaign} campaign finished: {totals}")
+    return totals
+
+
+def _send_campaign(records, campaign):
+    """Send every record of a campaign and return the non-empty responses.
+
+    An iterator (a streamed feed) is handed to `_send_campaign_stream` and
+    counts are returned instead. The message type is resolved once for the
+    whole list and already-sent records are dropped in one batch lookup.
+    With `SMS_USE_OUTBOX` on, the records are queued in the outbox for
+    `drain_sms_outbox` and a summary is returned instead; otherwise they are
+    sent here through the bounded-concurrency dispatcher, with log rows
+    bulk-written by a shared sink that is flushed even if the campaign fails
+    part-way.
+    """
+    if not isinstance(records, list):
+        return _send_campaign_stream(records, campaign)
+
+    message_type = resolve_campaign_message_type(records)
+    if message_type:
+        records = get_message_type(message_type).drop_already_sent(records)
+
+    if outbox_enabled():
+        queued = enqueue_campaign(records, campaign, message_type=message_type)
+        print(f"Queued {queued} new {campaign} SMS in the outbox ({len(records)} records).")
+        drains = fanout_chunks(queued)
+        try:
+            if drains > 1:
+                # Several drains claim disjoint batches, so the queued rows
+                # are shared out across whichever workers pick them up.
+                chord(drain_sms_outbox.s() for _ in range(drains))(aggregate_sms_chunks.s(campaign))
+            else:
+                drain_sms_outbox.delay()
+        except Exception as exc:
+            # The periodic drain picks the rows up anyway.
+            print(f"Could not schedule outbox drain for {campaign}: {exc}")
+        return {'campaign': campaign, 'records': len(records), 'queued': queued, 'drains': drains}
+
+    chunks = fanout_chunks(len(records))
+    if chunks > 1:
+        slices = split_records(list(records), chunks)
+        result = chord(
+            send_sms_chunk.s(chunk, campaign, message_type) for chunk in slices
+        )(aggregate_sms_chunks.s(campaign))
+        print(f"Fanned out {len(records)} {campaign} SMS over {len(slices)} chunks (chord {result.id}).")
+        return {'campaign': campaign, 'records': len(records), 'chunks': len(slices), 'chord_id': result.id}
+
+    responses = _send_records(records, campaign, message_type)
+    _spool_deferred(records, responses, campaign, message_type)
+    return [response for response in responses if response]
+
+
+def _send_records(records, campaign, message_type):
+    """Send `records` and return one response (None if the send raised) per record."""
+    with SMSLogSink() as log_sink:
+        send = partial(send_sms_to_api, log_sink=log_sink, message_type=message_type)
+        return dispatch_records(records, send, campaign=campaign)
+
+
+def _spool_deferred(records, responses, campaign, message_type):
+    """Park records refused by an open gateway circuit as DEFERRED outbox rows."""
+    deferred = [
+        record
+        for record, response in zip(records, responses)
+        if send_deferred(response)
+    ]
+    if deferred:
+        spooled = enqueue_campaign(
+            deferred, campaign, message_type=message_type, status=SMSOutbox.DEFERRED
+        )
+        print(f"Spooled {spooled} {campaign} SMS for replay once the gateway recovers.")
+
+
+@shared_task(bind=True, max_retries=3, default_retry_delay=60)
+def drain_sms_outbox(self, max_batches=None):
+    """Send PENDING outbox rows in claimed batches until the outbox is empty.
+
+    Several drains can run at once on different workers: each claims its own
+    rows with SKIP LOCKED. Rows are marked SENT or FAILED only after their log
+    rows are written, so a crash part-way leaves them SENDING for
+    `release_stale_claims` to hand back.
+    """
+    released, expired = release_stale_claims()
+    if released or expired:
+        print(f"Outbox: released {released} stale claims, failed {expired} after too many attempts.")
+
+    batch_size = get_outbox_config()['batch_size']
+    batches = 0
+    counts = {'sent': 0, 'failed': 0, 'deferred': 0}
+
+    while max_batches is None or batches < max_batches:
+        rows = claim_outbox_batch(batch_size)
+        if not rows:
+            break
+        batches += 1
+
+        groups = {}
+        for row in rows:
+            groups.setdefault((row.campaign, row.message_type), []).append(row)
+
+        for (campaign, message_type), group in groups.items():
+            results = _send_records([row.payload for row in group], campaign, message_type)
+            finish_outbox_rows(group, results)
+            for row in group:
+                counts[row.status.lower()] += 1
+
+    print(
+        f"Outbox drain finished: {batches} batches, {counts['sent']} sent, "
+        f"{counts['failed']} failed, {counts['deferred']} deferred."
+    )
+    return counts
+
+
+@shared_task(bind=True)
+def replay_deferred_sms(self):
+    """Replay the deferred spool of each gateway that has recovered.
+
+    For every gateway with DEFERRED rows, the oldest one is sent as a probe.
+    If it goes through, the rest of that gateway's spool is released to the
+    outbox and a drain is started; otherwise the probe goes back to the spool
+    (until it has used up `max_attempts`) and the next run tries again.
+    """
+    max_attempts = get_outbox_config()['max_attempts']
+    gateways = {}
+    spooled_types = (
+        SMSOutbox.objects.filter(status=SMSOutbox.DEFERRED)
+        .values_list('message_type', flat=True)
+        .distinct()
+    )
+    for message_type in spooled_types:
+        try:
+            gateway = get_message_type(message_type).gateway
+        except ValueError:
+            continue
+        gateways.setdefault(gateway, []).append(message_type)
+
+    released = 0
+    for gateway, message_types in gateways.items():
+        probe = claim_deferred_probe(message_types)
+        if probe is None:
+            continue
+
+        finish_outbox_rows([probe], _send_records([probe.payload], probe.campaign, probe.message_type))
+        if probe.status == SMSOutbox.SENT:
+            count = release_deferred(message_types)
+            released += count
+            print(f"{gateway} gateway is back: released {count} deferred SMS.")
+            continue
+
+        if probe.status == SMSOutbox.FAILED and probe.attempts < max_attempts:
+            probe.status = SMSOutbox.DEFERRED
+            probe.save(update_fields=['status'])
+        print(f"{gateway} gateway still unavailable: {probe.last_error}")
+
+    if released:
+        drain_sms_outbox.delay()
+    return {'released': released}
+
+
+@shared_task(bind=True, max_retries=2, default_retry_delay=60)
+def send_sms_chunk(self, records, campaign, message_type=None):
+    """Send one slice of a fanned-out campaign and return its counts.
+
+    Only counts travel back through the result backend; the per-message
+    detail is in the SMS log tables as usual.
+    """
+    responses = _send_records(records, campaign, message_type)
+    _spool_deferred(records, responses, campaign, message_type)
+    counts = tally_responses(responses)
+    print(
+        f"{campaign} chunk done: {counts['sent']} sent, {counts['failed']} failed, "
+        f"{counts['skipped']} skipped, {counts['deferred']} deferred of {counts['records']}."
+    )
+    return counts
+
+
+@shared_task(bind=True)
+def aggregate_sms_chunks(self, results, campaign):
+    """Chord callback: add up the counts returned by each chunk or drain."""
+    totals = {}
+    for counts in results:
+        for key, value in (counts or {}).items():
+            totals[key] = totals.get(key, 0) + value
+    totals['chunks'] = len(results)
+    print(f"{campaign} fan-out finished: {totals}")
+    return totals
+
+
+@shared_task(bind=True)
+def prefetch_esb_feeds(self, feeds=None):
+    """Pull the day's feeds concurrently into the snapshot store.
+
+    Runs before the first morning slot so the report and campaign tasks read
+    today's snapshot and start at once instead of waiting on the ESB in turn.
+    """
+    store = get_snapshot_store()
+    if store is None:
+        print("ESB snapshots are disabled; skipping prefetch.")
+        return {}
+
+    config = get_prefetch_config()
+    feeds = [feed for feed in (feeds or config['feeds']) if not uses_oracle(feed)]
+    started = time.monotonic()
+    results = get_esb_client().prefetch(feeds, store, parallel=config['parallel'])
+    print(f"Prefetched {len(feeds)} ESB feeds in {time.monotonic() - started:.1f}s: {results}")
+
+    # Once a day is plenty to apply the payload archive's retention.
+    archive = get_payload_archive()
+    if archive is not None:
+        days, payloads = archive.prune()
+        if days or payloads:
+            print(f"Pruned {days} archive index days and {payloads} archived payloads.")
+    artifact_store = get_artifact_store()
+    if artifact_store is not None:
+        days = artifact_store.prune()
+        if days:
+            print(f"Pruned {days} days of stored report artifacts.")
+    return results
+
+
 @shared_task(bind=True, max_retries=5, default_retry_delay=300)
 def retrieve_data(self):
     try:
-        loan_data = handle_loans_due()
-        # print(loan_data)
-        person_list = loan_data.get("Person", [])
-
-        if not person_list:
-            raise ValueError("Empty 'Person' list received.")
+        person_list = _campaign_records('loans_due', handle_loans_due, 'Person')
 
         # updated_loan_list = update_List(person_list)
-        response_data = []
-
-        for loan in person_list:
-            response = send_sms_to_api(loan)
-            if response:
-                response_data.append(response)
+        response_data = _send_campaign(person_list, 'loans_due')
 
         return response_data
 
@@ -116,20 +415,10 @@ def retrieve_data(self):
 @shared_task(bind=True, max_retries=5, default_retry_delay=300)
 def retrieve_birthday_data(self):
     try:
-        birthday_data = handle_birthdays()
-        # print(birthday_data)
-        person_list = birthday_data.get("Person", [])
-
-        if not person_list:
-            raise ValueError("Empty 'Person' list received.")
+        person_list = _campaign_records('birthdays', handle_birthdays, 'Person')
 
         # updated_birthday_list = update_List_birthdays(person_list)
-        response_data = []
-
-        for birthday in person_list:
-            response = send_sms_to_api(birthday)
-            if response:
-                response_data.append(response)
+        response_data = _send_campaign(person_list, 'birthdays')
 
         return response_data
 
@@ -164,7 +453,11 @@ def retrieve_greg_school_reports(
             f"window_start={window_start}, window_end={window_end}."
         )
 
-        greg_school_reports_data = handle_greg_school_reports()
+        # Only transactions above the feed's watermark are new. The ESB is
+        # asked for just those when the feed has a since-parameter.
+        watermark = get_watermark('greg_school_reports')
+        params = since_params('greg_school_reports', watermark)
+        greg_school_reports_data = handle_greg_school_reports(params=params)
 
         def normalize_notifications(payload_data):
             if isinstance(payload_data, list):
@@ -186,6 +479,9 @@ def retrieve_greg_school_reports(
         transactions = normalize_notifications(greg_school_reports_data)
 
         if not transactions:
+            if params:
+                print(f"No new Greg School transactions since {watermark.last_txn_time}.")
+                return []
             raise ValueError("Empty 'Person' list received.")
         
         print(f"Original Greg School Reports List: {transactions}")
@@ -197,9 +493,11 @@ def retrieve_greg_school_reports(
         #     end_time=parsed_end_time,
         # )
 
-        # --- NEW: keep only transactions inside the rolling one-hour window ---
-        filtered_txns = filter_transactions_in_window(
+        # --- NEW: keep transactions above the watermark (or, on the first
+        # run, inside the rolling window) and before the current hour ---
+        filtered_txns, newest = records_after(
             transactions,
+            watermark,
             window_start,
             window_end,
         )
@@ -219,12 +517,8 @@ def retrieve_greg_school_reports(
         # updated_greg_school_reports_list = update_List_greg_school_reports(filtered_txns)
         # print(f"Updated Greg School Reports List: {filtered_txns}")
 
-        response_data = []
-    
-        for report in filtered_txns:
-            response = send_sms_to_api(report)
-            if response:
-                response_data.append(response)
+        response_data = _send_campaign(filtered_txns, 'greg_school')
+        advance_watermark('greg_school_reports', newest)
 
         return response_data
 
@@ -241,35 +535,31 @@ def retrieve_greg_school_reports(
 @shared_task(bind=True, max_retries=5, default_retry_delay=300)
 def retrieve_atm_expiry_notifications(self):
     try:
-        atm_expiry_data = handle_ATM_expiry()
-        person_list = atm_expiry_data.get("Person", [])
-
-        if not person_list:
-            raise ValueError("Empty 'Person' list received.")
+        person_list = _campaign_records('atm_expiry', handle_ATM_expiry, 'Person')
 
         # Remove duplicate rows to avoid sending repeated SMSs for the same card/contact.
-        unique_person_list = []
-        seen = set()
-        for person in person_list:
-            if not isinstance(person, dict):
-                continue
-            dedupe_key = (
-                str(person.get('CUST_ID', '')).strip(),
-                str(person.get('PAN_MASKED', '')).strip(),
-                str(person.get('MOBILE_CONTACT', '')).strip(),
-            )
-            if dedupe_key in seen:
-                continue
-            seen.add(dedupe_key)
-            unique_person_list.append(person)
+        def unique_persons(persons):
+            seen = set()
+            for person in persons:
+                if not isinstance(person, dict):
+                    continue
+                dedupe_key = (
+                    str(person.get('CUST_ID', '')).strip(),
+                    str(person.get('PAN_MASKED', '')).strip(),
+                    str(person.get('MOBILE_CONTACT', '')).strip(),
+                )
+                if dedupe_key in seen:
+                    continue
+                seen.add(dedupe_key)
+                yield person
+
+        unique_person_list = unique_persons(person_list)
+        if isinstance(person_list, list):
+            unique_person_list = list(unique_person_list)
 
         # updated_atm_expiry_list = update_ATM_expiry(unique_person_list)
 
-        response_data = []
-        for atm_expiry in unique_person_list:
-            response = send_sms_to_api(atm_expiry)
-            if response:
-                response_data.append(response)
+        response_data = _send_campaign(unique_person_list, 'atm_expiry')
 
         return response_data
 
@@ -294,22 +584,6 @@ def retrieve_escrow_notifications(self, stage="primary", stage_attempt=1, cycle=
         if stage_attempt < 1 or cycle < 1:
             raise ValueError("Escrow retry state must start from attempt 1 and cycle 1.")
  
-        def safe_parse_date(dt):
-            try:
-                if not dt:
-                    return None
-                return parse(str(dt))
-            except Exception:
-                return None
- 
-        def to_float(val):
-            try:
-                if val in (None, ''):
-                    return 0.0
-                return float(str(val).replace(',', ''))
-            except Exception:
-                return 0.0
- 
         def normalize_notifications(payload_data):
             if isinstance(payload_data, list):
                 return payload_data
@@ -327,23 +601,8 @@ def retrieve_escrow_notifications(self, stage="primary", stage_attempt=1, cycle=
             return []
  
         def build_no_transaction_report(fallback_first):
-            wb = Workbook()
-            ws = wb.active
-            ws.title = "MTN Escrow Statement"
- 
-            acct_name = (fallback_first.get('ACCT_NM') or 'MTN ESCROW ACCOUNT').strip()
-            address = (fallback_first.get('ADDR_LINE_1') or 'PO Box 7566').strip()
-            branch_name = (fallback_first.get('BU_NM') or 'Head Office').strip()
-            account_no = (fallback_first.get('ACT_NO') or '').strip()
-            product = (fallback_first.get('PROD_DESC') or 'ESCROW DEPOSIT PRODUCT').strip()
-            currency = (fallback_first.get('CRNCY_NM') or fallback_first.get('CRNCY_CD_ISO') or 'Uganda Shillings').strip()
-            bank_name = (fallback_first.get('BANK_NAME') or 'Pride Bank').strip()
-            transaction_date = safe_parse_date(fallback_first.get('TRAN_DT'))
-            from_date = transaction_date.strftime('%d/%m/%Y') if transaction_date else ''
-            to_date = transaction_date.strftime('%d/%m/%Y') if transaction_date else ''
-            printed_on = datetime.now().strftime('%d/%m/%Y')
- 
-            opening_balance = to_float(
+            transaction_date = to_datetime(fallback_first.get('TRAN_DT'))
+            opening_balance = to_amount(
                 fallback_first.get('OPENING_BAL')
                 or fallback_first.get('OPENING_BALANCE')
                 or fallback_first.get('STMNT_BAL')
@@ -354,109 +613,39 @@ def retrieve_escrow_notifications(self, stage="primary", stage_attempt=1, cycle=
                 or fallback_first.get('CLOSING_BALANCE')
             )
             closing_balance = (
-                to_float(_raw_closing)
+                to_amount(_raw_closing)
                 if _raw_closing not in (None, '')
-                else to_float(fallback_first.get('STMNT_BAL') or opening_balance)
+                else to_amount(fallback_first.get('STMNT_BAL') or opening_balance)
             )
  
-            ws.append(["MTN Escrow Transaction Statement"])
-            ws.merge_cells('A1:N1')
-            ws['A1'].font = Font(bold=True, size=14)
-            ws['A1'].alignment = Alignment(horizontal='center')
- 
-            left_rows = [
-                ("Acct Name", acct_name),
-                ("Address", address),
-                ("Branch Name", branch_name),
-                ("Account No", account_no),
-                ("Product", product),
-            ]
-            right_rows = [
-                ("Currency", currency),
-                ("From Date", from_date),
-                ("To Date", to_date),
-                ("Bank", bank_name),
-                ("Printed On", printed_on),
-            ]
- 
-            ws.column_dimensions['A'].width = 18
-            ws.column_dimensions['B'].width = 28
-            ws.column_dimensions['C'].width = 6
-            ws.column_dimensions['D'].width = 4
-            ws.column_dimensions['E'].width = 18
-            ws.column_dimensions['F'].width = 28
-            ws.column_dimensions['G'].width = 6
-            ws.column_dimensions['H'].width = 4
- 
-            label_fill = PatternFill(start_color="EEF2F7", end_color="EEF2F7", fill_type="solid")
-            value_fill = PatternFill(start_color="FFFFFF", end_color="FFFFFF", fill_type="solid")
-            header_border = Border(
-                left=Side(style='thin'), right=Side(style='thin'),
-                top=Side(style='thin'), bottom=Side(style='thin')
-            )
- 
-            start_row = 3
-            for i, (label, value) in enumerate(left_rows):
-                r = start_row + i
-                lc = ws.cell(row=r, column=1, value=f"{label}:")
-                lc.font = Font(bold=True)
-                lc.alignment = Alignment(horizontal='left', vertical='center')
-                lc.fill = label_fill
-                lc.border = header_border
-                ws.merge_cells(start_row=r, start_column=2, end_row=r, end_column=3)
-                vc = ws.cell(row=r, column=2, value=value)
-                vc.alignment = Alignment(horizontal='left', vertical='center')
-                vc.fill = value_fill
-                vc.border = header_border
- 
-            for i, (label, value) in enumerate(right_rows):
-                r = start_row + i
-                rc = ws.cell(row=r, column=5, value=f"{label}:")
-                rc.font = Font(bold=True)
-                rc.alignment = Alignment(horizontal='left', vertical='center')
-                rc.fill = label_fill
-                rc.border = header_border
-                ws.merge_cells(start_row=r, start_column=6, end_row=r, end_column=8)
-                rv = ws.cell(row=r, column=6, value=value)
-                rv.alignment = Alignment(horizontal='left', vertical='center')
-                rv.fill = value_fill
-                rv.border = header_border
- 
-            ws.append([""])
-            ws.append(["No transactions found for previous day."])
-            ws.merge_cells(start_row=ws.max_row, start_column=1, end_row=ws.max_row, end_column=6)
-            ws[f'A{ws.max_row}'].font = Font(italic=True)
- 
-            ws.append([""])
-            ws.append([f"Opening balance : {opening_balance:,.2f}"])
-            ws.merge_cells(start_row=ws.max_row, start_column=1, end_row=ws.max_row, end_column=6)
-            ws[f'A{ws.max_row}'].font = Font(bold=True)
- 
-            ws.append([""])
-            ws.append([f"Closing balance : {closing_balance:,.2f}"])
-            ws.merge_cells(start_row=ws.max_row, start_column=1, end_row=ws.max_row, end_column=6)
-            ws[f'A{ws.max_row}'].font = Font(bold=True)
- 
-            ws.append([""])
-            ws.append(["Printed By : CUSTOMER ENGAGEMENT SYSTEM"])
-            ws.merge_cells(start_row=ws.max_row, start_column=1, end_row=ws.max_row, end_column=6)
-            ws.append([f"Print Date: {datetime.now().strftime('%d-%b-%Y')} "])
-            ws.merge_cells(start_row=ws.max_row, start_column=1, end_row=ws.max_row, end_column=6)
-            ws.append(["Verified By: CUSTOMER ENGAGEMENT SYSTEM"])
-            ws.merge_cells(start_row=ws.max_row, start_column=1, end_row=ws.max_row, end_column=6)
- 
             excel_filename = f"mtn_escrow_statement_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-            wb.save(excel_filename)
-            send_csv_report_email(
-                recipient_email=getattr(settings, 'ESCROW_REPORT_EMAILS', []),
-                subject=f"Daily MTN Escrow Statement - {datetime.now().strftime('%d-%m-%Y %H:%M:%S')}",
-                message="Dear Valued Partner, \nPlease find the attached MTN Escrow statement (no transactions for previous day).",
-                csv_file_path=excel_filename
-            )
-            print(f"Escrow no-transaction statement saved to {excel_filename}")
+            with ReportArtifact(excel_filename) as artifact:
+                ESCROW_NO_TRANSACTION_REPORT.render(
+                    artifact.buffer,
+                    acct_name=(fallback_first.get('ACCT_NM') or 'MTN ESCROW ACCOUNT').strip(),
+                    address=(fallback_first.get('ADDR_LINE_1') or 'PO Box 7566').strip(),
+                    branch_name=(fallback_first.get('BU_NM') or 'Head Office').strip(),
+                    account_no=(fallback_first.get('ACT_NO') or '').strip(),
+                    product=(fallback_first.get('PROD_DESC') or 'ESCROW DEPOSIT PRODUCT').strip(),
+                    currency=(fallback_first.get('CRNCY_NM') or fallback_first.get('CRNCY_CD_ISO') or 'Uganda Shillings').strip(),
+                    bank_name=(fallback_first.get('BANK_NAME') or 'Pride Bank').strip(),
+                    from_date=format_date(transaction_date),
+                    to_date=format_date(transaction_date),
+                    opening_balance=opening_balance,
+                    closing_balance=closing_balance,
+                )
+                send_report_email(
+                    recipient_email=getattr(settings, 'ESCROW_REPORT_EMAILS', []),
+                    subject=f"Daily MTN Escrow Statement - {datetime.now().strftime('%d-%m-%Y %H:%M:%S')}",
+                    message="Dear Valued Partner, \nPlease find the attached MTN Escrow statement (no transactions for previous day).",
+                    attachment=artifact,
+                )
+                artifact_path = store_report_artifact(artifact)
+            print(f"Escrow no-transaction statement generated as {excel_filename}")
             return [{
                 'filename': excel_filename,
-                'content': f"Escrow no-transaction statement generated and saved to {excel_filename}",
+                'artifact': artifact_path,
+                'content': f"Escrow no-transaction statement generated as {excel_filename}",
                 'totals': {
                     'debits': 0,
                     'credits': 0,
@@ -472,7 +661,11 @@ def retrieve_escrow_notifications(self, stage="primary", stage_attempt=1, cycle=
  
         if stage == "primary":
             try:
-                escrow_data = handle_Escrow_notifications()
+                # The first attempt may use the morning prefetch; retries
+                # always go back to the ESB for late transactions.
+                escrow_data = handle_Escrow_notifications(
+                    use_snapshot=(stage_attempt == 1 and cycle == 1),
+                )
                 print(f"Primary escrow notifications data received: {escrow_data}")
             except Exception as exc:
                 _retry_or_fail_escrow_stage(
@@ -527,264 +720,71 @@ def retrieve_escrow_notifications(self, stage="primary", stage_attempt=1, cycle=
             return build_no_transaction_report(fallback_first)
  
         # --- Build Excel workbook ---
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "MTN Escrow Statement"
- 
         print(f"Total notifications to process: {len(notifications)}")
  
         first = next((n for n in notifications if isinstance(n, dict)), {})
-        acct_name = (first.get('ACCT_NM') or '').strip()
-        address = (first.get('ADDR_LINE_1') or '').strip()
-        branch_name = (first.get('BU_NM') or '').strip()
-        account_no = (first.get('ACT_NO') or '').strip()
-        product = (first.get('PROD_DESC') or '').strip()
-        currency = (first.get('CRNCY_NM') or first.get('CRNCY_CD_ISO') or '').strip()
-        bank_name = (first.get('BANK_NAME') or 'Pride Bank').strip()
- 
-        dates = [safe_parse_date(n.get('TRAN_DT')) for n in notifications if isinstance(n, dict)]
-        dates = [d for d in dates if d is not None]
-        from_date = min(dates).strftime('%d/%m/%Y') if dates else ''
-        to_date = max(dates).strftime('%d/%m/%Y') if dates else ''
-        printed_on = datetime.now().strftime('%d/%m/%Y')
  
-        # --- FIX: guard non-dict items ---
-        total_debits = sum(to_float(n.get('DEBIT_AMT')) for n in notifications if isinstance(n, dict))
-        total_credits = sum(to_float(n.get('CREDIT_AMT')) for n in notifications if isinstance(n, dict))
-        count_debits = sum(1 for n in notifications if isinstance(n, dict) and to_float(n.get('DEBIT_AMT')) > 0)
-        count_credits = sum(1 for n in notifications if isinstance(n, dict) and to_float(n.get('CREDIT_AMT')) > 0)
+        # Parse every row once into a typed record (non-dict rows are
+        # rejected and counted); everything below works on the records.
+        records, _ = ESCROW_STATEMENT.parse(notifications)
  
         # Chronological sort
-        def sort_key(n):
-            dt = safe_parse_date(n.get('TRAN_DT')) if isinstance(n, dict) else None
-            return dt or datetime.min
- 
-        notifications_sorted = sorted(notifications, key=sort_key)
+        notifications_sorted = sorted(records, key=lambda r: r.tran_dt or datetime.min)
  
         # Opening balance derived from first transaction
-        first_txn = next((n for n in notifications_sorted if isinstance(n, dict)), None)
+        first_txn = notifications_sorted[0] if notifications_sorted else None
         if first_txn:
-            first_stmnt_balance = to_float(first_txn.get('STMNT_BAL'))
-            first_debit = to_float(first_txn.get('DEBIT_AMT'))
-            first_credit = to_float(first_txn.get('CREDIT_AMT'))
-            opening_balance = first_stmnt_balance - first_credit + first_debit
+            opening_balance = first_txn.balance - first_txn.credit + first_txn.debit
         else:
             opening_balance = 0.0
  
-        # --- Title ---
-        ws.append(["MTN Escrow Transaction Statement"])
-        ws.merge_cells('A1:N1')
-        ws['A1'].font = Font(bold=True, size=14)
-        ws['A1'].alignment = Alignment(horizontal='center')
- 
-        left_rows = [
-            ("Acct Name", acct_name),
-            ("Address", address),
-            ("Branch Name", branch_name),
-            ("Account No", account_no),
-            ("Product", product),
-        ]
-        right_rows = [
-            ("Currency", currency),
-            ("From Date", from_date),
-            ("To Date", to_date),
-            ("Bank", bank_name),
-            ("Printed On", printed_on),
-        ]
- 
-        ws.column_dimensions['A'].width = 18
-        ws.column_dimensions['B'].width = 28
-        ws.column_dimensions['C'].width = 6
-        ws.column_dimensions['D'].width = 4
-        ws.column_dimensions['E'].width = 18
-        ws.column_dimensions['F'].width = 28
-        ws.column_dimensions['G'].width = 6
-        ws.column_dimensions['H'].width = 4
- 
-        label_fill = PatternFill(start_color="EEF2F7", end_color="EEF2F7", fill_type="solid")
-        value_fill = PatternFill(start_color="FFFFFF", end_color="FFFFFF", fill_type="solid")
-        header_border = Border(
-            left=Side(style='thin'), right=Side(style='thin'),
-            top=Side(style='thin'), bottom=Side(style='thin')
-        )
- 
-        start_row = 3
-        for i, (label, value) in enumerate(left_rows):
-            r = start_row + i
-            lc = ws.cell(row=r, column=1, value=f"{label}:")
-            lc.font = Font(bold=True)
-            lc.alignment = Alignment(horizontal='left', vertical='center')
-            lc.fill = label_fill
-            lc.border = header_border
-            ws.merge_cells(start_row=r, start_column=2, end_row=r, end_column=3)
-            vc = ws.cell(row=r, column=2, value=value)
-            vc.alignment = Alignment(horizontal='left', vertical='center')
-            vc.fill = value_fill
-            vc.border = header_border
- 
-        for i, (label, value) in enumerate(right_rows):
-            r = start_row + i
-            rc = ws.cell(row=r, column=5, value=f"{label}:")
-            rc.font = Font(bold=True)
-            rc.alignment = Alignment(horizontal='left', vertical='center')
-            rc.fill = label_fill
-            rc.border = header_border
-            ws.merge_cells(start_row=r, start_column=6, end_row=r, end_column=8)
-            rv = ws.cell(row=r, column=6, value=value)
-            rv.alignment = Alignment(horizontal='left', vertical='center')
-            rv.fill = value_fill
-            rv.border = header_border
- 
-        ws.append([""])
-        ws.append([""])
-        ws.append([f"Opening balance : {opening_balance:,.2f}"])
-        ws.merge_cells(start_row=ws.max_row, start_column=1, end_row=ws.max_row, end_column=6)
-        ws[f'A{ws.max_row}'].font = Font(bold=True)
- 
-        # --- Table headers ---
-        ws.append([""])
-        headers = [
-            "Transaction Date", "Value Date", "Bank Reference", "MTN Reference",
-            "MSISDN", "Transaction Description", "Dr / Cr",
-            "Debit", "Credit", "Balance",
-            "CBS Status", "Prefunding", "Posted By", "Branch"
-        ]
-        ws.append(headers)
-        header_row_idx = ws.max_row
-        for col_num in range(1, len(headers) + 1):
-            cell = ws.cell(row=header_row_idx, column=col_num)
-            cell.font = Font(bold=True)
-            cell.alignment = Alignment(horizontal='center')
- 
-        # --- Data rows ---
-        amount_cols = {8, 9, 10}
-        running_balance = opening_balance
- 
-        for n in notifications_sorted:
-            if not isinstance(n, dict):
-                continue
-            tran_dt = safe_parse_date(n.get('TRAN_DT'))
-            value_dt = safe_parse_date(n.get('VALUE_DT'))
-            tran_dt_s = tran_dt.strftime('%d/%m/%Y') if tran_dt else ''
-            value_dt_s = value_dt.strftime('%d/%m/%Y') if value_dt else ''
-            tran_desc = n.get('TRAN_DESC') or ''
-            reference = n.get('TRAN_REF_TXT') or ''
-            bank_ref = n.get('SETTLEMENT_BANK_REF') or ''
-            drcr = (
-                n.get('DR_CR_IND')
-                or ('DR' if to_float(n.get('DEBIT_AMT')) > 0 else 'CR' if to_float(n.get('CREDIT_AMT')) > 0 else '')
-            ).strip()
-            debit = to_float(n.get('DEBIT_AMT'))
-            credit = to_float(n.get('CREDIT_AMT'))
-            running_balance = running_balance + credit - debit
-            balance = to_float(n.get('STMNT_BAL'))
-            cbs_status = n.get('CBS_Status') or ''
-            prefunding = (n.get('PREFUNDING_BRANCH') or '').strip()
-            posted_by = (n.get('POSTED_BY') or n.get('USER_NAME') or '').strip()
-            branch = (n.get('BU_NM') or '').strip()
-            msisdn = (n.get('CONTACT') or '').strip()
- 
-            ws.append([
-                tran_dt_s, value_dt_s, str(reference), str(bank_ref),
-                msisdn, tran_desc, drcr,
-                debit, credit, balance,
-                cbs_status, prefunding, posted_by, branch,
-            ])
- 
-        # Format numeric columns
-        for r in ws.iter_rows(min_row=header_row_idx + 1, max_row=ws.max_row, min_col=1, max_col=len(headers)):
-            for idx, cell in enumerate(r, start=1):
-                if idx in amount_cols:
-                    cell.number_format = '#,##0.00'
- 
-        # Auto-fit columns
-        for col_cells in ws.columns:
-            max_length = 0
-            col_letter = get_column_letter(col_cells[0].column)
-            for cell in col_cells:
-                try:
-                    if cell.value:
-                        max_length = max(max_length, len(str(cell.value)))
-                except Exception:
-                    pass
-            ws.column_dimensions[col_letter].width = min(max_length + 2, 60)
- 
-        # Borders
-        thin_border = Border(
-            left=Side(style='thin'), right=Side(style='thin'),
-            top=Side(style='thin'), bottom=Side(style='thin')
-        )
-        for row in ws.iter_rows(min_row=header_row_idx, max_row=ws.max_row, min_col=1, max_col=len(headers)):
-            for cell in row:
-                cell.border = thin_border
- 
-        # Zebra stripes
-        for row_idx in range(header_row_idx + 1, ws.max_row + 1):
-            if row_idx % 2 == 0:
-                for col_idx in range(1, len(headers) + 1):
-                    ws.cell(row=row_idx, column=col_idx).fill = PatternFill(
-                        start_color="F7F7F7", end_color="F7F7F7", fill_type="solid"
-                    )
- 
-        # --- Summary footer ---
-        ws.append([""])
-        ws.append([f"Debit(s) - {count_debits} Credit(s) - {count_credits}"])
-        ws.merge_cells(start_row=ws.max_row, start_column=1, end_row=ws.max_row, end_column=6)
-        ws[f'A{ws.max_row}'].font = Font(bold=True)
+        # Totals, counts, date range and running balance in one pass.
+        summary = ESCROW_STATEMENT_REPORT.summarise(notifications_sorted, opening_balance)
+        from_dt, to_dt = summary['tran_dt_range']
  
         # --- FIX: closing balance — only use CLOSING_BAL if field is present and non-empty ---
-        last_txn = next((x for x in reversed(notifications_sorted) if isinstance(x, dict)), None)
-        _raw_closing = last_txn.get('CLOSING_BAL') if last_txn else None
+        last_txn = notifications_sorted[-1] if notifications_sorted else None
         closing_balance = (
-            to_float(_raw_closing)
-            if _raw_closing not in (None, '')
-            else (running_balance if notifications_sorted else opening_balance)
+            last_txn.closing_balance
+            if last_txn is not None and last_txn.closing_balance is not None
+            else (summary['running_balance'] if notifications_sorted else opening_balance)
         )
  
-        # --- FIX: split chained openpyxl assignments ---
-        totals_row_idx = ws.max_row + 1
-        lbl_cell = ws.cell(row=totals_row_idx, column=1, value="Total :- ")
-        lbl_cell.font = Font(bold=True)
-        dc = ws.cell(row=totals_row_idx, column=8, value=total_debits)
-        dc.number_format = '#,##0.00'
-        cc = ws.cell(row=totals_row_idx, column=9, value=total_credits)
-        cc.number_format = '#,##0.00'
-        bc = ws.cell(row=totals_row_idx, column=10, value=closing_balance)
-        bc.number_format = '#,##0.00'
- 
-        # --- Closing balance line ---
-        ws.append([""])
-        ws.append([f"Closing balance : {closing_balance:,.2f}"])
-        ws.merge_cells(start_row=ws.max_row, start_column=1, end_row=ws.max_row, end_column=6)
-        ws[f'A{ws.max_row}'].font = Font(bold=True)
- 
-        # --- Footer ---
-        ws.append([""])
-        ws.append(["Printed By : CUSTOMER ENGAGEMENT SYSTEM"])
-        ws.merge_cells(start_row=ws.max_row, start_column=1, end_row=ws.max_row, end_column=6)
-        ws.append([f"Print Date: {datetime.now().strftime('%d-%b-%Y')} "])
-        ws.merge_cells(start_row=ws.max_row, start_column=1, end_row=ws.max_row, end_column=6)
-        ws.append(["Verified By: CUSTOMER ENGAGEMENT SYSTEM"])
-        ws.merge_cells(start_row=ws.max_row, start_column=1, end_row=ws.max_row, end_column=6)
- 
-        # --- Save and email ---
+        # --- Render and email ---
         excel_filename = f"mtn_escrow_statement_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-        wb.save(excel_filename)
-        send_csv_report_email(
-            recipient_email=getattr(settings, 'ESCROW_REPORT_EMAILS', []),
-            subject=f"Daily MTN Escrow Statement - {datetime.now().strftime('%d-%m-%Y %H:%M:%S')}",
-            message="Dear Valued Partner, \nPlease find the attached MTN Escrow statement.",
-            csv_file_path=excel_filename
-        )
-        print(f"Escrow statement saved to {excel_filename}")
+        with ReportArtifact(excel_filename) as artifact:
+            ESCROW_STATEMENT_REPORT.render(
+                artifact.buffer,
+                notifications_sorted,
+                acct_name=(first.get('ACCT_NM') or '').strip(),
+                address=(first.get('ADDR_LINE_1') or '').strip(),
+                branch_name=(first.get('BU_NM') or '').strip(),
+                account_no=(first.get('ACT_NO') or '').strip(),
+                product=(first.get('PROD_DESC') or '').strip(),
+                currency=(first.get('CRNCY_NM') or first.get('CRNCY_CD_ISO') or '').strip(),
+                bank_name=(first.get('BANK_NAME') or 'Pride Bank').strip(),
+                from_date=format_date(from_dt),
+                to_date=format_date(to_dt),
+                closing_balance=closing_balance,
+                **summary,
+            )
+            send_report_email(
+                recipient_email=getattr(settings, 'ESCROW_REPORT_EMAILS', []),
+                subject=f"Daily MTN Escrow Statement - {datetime.now().strftime('%d-%m-%Y %H:%M:%S')}",
+                message="Dear Valued Partner, \nPlease find the attached MTN Escrow statement.",
+                attachment=artifact,
+            )
+            artifact_path = store_report_artifact(artifact)
+        print(f"Escrow statement generated as {excel_filename}")
         return [{
             'filename': excel_filename,
-            'content': f"Escrow statement generated and saved to {excel_filename}",
+            'artifact': artifact_path,
+            'content': f"Escrow statement generated as {excel_filename}",
             'totals': {
-                'debits': total_debits,
-                'credits': total_credits,
-                'count_debits': count_debits,
-                'count_credits': count_credits,
+                'debits': summary['total_debits'],
+                'credits': summary['total_credits'],
+                'count_debits': summary['count_debits'],
+                'count_credits': summary['count_credits'],
                 'opening_balance': opening_balance,
                 'closing_balance': closing_balance,
             }
@@ -808,207 +808,50 @@ def retrieve_ura_report(self):
         if not report_list:
             raise ValueError("Empty 'Report' list received.")
 
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "URA Report"
-        
+        # Parse every row once; a row with a non-numeric amount would make
+        # the balances wrong, so any rejection fails the run as before.
+        records, rejected = URA_REPORT.parse(report_list)
+        if rejected:
+            raise ValueError(f"Invalid URA report rows: {dict(rejected)}")
+
         # Get the initial ledger balance from the first transaction for opening balance
         opening_balance = float(report_list[0].get('OPENING_BALANCE', 0)) if report_list else 0
         
         # Extract GL Account Number from first item
         gl_account_no = report_list[0].get('GL_ACCT_NO', 'N/A') if report_list else 'N/A'
         
-        # Get start and end dates from first and last items in report
-        try:
-            start_date = datetime.fromisoformat(report_list[0]['TRAN_DT'].replace('Z', '+00:00')).strftime('%d/%m/%Y') if report_list else 'N/A'
-            end_date = datetime.fromisoformat(report_list[-1]['TRAN_DT'].replace('Z', '+00:00')).strftime('%d/%m/%Y') if report_list else 'N/A'
-        except (ValueError, KeyError, TypeError):
-            start_date = 'N/A'
-            end_date = 'N/A'
-        
-        # Add report title and date
-        report_date = datetime.now().strftime('%d/%m/%Y')
-        
-        # Insert title row (Row 1)
-        ws.append(["URA Transaction Report"])
-        ws.merge_cells(f'A1:M1')  # Merge cells across all columns
-        title_cell = ws['A1']
-        title_cell.font = Font(bold=True, size=14)
-        title_cell.alignment = Alignment(horizontal='center')
-        
-        # Insert date row (Row 2)
-        ws.append([f"Generated on: {report_date}"])
-        ws.merge_cells(f'A2:M2')  # Merge cells across all columns
-        date_cell = ws['A2']
-        date_cell.font = Font(italic=True)
-        date_cell.alignment = Alignment(horizontal='center')
-        
-        # Insert GL Account No row (Row 3)
-        ws.append([f"GL Account No: {gl_account_no}"])
-        ws.merge_cells(f'A3:M3')  # Merge cells across all columns
-        gl_cell = ws['A3']
-        gl_cell.font = Font(bold=True)
-        gl_cell.alignment = Alignment(horizontal='left')
-        
-        # Insert Account Description row (Row 4)
-        ws.append(["Uganda Revenue Authority ePayments -Cash"])
-        ws.merge_cells(f'A4:M4')  # Merge cells across all columns
-        desc_cell = ws['A4']
-        desc_cell.alignment = Alignment(horizontal='left')
-        
-        # Insert Date Range row (Row 5)
-        ws.append([f"Period: {start_date} to {end_date}"])
-        ws.merge_cells(f'A5:M5')  # Merge cells across all columns
-        range_cell = ws['A5']
-        range_cell.font = Font(bold=True)
-        range_cell.alignment = Alignment(horizontal='left')
-        
-        # Insert empty row (Row 6)
-        ws.append([""])
-        
-        # Insert opening balance section (Row 7)
-        opening_balance_formatted = "{:,.2f}".format(opening_balance)
-        ws.append(["Opening Balance:", "", "", "", "", "", "", "", "", "", "", opening_balance_formatted, ""])
-        ws.merge_cells(f'A7:K7')  # Merge cells A-K
-        opening_balance_label = ws['A7']
-        opening_balance_label.font = Font(bold=True)
-        opening_balance_label.alignment = Alignment(horizontal='right')
-        
-        # Format the opening balance cell
-        opening_balance_cell = ws['L7']  # Column L, row 7
-        opening_balance_cell.font = Font(bold=True)
-        opening_balance_cell.number_format = '#,##0.00'
-        
-        # Insert empty row (Row 8)
-        ws.append([""])
-        
-        # Add headers (Row 9)
-        headers = [
-            "S/N", "Post Date", "Effective Date", "Created By", "Transaction Description",
-            "Reference", "Contra Account", "Origin Branch", "Debit", "Credit", "PRN", "Balance", "Payment Mode"
-        ]
-        ws.append(headers)
-
-        # Bold headers
-        for col_num, header in enumerate(headers, start=1):
-            ws.cell(row=9, column=col_num).font = Font(bold=True)  # Now header is on row 9
-            ws.cell(row=9, column=col_num).alignment = Alignment(horizontal='center')
-
-        # Initialize running balance with opening balance
-        running_balance = opening_balance
-
-        # Add transactions starting from row 10
-        start_row = 10
-        for idx, report in enumerate(report_list, 1):
-            try:
-                post_date = datetime.fromisoformat(report['TRAN_DT'].replace('Z', '+00:00')).strftime('%d/%m/%Y')
-            except:
-                post_date = ""
+        # Report period from the earliest and latest post dates
+        summary = URA_STATEMENT_REPORT.summarise(records, opening_balance)
+        first_dt, last_dt = summary['tran_dt_range']
 
-            try:
-                effective_date = datetime.fromisoformat(report['EFFECTIVE_DT'].replace('Z', '+00:00')).strftime('%d/%m/%Y')
-            except:
-                effective_date = ""
-
-            created_by = report.get('USER_NAME', '')
-            if created_by:
-                created_by = ' '.join(word.capitalize() for word in created_by.lower().split())
-
-            transaction_desc = report.get('TRAN_DESC', '')
-            prn_value = report.get('PRN', '')
-            tin_value = report.get('TIN', '')
-
-            if prn_value and f"PRN: {prn_value}" not in transaction_desc:
-                transaction_desc += f", PRN: {prn_value}"
-            if tin_value and f"TIN: {tin_value}" not in transaction_desc:
-                transaction_desc += f", TIN: {tin_value}"
-
-            debit_amt = float(report.get('DEBIT_AMT') or 0)
-            credit_amt = float(report.get('CREDIT_AMT') or 0)
-            
-            # Calculate running balance
-            running_balance = running_balance + credit_amt - debit_amt
-            calculated_ledger_bal = running_balance
-
-            row = [
-                idx,
-                post_date,
-                effective_date,
-                created_by,
-                transaction_desc,
-                str(report.get('TRAN_REF_TXT', '')),    # Keep as string
-                str(report.get('CONTRA_ACCT_NO', '')),  # Keep as string
-                str(report.get('USER_BU', '')),
-                debit_amt,
-                credit_amt,
-                str(prn_value),                         # Force as string
-                calculated_ledger_bal,
-                str(report.get('PAYMENT_TYPE', '')),
-            ]
-
-            ws.append(row)
-
-        # Format numeric columns with comma and 2 decimals - adjust row index for headers now at row 9
-        money_columns = ['I', 'J', 'L']  # Debit, Credit, Balance
-        for col in money_columns:
-            for cell in ws[col][start_row-1:]:  # Start after headers
-                cell.number_format = '#,##0.00'
-
-        # Format text columns to prevent scientific notation - adjust row index
-        text_columns = ['F', 'G', 'K']  # Reference, Contra Account, PRN
-        for col in text_columns:
-            for cell in ws[col][start_row-1:]:  # Start after headers
-                cell.number_format = '@'
-                cell.alignment = Alignment(horizontal='left')
-
-        # Auto-adjust column widths
-        for col_cells in ws.columns:
-            max_length = 0
-            column = col_cells[0].column
-            col_letter = get_column_letter(column)
-            for cell in col_cells:
-                try:
-                    if cell.value:
-                        max_length = max(max_length, len(str(cell.value)))
-                except:
-                    pass
-            ws.column_dimensions[col_letter].width = max_length + 2
-
-        # Add borders to the entire table
-        thin_border = Border(left=Side(style='thin'), 
-                             right=Side(style='thin'),
-                             top=Side(style='thin'),
-                             bottom=Side(style='thin'))
-                             
-        # Apply the border to all cells with content
-        for row in ws.iter_rows(min_row=9, max_row=ws.max_row, min_col=1, max_col=13):
-            for cell in row:
-                cell.border = thin_border
-                
-        # Apply alternating row colors for better readability
-        for row_idx in range(10, ws.max_row + 1):  # Start from row 10
-            if row_idx % 2 == 0:  # even rows
-                for col_idx in range(1, 14):  # columns A-M
-                    ws.cell(row=row_idx, column=col_idx).fill = PatternFill(start_color="F2F2F2", 
-                                                                           end_color="F2F2F2",
-                                                                           fill_type="solid")
-
-        # Save Excel file
+        # Render the Excel file
         excel_filename = f"ura_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-        wb.save(excel_filename)
-
-        # Send the Excel file via email
-        send_csv_report_email(
-            recipient_email=settings.URA_REPORT_EMAILS,
-            subject="URA Report Excel",
-            message="Please find attached the latest URA report.",
-            csv_file_path=excel_filename
-        )
+        with ReportArtifact(excel_filename) as artifact:
+            URA_STATEMENT_REPORT.render(
+                artifact.buffer,
+                records,
+                gl_account_no=gl_account_no,
+                start_date=format_date(first_dt, 'N/A'),
+                end_date=format_date(last_dt, 'N/A'),
+                opening_balance=opening_balance,
+                opening_balance_text="{:,.2f}".format(opening_balance),
+                running_balances=summary['running_balances'],
+            )
+
+            # Send the Excel file via email
+            send_report_email(
+                recipient_email=settings.URA_REPORT_EMAILS,
+                subject="URA Report Excel",
+                message="Please find attached the latest URA report.",
+                attachment=artifact,
+            )
+            artifact_path = store_report_artifact(artifact)
 
-        print(f"URA report saved to {excel_filename}")
+        print(f"URA report generated as {excel_filename}")
         return [{
             'filename': excel_filename,
-            'content': f"URA report generated and saved to {excel_filename}"
+            'artifact': artifact_path,
+            'content': f"URA report generated as {excel_filename}"
         }]
 
     except (ValueError) as e:
@@ -1020,7 +863,8 @@ def retrieve_ura_report(self):
         raise self.retry(exc=exc)
 
 
-def send_csv_report_email(recipient_email, subject, message, csv_file_path):
+def send_report_email(recipient_email, subject, message, attachment):
+    """Email a rendered ReportArtifact straight from its buffer."""
     try:
         recipients = recipient_email if isinstance(recipient_email, list) else [recipient_email]
 
@@ -1031,22 +875,26 @@ def send_csv_report_email(recipient_email, subject, message, csv_file_path):
             to=recipients,
         )
 
-        # Attach CSV file
-        if os.path.exists(csv_file_path):
-            with open(csv_file_path, 'rb') as f:
-                email.attach(os.path.basename(csv_file_path), f.read(), 'text/csv')
-        else:
-            print("CSV file not found at:", csv_file_path)
-            return False
+        # Attach the report
+        email.attach(attachment.filename, attachment.getvalue(), attachment.content_type)
 
         email.send()
-        print(f"Email sent to {recipient_email} with CSV attachment.")
+        print(f"Email sent to {recipient_email} with {attachment.filename} attached.")
         return True
     except Exception as e:
-        print("Error sending CSV report email:", e)
+        print("Error sending report email:", e)
         return False
 
 
+def store_report_artifact(artifact):
+    """Keep a copy of `artifact` in the report artifact store, if one is configured."""
+    store = get_artifact_store()
+    if store is None:
+        return None
+    path = store.save(artifact)
+    print(f"Report artifact stored at {path}")
+    return path
+
 
 @shared_task(bind=True, max_retries=5, default_retry_delay=300)
 def retrieve_interswitch_agents_report(self):
@@ -1082,34 +930,16 @@ def retrieve_interswitch_agents_report(self):
         if not report_list:
             raise ValueError("Empty Interswitch agents report received.")
 
-        def safe_parse_date(dt):
-            try:
-                if not dt:
-                    return None
-                return parse(str(dt))
-            except Exception:
-                return None
-
-        def to_float(val):
-            try:
-                if val in (None, ''):
-                    return 0.0
-                return float(str(val).replace(',', ''))
-            except Exception:
-                return 0.0
-
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "Interswitch Agents Report"
+        # Parse each row once into a typed record. The schema has no
+        # required fields, so records[i] is report_list[i].
+        records, _ = INTERSWITCH_REPORT.parse(report_list)
 
         # Order rows chronologically so the running balance / period read correctly.
-        report_sorted = sorted(
-            report_list,
-            key=lambda n: safe_parse_date(n.get('TRAN_DT')) or datetime.min,
-        )
+        order = sorted(range(len(records)), key=lambda i: records[i].tran_dt or datetime.min)
+        report_sorted = [records[i] for i in order]
 
         # Header-level details from the first record.
-        first = report_sorted[0]
+        first = report_list[order[0]]
         acct_name = (first.get('ACCT_NM') or '').strip()
         # customer_name = (first.get('CUST_NM') or '').strip()
         # address = (first.get('ADDR_LINE_1') or '').strip()
@@ -1119,203 +949,47 @@ def retrieve_interswitch_agents_report(self):
         currency = (first.get('CRNCY_NM') or first.get('CRNCY_CD_ISO') or '').strip()
         bank_name = (first.get('BANK_NAME') or 'Pride Bank').strip()
 
-        # Period from min/max transaction date.
-        start_dates = [d for d in (safe_parse_date(n.get('TIMESTAMP')) for n in report_sorted) if d]
-        end_dates = [d for d in (safe_parse_date(n.get('TRAN_DT')) for n in report_sorted) if d]
-
-        start_date = min(start_dates).strftime('%d/%m/%Y') if start_dates else 'N/A'
-        end_date = max(end_dates).strftime('%d/%m/%Y') if end_dates else 'N/A'
-        report_date = datetime.now().strftime('%d/%m/%Y')
-
         # Prefer the explicit balance/total fields supplied in the payload,
         # falling back to derived values where they are absent.
         last = report_sorted[-1]
-        opening_balance = to_float(first.get('OPENING_BAL'))
+        opening_balance = report_sorted[0].opening_balance
         # closing_balance = to_float(last.get('CLOSING_BAL')) or to_float(last.get('STMNT_BAL'))
-        closing_balance = to_float(last.get('STMNT_BAL'))
-        # total_debits = to_float(first.get('TOTAL_DR_AMT')) or sum(to_float(n.get('DEBIT_AMT')) for n in report_sorted)
-        total_debits = sum(to_float(n.get('DEBIT_AMT')) for n in report_sorted)
-        # total_credits = to_float(first.get('TOTAL_CR_AMT')) or sum(to_float(n.get('CREDIT_AMT')) for n in report_sorted)
-        total_credits = sum(to_float(n.get('CREDIT_AMT')) for n in report_sorted)
-
-        count_debits = sum(1 for n in report_sorted if to_float(n.get('DEBIT_AMT')) > 0)
-        count_credits = sum(1 for n in report_sorted if to_float(n.get('CREDIT_AMT')) > 0)
-
-        # Transaction table columns mapped to the Interswitch fields.
-        headers = [
-            ("S/N", None),
-            # ("Transaction Date", 'TRAN_DT'), // Changed to TIMESTAMP for better clarity
-            ("Transaction Date", 'TIMESTAMP'),
-            ("Value Date", 'VALUE_DT'),
-            ("Description", 'TRAN_DESC'),
-            ("Reference", 'TRAN_REF_TXT'),
-            # ("Event", 'EVENT_DESC'),
-            # ("Channel", 'CHANNEL_DESC'),
-            # ("Contra Account", 'CONTRA_ACCT_NO'),
-            ("Recipient Account", 'RECIPIENT_ACCOUNT'),
-            ("Recipient", 'RECIPIENT_NAME'),
-            ("Dr / Cr", 'DR_CR_IND'),
-            ("Debit", 'DEBIT_AMT'),
-            ("Credit", 'CREDIT_AMT'),
-            ("Balance", 'STMNT_BAL'),
-            # ("Posted By", 'POSTED_BY'),
-            # ("Branch", 'BU_NM'),
-        ]
-        header_labels = [h[0] for h in headers]
-        num_cols = len(headers)
-
-        date_fields = {'TRAN_DT', 'VALUE_DT', 'TIMESTAMP'}
-        amount_fields = {'DEBIT_AMT', 'CREDIT_AMT', 'STMNT_BAL'}
-        # text_fields = {'TRAN_REF_TXT', 'CONTRA_ACCT_NO'}  # keep as text, no sci-notation
-        text_fields = {'TRAN_REF_TXT', 'RECIPIENT_ACCOUNT'}  # keep as text, no sci-notation
-
-        # Column letters used for number/text formatting below.
-        amount_cols = [get_column_letter(i + 1) for i, h in enumerate(headers) if h[1] in amount_fields]
-        text_cols = [get_column_letter(i + 1) for i, h in enumerate(headers) if h[1] in text_fields]
-
-        def merge_full(row_idx):
-            ws.merge_cells(start_row=row_idx, start_column=1, end_row=row_idx, end_column=num_cols)
-
-        # Title (Row 1)
-        ws.append(["Interswitch Agency Banking Report"])
-        merge_full(1)
-        ws['A1'].font = Font(bold=True, size=14)
-        ws['A1'].alignment = Alignment(horizontal='center')
-
-        # Generated-on subtitle (Row 2)
-        ws.append([f"Generated on: {report_date}"])
-        merge_full(2)
-        ws['A2'].font = Font(italic=True)
-        ws['A2'].alignment = Alignment(horizontal='center')
-
-        # Account information block (left-aligned, one field per merged row).
-        info_lines = [
-            f"Account Name: {acct_name}",
-            # f"Customer: {customer_name}",
-            f"Account No: {account_no}",
-            f"Product: {product}",
-            f"Currency: {currency}",
-            # f"Branch: {branch_name}",
-            # f"Address: {address}",
-            f"Bank: {bank_name}",
-            f"Period: {start_date} to {end_date}",
-        ]
-        for line in info_lines:
-            ws.append([line])
-            merge_full(ws.max_row)
-            ws[f'A{ws.max_row}'].font = Font(bold=True)
-            ws[f'A{ws.max_row}'].alignment = Alignment(horizontal='left')
-
-        # Spacer + opening balance line.
-        ws.append([""])
-        ws.append([f"Opening Balance: {opening_balance:,.2f}"])
-        merge_full(ws.max_row)
-        ws[f'A{ws.max_row}'].font = Font(bold=True)
-
-        # Spacer before the table.
-        ws.append([""])
-
-        # Table header row.
-        ws.append(header_labels)
-        header_row_idx = ws.max_row
-        for col_num in range(1, num_cols + 1):
-            cell = ws.cell(row=header_row_idx, column=col_num)
-            cell.font = Font(bold=True)
-            cell.alignment = Alignment(horizontal='center')
-
-        # Data rows.
-        for idx, record in enumerate(report_sorted, start=1):
-            row_values = []
-            for _label, field in headers:
-                if field is None:  # S/N column
-                    row_values.append(idx)
-                elif field in date_fields:
-                    parsed = safe_parse_date(record.get(field))
-                    row_values.append(parsed.strftime('%d/%m/%Y') if parsed else '')
-                elif field in amount_fields:
-                    row_values.append(to_float(record.get(field)))
-                elif field in text_fields:
-                    row_values.append(str(record.get(field) or ''))
-                else:
-                    row_values.append(record.get(field) or '')
-            ws.append(row_values)
-
-        data_end_row = ws.max_row
-
-        # Number / text formatting on the data rows.
-        for col in amount_cols:
-            for cell in ws[col][header_row_idx:data_end_row]:
-                cell.number_format = '#,##0.00'
-        for col in text_cols:
-            for cell in ws[col][header_row_idx:data_end_row]:
-                cell.number_format = '@'
-                cell.alignment = Alignment(horizontal='left')
-
-        # Summary footer: counts, totals, closing balance.
-        ws.append([""])
-        ws.append([f"Debit(s) - {count_debits}   Credit(s) - {count_credits}"])
-        merge_full(ws.max_row)
-        ws[f'A{ws.max_row}'].font = Font(bold=True)
-
-        totals_row_idx = ws.max_row + 1
-        ws.cell(row=totals_row_idx, column=1, value="Total :-").font = Font(bold=True)
-        debit_col_idx = header_labels.index("Debit") + 1
-        credit_col_idx = header_labels.index("Credit") + 1
-        balance_col_idx = header_labels.index("Balance") + 1
-        ws.cell(row=totals_row_idx, column=debit_col_idx, value=total_debits).number_format = '#,##0.00'
-        ws.cell(row=totals_row_idx, column=credit_col_idx, value=total_credits).number_format = '#,##0.00'
-        ws.cell(row=totals_row_idx, column=balance_col_idx, value=closing_balance).number_format = '#,##0.00'
-
-        ws.append([""])
-        ws.append([f"Closing Balance: {closing_balance:,.2f}"])
-        merge_full(ws.max_row)
-        ws[f'A{ws.max_row}'].font = Font(bold=True)
-
-        # Auto-adjust column widths.
-        for col_cells in ws.columns:
-            max_length = 0
-            col_letter = get_column_letter(col_cells[0].column)
-            for cell in col_cells:
-                try:
-                    if cell.value is not None:
-                        max_length = max(max_length, len(str(cell.value)))
-                except Exception:
-                    pass
-            ws.column_dimensions[col_letter].width = min(max_length + 2, 60)
-
-        # Borders on the table (header + data).
-        thin_border = Border(
-            left=Side(style='thin'),
-            right=Side(style='thin'),
-            top=Side(style='thin'),
-            bottom=Side(style='thin'),
-        )
-        for row in ws.iter_rows(min_row=header_row_idx, max_row=data_end_row, min_col=1, max_col=num_cols):
-            for cell in row:
-                cell.border = thin_border
-
-        # Alternating row shading for readability.
-        for row_idx in range(header_row_idx + 1, data_end_row + 1):
-            if row_idx % 2 == 0:
-                for col_idx in range(1, num_cols + 1):
-                    ws.cell(row=row_idx, column=col_idx).fill = PatternFill(
-                        start_color="F2F2F2", end_color="F2F2F2", fill_type="solid"
-                    )
+        closing_balance = last.balance
+        # Totals, counts and the period (earliest TIMESTAMP to latest
+        # TRAN_DT) in one pass.
+        summary = INTERSWITCH_STATEMENT_REPORT.summarise(report_sorted, opening_balance)
+        start_date = format_date(summary['timestamp_range'][0], 'N/A')
+        end_date = format_date(summary['tran_dt_range'][1], 'N/A')
 
         excel_filename = f"interswitch_agents_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-        wb.save(excel_filename)
+        with ReportArtifact(excel_filename) as artifact:
+            INTERSWITCH_STATEMENT_REPORT.render(
+                artifact.buffer,
+                report_sorted,
+                acct_name=acct_name,
+                account_no=account_no,
+                product=product,
+                currency=currency,
+                bank_name=bank_name,
+                start_date=start_date,
+                end_date=end_date,
+                closing_balance=closing_balance,
+                **summary,
+            )
 
-        send_csv_report_email(
-            recipient_email=settings.INTERSWITCH_REPORT_EMAILS,
-            subject="Interswitch Agents Report Excel",
-            message="Dear Valued Partner, \nPlease find the attached Daily Interswitch statement.",
-            csv_file_path=excel_filename,
-        )
+            send_report_email(
+                recipient_email=settings.INTERSWITCH_REPORT_EMAILS,
+                subject="Interswitch Agents Report Excel",
+                message="Dear Valued Partner, \nPlease find the attached Daily Interswitch statement.",
+                attachment=artifact,
+            )
+            artifact_path = store_report_artifact(artifact)
 
-        print(f"Interswitch agents report saved to {excel_filename}")
+        print(f"Interswitch agents report generated as {excel_filename}")
         return [{
             'filename': excel_filename,
-            'content': f"Interswitch agents report generated and saved to {excel_filename}"
+            'artifact': artifact_path,
+            'content': f"Interswitch agents report generated as {excel_filename}"
         }]
 
     except (ValueError) as e:
@@ -1330,22 +1004,11 @@ def retrieve_interswitch_agents_report(self):
 @shared_task(bind=True, max_retries=5, default_retry_delay=300)
 def retrieve_group_loans(self):
     try:
-        group_loans_data = handle_group_loans()
-        # print("Group Loans Datat",group_loans_data)
-        person_list = group_loans_data.get("Report", [])
-        # print("Filtered Persons List",person_list)
-
-        if not person_list:
-            raise ValueError("Empty 'Person' list received.")
+        person_list = _campaign_records('group_loans', handle_group_loans, 'Report')
 
         # updated_birthday_list = update_group_loans(person_list)
         # print(updated_birthday_list)
-        response_data = []
-
-        for group_loan in person_list:
-            response = send_sms_to_api(group_loan)
-            if response:
-                response_data.append(response)
+        response_data = _send_campaign(person_list, 'group_loans')
 
         return response_data
 
@@ -1358,254 +1021,47 @@ def retrieve_group_loans(self):
         raise self.retry(exc=exc)
 
 
+def _save_sms_log(log_model, log_sink, **fields):
+    if log_sink is None:
+        return log_model.objects.create(**fields)
+    log_sink.add(log_model(**fields))
+
+
 @shared_task(bind=True, max_retries=2, default_retry_delay=60)
-def send_sms_to_api(self, message_detail):
+def send_sms_to_api(self, message_detail, log_sink=None, message_type=None):
+    """Word, send and log one SMS notice.
+
+    The notice type comes from `message_type` (a name from
+    `message_types.MESSAGE_TYPES`, resolved once per campaign by the caller)
+    or, when not given, from the record's marker keys. All per-type parsing,
+    wording and log-row layout lives in the handler; this function only owns
+    the send and the success/failure logging around it.
+    """
     resp = ""
-    http = urllib3.PoolManager(cert_reqs='CERT_NONE', assert_hostname=False)
+    candidate = None
+    handler = None
+    fields = {}
+    message = ""
     response_data = {}
-    
-    try:
-        # Set up base fields
-        acct_nm = ""
-        tel_number = ""
-        message = ""
-        log_model = None
-        due_dt_for_db = None
-        amt_due = None
-        date_of_birth = None
-        group_cust_no = None
-        client_type = None
-        card_title = ""
-        pan_masked = ""
-        cust_id = ""
-        cust_no = ""
-        requested_date = None
-        expiry_date = None
-        transaction_acct = ""
-        txn_date_for_db = None
-        txn_time_fmt = ""
-
-        # Handle custom messages (New condition for insurance messages)
-        if 'CUSTOM_MESSAGE' in message_detail:
-            acct_nm = message_detail.get('CUST_NM')
-            tel_number = message_detail.get('TEL_NUMBER')
-            # Use the custom message directly
-            message = message_detail.get('CUSTOM_MESSAGE')
-            log_model = GroupSMSLog  # Use standard SMS log for custom messages
-
-        elif 'AMT_DUE' in message_detail:
-            # Loan due message handling (existing code)
-            acct_nm = message_detail.get('CUST_NM')
-            tel_number = message_detail.get('TEL_NUMBER')
-            due_dt_serial = message_detail.get('DUE_DT')
-            amt_due = float(message_detail.get('AMT_DUE', 0))
-
-            due_dt_obj = parse(due_dt_serial) if isinstance(due_dt_serial, str) else due_dt_serial
-            due_dt_for_db = due_dt_obj.date()
-            due_dt_for_sms = due_dt_obj.strftime('%d-%m-%Y')
-
-            formatted_amt_due = "{:,}".format(round(amt_due))
-            message = (
-                f"Dear {acct_nm}, your loan instalment is due on {due_dt_for_sms}. "
-                "Thank you for banking with us. Toll Free: 0800333999"
-            )
-            log_model = SMSLog
-
-        elif 'BIRTH_DT' in message_detail:
-            # Birthday message
-            acct_nm = message_detail.get('FIRST_NM')
-            tel_number = message_detail.get('TEL_NUMBER')
-            date_of_birth_raw = message_detail.get('BIRTH_DT')
-            client_type = message_detail.get('CLIENT_TYPE', 'CUSTOMER')
 
-            try:
-                date_of_birth = parse(date_of_birth_raw).date()
-            except Exception as e:
-                print(f"Failed to parse BIRTH_DT: {e}")
-                date_of_birth = None
-
-            message = (
-                f"Dear {acct_nm}, Pride Wishes you a Happy Birthday. We value our relationship with you. "
-                "Thank you for choosing Pride. Toll Free: 0800333999"
-            )
-            log_model = BirthdaySMSLog
-
-        elif 'CUSTOMER_NAME' in message_detail:
-            # Extract raw values
-            acct_no = message_detail.get('ACCT_NO', '')
-            txn_amount = message_detail.get('TXN_AMT', '0')
-            txn_date_raw = message_detail.get('TXN_TIME')
-            tran_desc = message_detail.get('TRAN_DESC', '')
-            ledger_bal = message_detail.get('LEDGER_BAL', '0')
-            acct_nm = message_detail.get('CUSTOMER_NAME', '')
-            tel_number = message_detail.get('TEL_NUMBER') or message_detail.get('CUSTOMER_NAME', '')
-
-            # 1. Mask account number (last 4 digits)
-            acct_masked = f"***{acct_no[-4:]}" if acct_no else "***0000"
-
-            greg_school_account=settings.GREG_SCHOOL_ACCOUNT_NUMBER
-            # creamland_account=settings.CREAMLAND_SCHOOL_ACCOUNT_NUMBER
-            precious_school_account=settings.PRECIOUS_SCHOOL_ACCOUNT_NUMBER
-            
-            school_name = "Valued Customer" # Default name if no account match
-
-            if acct_no == greg_school_account:
-                school_name = "GREGS HILL PRI SCH"
-            # elif acct_no == creamland_account:
-            #     school_name = "CREAMLAND PRI SCH"
-            elif acct_no == precious_school_account:
-                school_name = "PRECIOUS KINDERGARTEN"
-
-            # 2. Format amount (UGX with commas)
-            try:
-                txn_amount_fmt = f"{int(float(txn_amount)):,}"
-            except:
-                txn_amount_fmt = txn_amount
-
-            # 3. Format date and time
-            try:
-                parsed_txn_date = datetime.fromisoformat(txn_date_raw)
-                txn_date_for_db = parsed_txn_date.date()
-                txn_date_fmt = parsed_txn_date.strftime("%d/%m/%Y")
-                txn_time_fmt = parsed_txn_date.strftime("%H:%M")
-                print(f"Parsed TRAN_DT '{txn_date_raw}' to '{txn_date_fmt} {txn_time_fmt}'")
-            except Exception as e:
-                print(f"Failed to parse TRAN_DT '{txn_date_raw}': {e}")
-                txn_date_fmt = txn_date_raw
-                txn_date_for_db = None
-                txn_time_fmt = ""
-                
-            # 4. Extract "1009453253-Jane Doe"
-            extracted_desc = ""
-            try:
-                print(f"Attempting to extract description from TRAN_DESC: '{tran_desc}'")
-                match = re.search(
-                    # r'(\d+-.*?)(?=-(?:MTN_UG|AIRTEL_UG)\b)',
-                    # r'(\d+-.*?)(?=-(?:MTN_UG|AIRTEL_UG|AIRTEL_MONEY_UG)\b)',
-                    r'(\d+-.*?)(?=-[A-Z_]+_UG\b)',
-                    tran_desc,
-                    flags=re.IGNORECASE,
-                )
-                if match:
-                    extracted_desc = match.group(1).strip()
-                else:
-                    extracted_desc = "UNKNOWN"
-            except Exception as e:
-                print(f"Failed to extract description from TRAN_DESC: {e}")
-                extracted_desc = "UNKNOWN"
-
-            # 5. Format balance (remove decimals, add commas)
-            try:
-                bal_fmt = f"{int(float(ledger_bal)):,}"
-            except:
-                bal_fmt = ledger_bal
-
-            # Final message
-            message = (
-                f"{school_name}, CR on A/C {acct_masked} "
-                f"with UGX {txn_amount_fmt} on {txn_date_fmt} "
-                f"at {txn_time_fmt} "
-                f"by {extracted_desc}. Bal:{bal_fmt}. "
-                f"For Help Call 0800333999"
-            )
-            print(f"Generated {school_name} message:", message)
-            log_model = GregSchoolSMSLog
-
-        
-        elif 'GROUP_CUST_NO' in message_detail:
-            # Group loan message - updated format
-            full_name = message_detail.get('MEMBER_NM', '')
-            
-            name_parts = full_name.split()
-            if len(name_parts) > 1:
-                display_name = name_parts[-1]
-            else:
-                display_name = full_name
-        
-            acct_nm = full_name
-            tel_number = message_detail.get('PHONE', '')
-            group_cust_no = message_detail.get('GROUP_CUST_NO', '')
-            
-            try:
-                loan_amount = float(message_detail.get('LOAN_AMOUNT_PAID', '0'))
-                comp_amount = float(message_detail.get('COMP_AMOUNT_PAID', '0'))
-                vol_amount = float(message_detail.get('VOL_AMOUNT_PAID', '0'))
-                
-                total_amount = loan_amount + comp_amount + vol_amount
-                
-                formatted_total = "{:,.0f}".format(total_amount)
-            except (ValueError, TypeError) as e:
-                print(f"Error calculating total amount: {e}")
-                formatted_total = "0"
-            
-            try:
-                create_dt = datetime.fromisoformat(message_detail.get('CREATE_DT', '').replace('Z', '+00:00'))
-                formatted_date = create_dt.strftime('%d-%m-%Y')
-            except (ValueError, TypeError, AttributeError) as e:
-                print(f"Error formatting date: {e}")
-                formatted_date = datetime.now().strftime('%d-%m-%Y')
-            
-            message = (
-                f"Dear {display_name}, your CEC/MEC collection of Shs {formatted_total} has been received on {formatted_date}. "
-                "For Help Call 0800333999. Never share your ATM/Mobile PIN."
-            )
-            print("Generated group loan message:", message)
-            log_model = GroupLoanSMSLog
-
-        elif "CARD_TITLE" in message_detail:
-            # ATM card expiry message
-            pan_masked = str(message_detail.get('PAN_MASKED') or '')
-            tel_number = str(message_detail.get('MOBILE_CONTACT') or '').strip()
-            card_title_raw = str(message_detail.get('CARD_TITLE') or '').strip()
-            card_title = card_title_raw.split()[0].replace(',', '') if card_title_raw else 'Customer'
-            acct_nm = card_title
-
-            cust_id = str(message_detail.get('CUST_ID') or '').strip()
-            cust_no = str(message_detail.get('CUST_NO') or '').strip()
-            transaction_acct = str(message_detail.get('TRANSACTION_ACCT') or '').strip()
-
-            try:
-                requested_date_raw = message_detail.get('REQUESTED_DATE')
-                requested_date = parse(requested_date_raw).date() if requested_date_raw else None
-            except Exception:
-                requested_date = None
-
-            try:
-                expiry_date_raw = message_detail.get('EXPIRY_DATE')
-                expiry_date = parse(expiry_date_raw).date() if expiry_date_raw else None
-            except Exception:
-                expiry_date = None
-
-            # Skip invalid/non-SMS contacts (e.g., emails)
-            if not tel_number.isdigit():
-                raise ValueError(f"Invalid ATM contact '{tel_number}' for card '{card_title_raw}'")
-
-            # Keep model field length constraints safe
-            tel_number = tel_number[:15]
-            transaction_acct = transaction_acct[:50]
-
-            message = (
-                f"Dear {card_title}, your ATM card ending with **{pan_masked[-4:]} will expire at the end of this month. "
-                "Please visit your nearest branch to renew. Never share your PIN."
-            )
-            log_model = ATMExpirySMSLog
-
-        else:
+    try:
+        candidate = (
+            get_message_type(message_type)
+            if message_type
+            else resolve_message_type(message_detail)
+        )
+        if candidate.marker not in message_detail:
             raise ValueError("Invalid message_detail format: no recognized fields found.")
 
-        # Idempotency guard for Greg School reports: never send the same SMS
-        # twice. A successful send is logged with status="SENT" below, so if an
-        # identical message to the same contact is already recorded as sent,
-        # skip it. This protects against window overlap and Celery retries
-        # re-processing a batch after a partial failure.
-        if log_model == GregSchoolSMSLog and GregSchoolSMSLog.objects.filter(
-            contact=tel_number,
-            message=message,
-            status="SENT",
-        ).exists():
-            print(f"Skipping duplicate Greg School SMS to {tel_number}: already sent.")
+        fields = candidate.extract(message_detail)
+        message = candidate.render(fields)
+        handler = candidate
+        tel_number = fields['tel_number']
+
+        if handler.already_sent(fields, message, log_sink):
+            print(f"Skipping duplicate {handler.name} SMS to {tel_number}: already sent.")
             return {
-                'account_name': acct_nm,
+                'account_name': fields['acct_nm'],
                 'phone_number': tel_number,
                 'message': message,
                 'status': 'skipped_duplicate',
@@ -1614,18 +1070,19 @@ def send_sms_to_api(self, message_detail):
 
         # Birthday messages go through the new SMS gateway; every other message
         # type keeps using the legacy Moonlight endpoint below.
-        if log_model == BirthdaySMSLog:
+        if handler.gateway == 'birthday':
             api_response = send_birthday_sms(tel_number, message)
         else:
-            # Send SMS (existing code)
             sender_name = os.getenv("MOONLIGHT_SENDER_NAME", "default_sender")
             password = os.getenv("MOONLIGHT_SENDER_PASSWORD", "default_password")
             address = os.getenv("MOONLIGHT_SENDER_ADDRESS", "http://example.com/api")
 
-            resp = http.request(
-                'GET',
-                f"{address}?sender_name={sender_name}&password={password}&recipient_addr={tel_number}&message={message}"
-            )
+            with get_gateway_throttle('moonlight').slot() as slot:
+                resp = get_moonlight_client().request(
+                    'GET',
+                    f"{address}?sender_name={sender_name}&password={password}&recipient_addr={tel_number}&message={message}"
+                )
+                slot.record_status(resp.status)
 
             # Attempt to parse response
             try:
@@ -1633,172 +1090,69 @@ def send_sms_to_api(self, message_detail):
             except json.decoder.JSONDecodeError:
                 api_response = {"raw_response": resp.data.decode('utf-8')}
 
-
         response_data = {
-            'account_name': acct_nm,
+            'account_name': fields['acct_nm'],
             'phone_number': tel_number,
             'message': message,
-            'due_date': due_dt_for_db,
-            'amount_due': amt_due,
+            'due_date': fields.get('due_date'),
+            'amount_due': fields.get('amount_due'),
             'status': api_response,
             'response_data': api_response
         }
 
-        # Save to appropriate model
-        if log_model == SMSLog:
-            log_model.objects.create(
-                account_name=acct_nm,
-                phone_number=tel_number,
-                message=message,
-                due_date=due_dt_for_db,
-                amount_due=amt_due or 0,
-                status=api_response,
-                response_data=api_response
-            )
-        # Save to appropriate model
-        elif log_model == GroupSMSLog:
-            log_model.objects.create(
-                account_name=acct_nm,
-                phone_number=tel_number,
-                message=message,
-                status=api_response,
-                response_data=api_response
-            )
-        elif log_model == BirthdaySMSLog:
-            # The new gateway returns {"requestId": ..., "status": "QUEUED"}.
-            # Store the short status string in `status` (CharField) and keep the
-            # full payload (incl. requestId) in `response_data`.
-            birthday_status = (
-                api_response.get("status")
-                if isinstance(api_response, dict)
-                else api_response
-            )
-            log_model.objects.create(
-                acct_nm=acct_nm,
-                client_type=client_type,
-                message=message,
-                date_of_birth=date_of_birth,
-                contact=tel_number,
-                status=birthday_status,
-                response_data=api_response
-            )
-        elif log_model == GroupLoanSMSLog:
-            # Create new group loan SMS log entry
-            log_model.objects.create(
-                acct_nm=acct_nm,
-                group_cust_no=group_cust_no,
-                message=message,
-                contact=tel_number,
-                status=api_response,
-                response_data=api_response
-            )
-        elif log_model == ATMExpirySMSLog:
-            log_model.objects.create(
-                cust_id=cust_id,
-                cust_no=cust_no,
-                pan_masked=pan_masked,
-                card_title=card_title,
-                requested_date=requested_date,
-                expiry_date=expiry_date,
-                transaction_acct=transaction_acct,
-                mobile_contact=tel_number,
-                message=message,
-                status=api_response,
-                response_data=api_response
-            )
-        elif log_model == GregSchoolSMSLog:
-            log_model.objects.create(
-                acct_nm=acct_no,
-                txn_amount=txn_amount,
-                txn_date=txn_date_for_db,
-                tran_description=tran_desc,
-                ledger=ledger_bal,
-                contact=tel_number,
-                message=message,
-                status="SENT",
-                response_data=api_response,
-            )
+        _save_sms_log(
+            handler.log_model,
+            log_sink,
+            **handler.log_row(fields, message, handler.sent_status(api_response), api_response),
+        )
 
         return response_data
 
+    except CircuitOpenError as e:
+        # The gateway is known to be down: hand the message back for the
+        # deferred spool instead of waiting out a timeout and logging a failure.
+        print(f"Deferring {handler.name} SMS to {fields['tel_number']}: {e}")
+        return {
+            'account_name': fields['acct_nm'],
+            'phone_number': fields['tel_number'],
+            'message': message,
+            'status': 'deferred',
+            'response_data': {'deferred': str(e)},
+        }
+
     except Exception as e:
         error_msg = str(e)
         fallback_response = resp.data.decode('utf-8') if resp else "No response received"
         print(f"Error sending SMS: {error_msg}")
 
-        # Log even failed attempts
-        if log_model == SMSLog:
-            log_model.objects.create(
-                account_name=acct_nm,
-                phone_number=tel_number,
-                message=message,
-                due_date=due_dt_for_db,
-                amount_due=amt_due,
-                status=fallback_response,
-                response_data={"error": error_msg}
-            )
-        elif log_model == GroupSMSLog:
-            log_model.objects.create(
-                account_name=acct_nm,
-                phone_number=tel_number,
-                message=message,
-                status=fallback_response,
-                response_data={"error": error_msg}
-            )
-        elif log_model == BirthdaySMSLog:
-            log_model.objects.create(
-                acct_nm=acct_nm,
-                client_type=client_type if 'client_type' in locals() else 'Birthday',
-                message=message,
-                date_of_birth=date_of_birth,
-                contact=tel_number,
-                status=fallback_response,
-                response_data={"error": error_msg}
-            )
-        elif log_model == GroupLoanSMSLog:
-            # Error handling for group loan SMS
-            log_model.objects.create(
-                acct_nm=acct_nm,
-                group_cust_no=group_cust_no if group_cust_no else "",
-                message=message,
-                contact=tel_number,
-                status=fallback_response,
-                response_data={"error": error_msg}
-            )
-        elif log_model == ATMExpirySMSLog:
-            log_model.objects.create(
-                cust_id=cust_id,
-                cust_no=cust_no,
-                pan_masked=pan_masked,
-                card_title=card_title or acct_nm,
-                requested_date=requested_date,
-                expiry_date=expiry_date,
-                transaction_acct=transaction_acct,
-                mobile_contact=tel_number,
-                message=message,
-                status=fallback_response,
-                response_data={"error": error_msg}
+        # Log even failed attempts, once the record was understood well enough
+        # to know where it belongs.
+        if handler is not None:
+            _save_sms_log(
+                handler.log_model,
+                log_sink,
+                **handler.log_row(
+                    fields,
+                    message,
+                    handler.failed_status(fallback_response),
+                    {"error": error_msg},
+                    failed=True,
+                ),
             )
 
-        elif log_model == GregSchoolSMSLog:
-            log_model.objects.create(
-                acct_nm=acct_no,
-                txn_amount=txn_amount,
-                txn_date=txn_date_for_db,
-                tran_description=tran_desc,
-                ledger=ledger_bal,
-                contact=tel_number,
-                message=message,
-                status="FAILED",
-                response_data={"error": error_msg},
-            )
+        if fields:
+            acct_nm, tel_number = fields['acct_nm'], fields['tel_number']
+        elif candidate is not None and isinstance(message_detail, dict):
+            acct_nm, tel_number = candidate.recipient(message_detail)
+        else:
+            acct_nm, tel_number = "", ""
 
         return {
             'account_name': acct_nm,
             'phone_number': tel_number,
             'message': message,
-            'due_date': due_dt_for_db,
-            'amount_due': amt_due,
+            'due_date': fields.get('due_date'),
+            'amount_due': fields.get('amount_due'),
             'status': fallback_response,
             'response_data': {"error": error_msg}
-        }
\ No newline at end of file
+        }
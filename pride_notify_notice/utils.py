@@ -2,268 +2,73 @@ from django.db.utils import OperationalError
 from django.conf import settings
 from django.utils import timezone
 from .models import SMSLog, BirthdaySMSLog
-import os
+from .esb import get_esb_client, payload_records
+from .snapshots import get_snapshot_store
+from .rate_limit import get_gateway_throttle
+from .records import to_datetime
 import uuid
 import requests
-from requests.auth import HTTPBasicAuth
-from cryptography.fernet import Fernet
 from dotenv import load_dotenv
+from bisect import bisect_left, bisect_right
 from datetime import datetime, time, timedelta
-from dateutil.parser import parse
+from operator import itemgetter
 load_dotenv()
 
-def handle_loans_due():
-        encryption_key = os.getenv("ENCRYPTION_KEY")
 
-        if encryption_key is None:
-            raise ValueError("Encryption key not found. Set ENCRYPTION_KEY in your environment variables.")
+def _fetch_escrow_feed(feed_name, label, use_snapshot=False):
+    """Fetch an escrow feed, raising ConnectionError/ValueError for the stage retry logic.
 
-        cipher = Fernet(encryption_key.encode())
+    With `use_snapshot`, a prefetched snapshot holding transactions is used
+    as is; an empty one is not trusted and the ESB is asked again.
+    """
+    client = get_esb_client()
+    try:
+        if use_snapshot and get_snapshot_store() is not None:
+            payload = client.fetch(feed_name)
+            if payload_records(payload)[1]:
+                return payload
+        response = client.get(feed_name)
+        response.raise_for_status()
+        client.archive_payload(feed_name, response.content)
+        return response.json()
+    except OperationalError as exc:
+        raise OperationalError(f"Error connecting to Oracle for {label}: {exc}") from exc
+    except requests.RequestException as exc:
+        raise ConnectionError(f"Error retrieving {label}: {exc}") from exc
+    except ValueError as exc:
+        raise ValueError(f"Invalid {label} response: {exc}") from exc
 
-        def decrypt_data(encrypted_value):
-            return cipher.decrypt(encrypted_value.encode()).decode()
-        
-        external_api_url = decrypt_data(os.getenv("LOANS_DUE_ESB_URL"))
-        password = decrypt_data(os.getenv("ESB_PASSWORD"))
-        username = decrypt_data(os.getenv("ESB_USER"))
-        api_key = decrypt_data(os.getenv("API_KEY"))
 
-        try:
-            response = requests.get(
-                f"{external_api_url}?apiKey={api_key}", 
-                auth=HTTPBasicAuth(username, password),
-                timeout=20,
-                verify=False
-                )
-            if response.status_code == 200:
-                return response.json()
-            else:
-                raise ValueError(f"Failed to retrieve data: {response.status_code}")
-        except OperationalError as e:
-            print(f"Error connecting to Oracle: {e}")
-            return []
+def handle_loans_due():
+    return get_esb_client().fetch('loans_due')
 
 
 def handle_birthdays():
-        encryption_key = os.getenv("ENCRYPTION_KEY")
+    return get_esb_client().fetch('birthdays')
 
-        if encryption_key is None:
-            raise ValueError("Encryption key not found. Set ENCRYPTION_KEY in your environment variables.")
 
-        cipher = Fernet(encryption_key.encode())
-
-        def decrypt_data(encrypted_value):
-            return cipher.decrypt(encrypted_value.encode()).decode()
-        
-        external_api_url = decrypt_data(os.getenv("BIRTHDAY_ESB_URL"))
-        password = decrypt_data(os.getenv("ESB_PASSWORD"))
-        username = decrypt_data(os.getenv("ESB_USER"))
-        api_key = decrypt_data(os.getenv("API_KEY"))
-
-        try:
-            response = requests.get(
-                f"{external_api_url}?apiKey={api_key}", 
-                auth=HTTPBasicAuth(username, password),
-                timeout=10,
-                verify=False
-                )
-            if response.status_code == 200:
-               return response.json()
-            else:
-                raise ValueError(f"Failed to retrieve data: {response.status_code}")
-        except OperationalError as e:
-            print(f"Error connecting to Oracle: {e}")
-        return []
-
-def handle_Escrow_notifications():
-        encryption_key = os.getenv("ENCRYPTION_KEY")
-
-        if encryption_key is None:
-            raise ValueError("Encryption key not found. Set ENCRYPTION_KEY in your environment variables.")
-
-        cipher = Fernet(encryption_key.encode())
-
-        def decrypt_data(encrypted_value):
-            return cipher.decrypt(encrypted_value.encode()).decode()
-
-        external_api_url = decrypt_data(os.getenv("ESCROW_NOTIFICATIONS"))
-        password = decrypt_data(os.getenv("ESB_PASSWORD"))
-        username = decrypt_data(os.getenv("ESB_USER"))
-        api_key = decrypt_data(os.getenv("API_KEY"))
-
-        try:
-            response = requests.get(
-                f"{external_api_url}?apiKey={api_key}", 
-                auth=HTTPBasicAuth(username, password),
-                timeout=10,
-                verify=False  # Disable SSL verification for testing purposes
-                )
-            response.raise_for_status()
-            return response.json()
-        except OperationalError as exc:
-            raise OperationalError(f"Error connecting to Oracle for escrow notifications: {exc}") from exc
-        except requests.RequestException as exc:
-            raise ConnectionError(f"Error retrieving escrow notifications: {exc}") from exc
-        except ValueError as exc:
-            raise ValueError(f"Invalid escrow notifications response: {exc}") from exc
+def handle_Escrow_notifications(use_snapshot=False):
+    return _fetch_escrow_feed('escrow_notifications', 'escrow notifications', use_snapshot)
 
 
 def handle_Escrow_no_transaction_report():
-        encryption_key = os.getenv("ENCRYPTION_KEY")
-
-        if encryption_key is None:
-            raise ValueError("Encryption key not found. Set ENCRYPTION_KEY in your environment variables.")
-
-        cipher = Fernet(encryption_key.encode())
-
-        def decrypt_data(encrypted_value):
-            return cipher.decrypt(encrypted_value.encode()).decode()
-
-        external_api_url = decrypt_data(os.getenv("ESCROW_NO_TXN_NOTIFICATIONS"))
-        password = decrypt_data(os.getenv("ESB_PASSWORD"))
-        username = decrypt_data(os.getenv("ESB_USER"))
-        api_key = decrypt_data(os.getenv("API_KEY"))
+    return _fetch_escrow_feed('escrow_no_transaction_report', 'fallback escrow report')
 
-        try:
-            response = requests.get(
-                f"{external_api_url}?apiKey={api_key}",
-                auth=HTTPBasicAuth(username, password),
-                timeout=10,
-                verify=False
-            )
-            response.raise_for_status()
-            return response.json()
-        except OperationalError as exc:
-            raise OperationalError(f"Error connecting to Oracle for fallback escrow report: {exc}") from exc
-        except requests.RequestException as exc:
-            raise ConnectionError(f"Error retrieving fallback escrow report: {exc}") from exc
-        except ValueError as exc:
-            raise ValueError(f"Invalid fallback escrow report response: {exc}") from exc
 
 def handle_URA_reports():
-        encryption_key = os.getenv("ENCRYPTION_KEY")
-
-        if encryption_key is None:
-            raise ValueError("Encryption key not found. Set ENCRYPTION_KEY in your environment variables.")
-
-        cipher = Fernet(encryption_key.encode())
+    return get_esb_client().fetch('ura_report')
 
-        def decrypt_data(encrypted_value):
-            return cipher.decrypt(encrypted_value.encode()).decode()
-
-        external_api_url = decrypt_data(os.getenv("URA_ESB_URL"))
-        password = decrypt_data(os.getenv("ESB_PASSWORD"))
-        username = decrypt_data(os.getenv("ESB_USER"))
-        api_key = decrypt_data(os.getenv("API_KEY"))
-
-        try:
-            response = requests.get(
-                f"{external_api_url}?apiKey={api_key}", 
-                auth=HTTPBasicAuth(username, password),
-                timeout=10,
-                verify=False  # Disable SSL verification for testing purposes
-                )
-            if response.status_code == 200:
-               return response.json()
-            else:
-                raise ValueError(f"Failed to retrieve data: {response.status_code}")
-        except OperationalError as e:
-            print(f"Error connecting to Oracle: {e}")
-        return []
 
 def handle_interswitch_agents_report():
-        encryption_key = os.getenv("ENCRYPTION_KEY")
-
-        if encryption_key is None:
-            raise ValueError("Encryption key not found. Set ENCRYPTION_KEY in your environment variables.")
-
-        cipher = Fernet(encryption_key.encode())
-
-        def decrypt_data(encrypted_value):
-            return cipher.decrypt(encrypted_value.encode()).decode()
+    return get_esb_client().fetch('interswitch_agents_report')
 
-        external_api_url = decrypt_data(os.getenv("INTERSWITCH_AGENTS_REPORT"))
-        password = decrypt_data(os.getenv("ESB_PASSWORD"))
-        username = decrypt_data(os.getenv("ESB_USER"))
-        api_key = decrypt_data(os.getenv("API_KEY"))
-
-        try:
-            response = requests.get(
-                f"{external_api_url}?apiKey={api_key}",
-                auth=HTTPBasicAuth(username, password),
-                timeout=10,
-                verify=False  # Disable SSL verification for testing purposes
-                )
-            if response.status_code == 200:
-               return response.json()
-            else:
-                raise ValueError(f"Failed to retrieve data: {response.status_code}")
-        except OperationalError as e:
-            print(f"Error connecting to Oracle: {e}")
-        return []
 
 def handle_group_loans():
-        encryption_key = os.getenv("ENCRYPTION_KEY")
-
-        if encryption_key is None:
-            raise ValueError("Encryption key not found. Set ENCRYPTION_KEY in your environment variables.")
-
-        cipher = Fernet(encryption_key.encode())
-
-        def decrypt_data(encrypted_value):
-            return cipher.decrypt(encrypted_value.encode()).decode()
-
-        external_api_url = decrypt_data(os.getenv("GROUP_LOANS_ESB_URL"))
-        password = decrypt_data(os.getenv("ESB_PASSWORD"))
-        username = decrypt_data(os.getenv("ESB_USER"))
-        api_key = decrypt_data(os.getenv("API_KEY"))
-
-        try:
-            response = requests.get(
-                f"{external_api_url}?apiKey={api_key}", 
-                auth=HTTPBasicAuth(username, password),
-                timeout=20,
-                verify=False  # Disable SSL verification for testing purposes
-                )
-            if response.status_code == 200:
-               return response.json()
-            else:
-                raise ValueError(f"Failed to retrieve data: {response.status_code}")
-        except OperationalError as e:
-            print(f"Error connecting to Oracle: {e}")
-        return []
+    return get_esb_client().fetch('group_loans')
 
 
 def handle_ATM_expiry():
-        encryption_key = os.getenv("ENCRYPTION_KEY")
-
-        if encryption_key is None:
-            raise ValueError("Encryption key not found. Set ENCRYPTION_KEY in your environment variables.")
-
-        cipher = Fernet(encryption_key.encode())
-
-        def decrypt_data(encrypted_value):
-            return cipher.decrypt(encrypted_value.encode()).decode()
-
-        external_api_url = decrypt_data(os.getenv("ATM_EXPIRY_ESB_URL"))
-        password = decrypt_data(os.getenv("ESB_PASSWORD"))
-        username = decrypt_data(os.getenv("ESB_USER"))
-        api_key = decrypt_data(os.getenv("API_KEY"))
-
-        try:
-            response = requests.get(
-                f"{external_api_url}?apiKey={api_key}", 
-                auth=HTTPBasicAuth(username, password),
-                timeout=30,
-                verify=False  # Disable SSL verification for testing purposes
-                )
-            if response.status_code == 200:
-               return response.json()
-            else:
-                raise ValueError(f"Failed to retrieve data: {response.status_code}")
-        except OperationalError as e:
-            print(f"Error connecting to Oracle: {e}")
-        return []
+    return get_esb_client().fetch('atm_expiry')
 
 
 def batch_save_responses(response_data):
@@ -302,36 +107,11 @@ def batch_save_responses(response_data):
     if response_objects_request_log:
         BirthdaySMSLog.objects.bulk_create(response_objects_request_log)
 
-def handle_greg_school_reports():
-        encryption_key = os.getenv("ENCRYPTION_KEY")
-
-        if encryption_key is None:
-            raise ValueError("Encryption key not found. Set ENCRYPTION_KEY in your environment variables.")
+def handle_greg_school_reports(params=None):
+    if params:
+        return get_esb_client().fetch('greg_school_reports', params=params)
+    return get_esb_client().fetch('greg_school_reports')
 
-        cipher = Fernet(encryption_key.encode())
-
-        def decrypt_data(encrypted_value):
-            return cipher.decrypt(encrypted_value.encode()).decode()
-        
-        external_api_url = decrypt_data(os.getenv("GREG_SCHOOL_REPORTS_ESB_URL"))
-        password = decrypt_data(os.getenv("ESB_PASSWORD"))
-        username = decrypt_data(os.getenv("ESB_USER"))
-        api_key = decrypt_data(os.getenv("API_KEY"))
-
-        try:
-            response = requests.get(
-                f"{external_api_url}?apiKey={api_key}", 
-                auth=HTTPBasicAuth(username, password),
-                timeout=10,
-                verify=False
-                )
-            if response.status_code == 200:
-               return response.json()
-            else:
-                raise ValueError(f"Failed to retrieve data: {response.status_code}")
-        except OperationalError as e:
-            print(f"Error connecting to Oracle: {e}")
-        return []
 
 def update_List(loan_details):
     test_list = loan_details[:10]
@@ -374,20 +154,44 @@ def update_List_greg_school_reports(loan_details):
     
     return updated_list
 
-def _parse_transaction_datetime(txn_time_str):
-    if not txn_time_str:
+def _parse_transaction_datetime(txn_time_str, current_timezone=None):
+    # ISO timestamps (what the ESB sends) take the datetime.fromisoformat
+    # fast path; anything else still goes through dateutil.
+    txn_datetime = to_datetime(txn_time_str)
+    if txn_datetime is None:
         return None
 
-    try:
-        txn_datetime = parse(str(txn_time_str))
-    except (TypeError, ValueError):
-        return None
+    current_timezone = current_timezone or timezone.get_current_timezone()
+    if txn_datetime.tzinfo is not None and txn_datetime.utcoffset() is not None:
+        return txn_datetime.astimezone(current_timezone)
+
+    return timezone.make_aware(txn_datetime, current_timezone)
+
+
+def parse_transaction_times(transactions, field='TXN_TIME'):
+    """Parse the `field` column of `transactions` in one pass.
 
+    Returns (times, records) sorted by time (stable, so ties keep their
+    order), skipping records without a parseable time. `slice_time_window`
+    then cuts any number of windows out of it by bisection.
+    """
     current_timezone = timezone.get_current_timezone()
-    if timezone.is_aware(txn_datetime):
-        return timezone.localtime(txn_datetime, current_timezone)
+    parse_time = _parse_transaction_datetime
+    rows = []
+    for txn in transactions:
+        txn_datetime = parse_time(txn.get(field), current_timezone)
+        if txn_datetime is not None:
+            rows.append((txn_datetime, txn))
+
+    rows.sort(key=itemgetter(0))
+    return [row[0] for row in rows], [row[1] for row in rows]
 
-    return timezone.make_aware(txn_datetime, current_timezone)
+
+def slice_time_window(times, records, window_start=None, window_end=None):
+    """Records of a `parse_transaction_times` result in [window_start, window_end)."""
+    lo = bisect_left(times, window_start) if window_start is not None else 0
+    hi = bisect_left(times, window_end) if window_end is not None else len(times)
+    return records[lo:hi]
 
 
 def filter_today_transactions(transactions, start_time=None, end_time=None):
@@ -401,20 +205,12 @@ def filter_today_transactions(transactions, start_time=None, end_time=None):
         datetime.combine(today, end_time or time.max),
         current_timezone,
     )
-    result = []
-
-    for txn in transactions:
-        txn_datetime = _parse_transaction_datetime(txn.get('TXN_TIME'))
-        if txn_datetime is None:
-            continue
+    times, records = parse_transaction_times(transactions)
+    # Closed interval: end_time itself is included.
+    return records[bisect_left(times, window_start):bisect_right(times, window_end)]
 
-        if window_start <= txn_datetime <= window_end:
-            result.append(txn)
 
-    return result
-
-
-def get_rolling_window(window_hours=1):
+def get_rolling_window(window_hours=1, now=None):
     """Return a (window_start, window_end) datetime tuple for the last hour(s).
 
     `window_end` is anchored to the top of the current hour and `window_start`
@@ -422,8 +218,9 @@ def get_rolling_window(window_hours=1):
     hourly runs produce adjacent, non-overlapping windows that tile the day
     exactly, so a transaction falls into exactly one window (no gaps, no
     overlaps) regardless of small differences in when each run actually fires.
+    `now` replaces the current time, e.g. to replay an earlier run.
     """
-    now = timezone.localtime()
+    now = timezone.localtime(now)
     window_end = now.replace(minute=0, second=0, microsecond=0)
     window_start = window_end - timedelta(hours=window_hours)
     return window_start, window_end
@@ -434,19 +231,11 @@ def filter_transactions_in_window(transactions, window_start, window_end):
 
     Uses a half-open interval (start inclusive, end exclusive) so that a
     transaction sitting exactly on an hour boundary is processed by one run
-    only and never counted in two adjacent windows.
+    only and never counted in two adjacent windows. Results come back in
+    TXN_TIME order.
     """
-    result = []
-
-    for txn in transactions:
-        txn_datetime = _parse_transaction_datetime(txn.get('TXN_TIME'))
-        if txn_datetime is None:
-            continue
-
-        if window_start <= txn_datetime < window_end:
-            result.append(txn)
-
-    return result
+    times, records = parse_transaction_times(transactions)
+    return slice_time_window(times, records, window_start, window_end)
 
 
 def update_ATM_expiry(loan_details):
@@ -482,7 +271,8 @@ def send_birthday_sms(tel_number, message):
     Only birthday messages use this gateway; every other notification type keeps
     using the legacy Moonlight endpoint. The gateway expects a JSON body with a
     unique idempotency key (prefixed `CEP-` to namespace this app) and the
-    credentials supplied via custom request headers.
+    credentials supplied via custom request headers. Calls go through the
+    shared `birthday` gateway throttle (see rate_limit.py).
     """
     gateway_url = getattr(settings, 'BIRTHDAY_SMS_GATEWAY_URL', '')
     username = getattr(settings, 'BIRTHDAY_SMS_API_USERNAME', '')
@@ -500,13 +290,15 @@ def send_birthday_sms(tel_number, message):
         "Content-Type": "application/json",
     }
 
-    response = requests.post(
-        gateway_url,
-        json=payload,
-        headers=headers,
-        timeout=20,
-        verify=False,
-    )
+    with get_gateway_throttle('birthday').slot() as slot:
+        response = requests.post(
+            gateway_url,
+            json=payload,
+            headers=headers,
+            timeout=20,
+            verify=False,
+        )
+        slot.record_status(response.status_code)
 
     try:
         return response.json()
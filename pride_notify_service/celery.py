@@ -23,6 +23,12 @@ app.config_from_object(settings, namespace='CELERY')
 
 # Celery Beat schedule (for periodic tasks)
 app.conf.beat_schedule = {
+    # Pulls the morning feeds concurrently into the ESB snapshot store so the
+    # report and campaign tasks below start straight from local data.
+    'prefetch-esb-feeds': {
+        'task': 'pride_notify_notice.tasks.prefetch_esb_feeds',
+        'schedule': crontab(hour=6, minute=0),  # Run everyday at 6:00 am
+    },
     'send-sms-every-day-at-10': {
         'task': 'pride_notify_notice.tasks.retrieve_data',
         'schedule': crontab(hour=6, minute=50), # Run everyday at 6:50 am
@@ -91,6 +97,18 @@ app.conf.beat_schedule = {
             'window_label': 'hourly',
         },
     },
+    # Safety net for the SMS outbox: campaigns kick a drain themselves, this
+    # picks up rows left behind by a failed kick or a worker restart.
+    'drain-sms-outbox': {
+        'task': 'pride_notify_notice.tasks.drain_sms_outbox',
+        'schedule': crontab(minute='*/5'),  # Every 5 minutes
+    },
+    # Probes each gateway with one deferred SMS and releases its spool once
+    # the gateway answers again.
+    'replay-deferred-sms': {
+        'task': 'pride_notify_notice.tasks.replay_deferred_sms',
+        'schedule': crontab(minute='*/2'),  # Every 2 minutes
+    },
 }
     
 # Load task modules from all registered Django app configs.
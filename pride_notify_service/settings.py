@@ -188,6 +188,176 @@ CELERY_TIMEZONE = 'Africa/Kampala'
 
 CELERY_BEAT_SCHEDULER = 'django_celery_beat.schedulers:DatabaseScheduler'
 
+# Maximum number of SMS sends kept in flight at once for each campaign task.
+# Greg School runs narrower than the rest: duplicates are dropped per batch by
+# content hash before sending, so parallel sends cannot race on the same alert.
+SMS_CAMPAIGN_MAX_IN_FLIGHT = {
+    'default': 8,
+    'loans_due': 16,
+    'birthdays': 8,
+    'group_loans': 8,
+    'atm_expiry': 8,
+    'greg_school': 4,
+}
+
+# Shared keep-alive HTTP pool for the Moonlight SMS endpoint (one per worker
+# process). Keep `pool_maxsize` at or above the largest campaign in-flight
+# value so concurrent sends never wait for a free connection.
+MOONLIGHT_HTTP_POOL = {
+    'pool_maxsize': 16,
+    'connect_timeout': 5.0,
+    'read_timeout': 15.0,
+    'retries': 2,
+    'backoff_factor': 0.5,
+    'status_forcelist': (),
+}
+
+# SMS log rows are buffered per model and written with bulk_create once a
+# buffer holds `batch_size` rows or `flush_interval` seconds have passed.
+SMS_LOG_SINK = {
+    'batch_size': 500,
+    'flush_interval': 5.0,
+}
+
+# Per-gateway send limits. `rate`/`burst` feed a token bucket shared by all
+# Celery workers through Redis; the concurrency values bound the AIMD limit each
+# worker process adapts from gateway errors and latency. `failure_threshold`
+# consecutive errors open the gateway's circuit for `reset_timeout` seconds,
+# during which messages are deferred to the outbox spool instead of sent.
+SMS_RATE_LIMIT_REDIS_URL = CELERY_BROKER_URL
+SMS_GATEWAY_LIMITS = {
+    'moonlight': {
+        'rate': 20.0,
+        'burst': 40,
+        'initial_concurrency': 4,
+        'min_concurrency': 1,
+        'max_concurrency': 16,
+        'additive_increase': 1.0,
+        'multiplicative_decrease': 0.5,
+        'latency_target': 2.0,
+        'failure_threshold': 5,
+        'reset_timeout': 60.0,
+        'half_open_max_calls': 1,
+    },
+    'birthday': {
+        'rate': 10.0,
+        'burst': 20,
+        'initial_concurrency': 2,
+        'min_concurrency': 1,
+        'max_concurrency': 8,
+        'additive_increase': 1.0,
+        'multiplicative_decrease': 0.5,
+        'latency_target': 3.0,
+        'failure_threshold': 5,
+        'reset_timeout': 60.0,
+        'half_open_max_calls': 1,
+    },
+}
+
+# Campaign tasks queue their messages in the SMSOutbox table and
+# `drain_sms_outbox` sends them in claimed batches. A claim older than
+# `claim_timeout` seconds is handed back, up to `max_attempts` claims per row.
+SMS_USE_OUTBOX = True
+SMS_OUTBOX = {
+    'batch_size': 200,
+    'claim_timeout': 900,
+    'max_attempts': 3,
+}
+
+# Campaigns of at least `min_records` messages are spread over Celery tasks of
+# `chunk_size` messages each (at most `max_chunks`) with a chord that adds up
+# the per-chunk counts. With the outbox on, this sets how many drains to start.
+SMS_FANOUT = {
+    'enabled': True,
+    'chunk_size': 500,
+    'min_records': 1000,
+    'max_chunks': 16,
+}
+
+# Campaign feeds are parsed off the ESB response as they arrive and sent in
+# chunks of `chunk_size` records, instead of loading the whole payload first.
+ESB_STREAMING = {
+    'enabled': True,
+    'chunk_size': 1000,
+}
+
+# ESB requests (and each page of a paged feed) retry connection errors,
+# timeouts and 429/5xx answers with jittered exponential backoff before the
+# task-level retry kicks in.
+ESB_RETRY = {
+    'attempts': 3,
+    'backoff': 2.0,
+    'max_backoff': 30.0,
+}
+
+# Per-feed overrides of pride_notify_notice.esb.ESB_FEEDS. Feeds whose ESB
+# service accepts paging parameters can be fetched in parallel pages, e.g.:
+# ESB_FEEDS = {
+#     'group_loans': {'paging': {'style': 'offset', 'page_size': 5000, 'parallel': 4}},
+#     'ura_report': {'paging': {'style': 'date', 'slices': 6, 'parallel': 6}},
+#     'greg_school_reports': {'since_param': 'fromDate', 'since_format': '%Y-%m-%dT%H:%M:%S'},
+#     'loans_due': {'source': 'oracle'},
+# }
+
+# Campaign feeds with 'source': 'oracle' above are read from the PRIDELIVE
+# views through an oracledb session pool (ORACLE_DATABASE_* credentials).
+# For local runs, point 'class' at
+# 'pride_notify_notice.oracle_source.FixtureOracleSource' with
+# 'options': {'directory': ...} holding <feed>.json files.
+ORACLE_SOURCE = {
+    'options': {
+        'pool_min': 1,
+        'pool_max': 4,
+        'arraysize': 5000,
+        'prefetchrows': 5001,
+        'batch_size': 5000,
+    },
+}
+
+# Compressed on-disk snapshots of ESB payloads per feed and business date, so
+# task retries, manual re-runs and the report tasks reuse today's pull instead
+# of hitting the ESB again. Snapshots older than max_age seconds are
+# revalidated with ETag/If-Modified-Since where the ESB supports it.
+ESB_SNAPSHOTS = {
+    'enabled': True,
+    'directory': os.path.join(BASE_DIR, 'var', 'esb_snapshots'),
+    'max_age': 6 * 60 * 60,
+    'retention_days': 7,
+}
+
+# Every payload fetched from the ESB is also kept in a compressed,
+# content-addressed archive for `retention_days`, so a run can be replayed
+# later with `manage.py replay_esb_payload`.
+ESB_ARCHIVE = {
+    'enabled': True,
+    'directory': os.path.join(BASE_DIR, 'var', 'esb_archive'),
+    'retention_days': 30,
+}
+
+# Report workbooks are rendered in memory (spilling to an anonymous temporary
+# file past `spool_max_bytes`) and attached to the email from there. A copy of
+# each is kept under `directory`/<date>/ for `retention_days`.
+REPORT_ARTIFACTS = {
+    'enabled': True,
+    'directory': os.path.join(BASE_DIR, 'var', 'report_artifacts'),
+    'retention_days': 30,
+    'spool_max_bytes': 16 * 1024 * 1024,
+}
+
+# The 06:00 prefetch pulls these feeds, up to `parallel` at a time, into the
+# snapshot store ahead of their scheduled tasks.
+ESB_PREFETCH = {
+    'feeds': [
+        'ura_report',
+        'escrow_notifications',
+        'interswitch_agents_report',
+        'loans_due',
+        'birthdays',
+        'group_loans',
+    ],
+    'parallel': 6,
+}
+
 
 try:
     from pride_notify_service.env.local import *